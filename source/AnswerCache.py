@@ -0,0 +1,159 @@
+"""
+This module implements a cache for the answers given by the bot, so that questions
+that are asked over and over do not go through the whole answering pipeline.
+"""
+import re
+from collections import OrderedDict
+from threading import Lock
+
+class AnswerCache:
+    """
+    A LRU cache that maps normalized questions to answers.
+
+    Each answer is recorded together with the entities (BabelNet IDs) that were
+    involved in computing it, so that it can be invalidated as soon as the Knowledge
+    Graph changes around any of them. An answer computed while some of its entities
+    were being invalidated is not stored (see `lookup` and `store`).
+    """
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        # normalized question -> (answer, entity IDs), in LRU order
+        self._entries = OrderedDict()
+        # entity ID -> set of normalized questions whose answer involves it
+        self._questions_by_entity = dict()
+        # number of invalidations so far, and entity ID -> number of the last
+        # invalidation that involved it
+        self._generation = 0
+        self._invalidated_at = dict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def normalize(question):
+        """
+        Transform a question in the canonical form used as cache key, so that
+        trivial differences in case, spacing and punctuation do not cause misses.
+        """
+        question = re.sub(r"\s+", " ", question.strip().lower())
+        question = re.sub(r" ([?.!,])", r"\1", question)
+        return question.rstrip("?.! ")
+
+    def lookup(self, question):
+        """
+        Search the cache for the answer to a question.
+
+        Parameters:
+        -----------
+            - `question`: the question asked.
+        
+        Returns:
+        --------
+        A triple (found, answer, token), where `found` tells whether the question was
+        in the cache. Note that `answer` can be `None` even if `found` is True, when the
+        question is known to have no answer. `token` must be passed to `store` along
+        with the answer computed after a miss.
+        """
+        key = AnswerCache.normalize(question)
+        with self._lock:
+            try:
+                answer, _ = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return False, None, self._generation
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, answer, self._generation
+
+    def store(self, question, answer, entity_ids, token=None):
+        """
+        Add the answer to a question to the cache.
+
+        Parameters:
+        -----------
+            - `question`: the question asked.
+            - `answer`: the answer computed for `question`.
+            - `entity_ids`: the BabelNet IDs of the entities involved in the answer.
+            - `token`: the token returned by the `lookup` made before computing the
+            answer. If any of the entities has been invalidated since, the answer
+            may be stale and it is not stored.
+        
+        Returns:
+        --------
+        Nothing
+        """
+        key = AnswerCache.normalize(question)
+        entity_ids = frozenset(entity_ids)
+        with self._lock:
+            if token is not None and any(self._invalidated_at.get(ent, 0) > token for ent in entity_ids):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (answer, entity_ids)
+            for ent in entity_ids:
+                try:
+                    self._questions_by_entity[ent].add(key)
+                except KeyError:
+                    self._questions_by_entity[ent] = {key}
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_entities(self, entity_ids):
+        """
+        Remove from the cache all the answers that involve any of the given entities.
+
+        Parameters:
+        -----------
+            - `entity_ids`: iterable of BabelNet IDs of entities that changed.
+        
+        Returns:
+        --------
+        The number of answers removed.
+        """
+        removed = 0
+        with self._lock:
+            self._generation += 1
+            for ent in entity_ids:
+                self._invalidated_at[ent] = self._generation
+                for key in list(self._questions_by_entity.get(ent, ())):
+                    self._remove(key)
+                    removed += 1
+            self.invalidations += removed
+        return removed
+
+    def _remove(self, key):
+        """
+        Remove an entry and its references from the entity index. The caller must
+        hold the lock.
+        """
+        _, entity_ids = self._entries.pop(key)
+        for ent in entity_ids:
+            questions = self._questions_by_entity[ent]
+            questions.discard(key)
+            if len(questions) == 0:
+                del self._questions_by_entity[ent]
+
+    def hit_rate(self):
+        """
+        returns the fraction of lookups that found the question in the cache.
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0
+
+    def stats(self):
+        """
+        returns a dictionary with the cache counters.
+        """
+        return {
+            'size' : len(self._entries),
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'hit_rate' : self.hit_rate(),
+            'evictions' : self.evictions,
+            'invalidations' : self.invalidations
+        }
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,15 +1,31 @@
 """
     This module implements communication functions with BabelFy application.
 """
+import logging
 import urllib3
 import json
 from bs4 import BeautifulSoup
+import Metrics
 from Settings import BabelNetKEY as key
 
+logger = logging.getLogger(__name__)
+
 lang = "EN"
 # pool handles http connections
 pool = urllib3.PoolManager()
 
+# service endpoints, they can be changed with set_endpoints (e.g. to use a local stub)
+babelfy_url = "https://babelfy.io/v1/disambiguate"
+babelnet_url = "https://babelnet.io/v4/getSynsetIds"
+
+def set_endpoints(babelfy, babelnet):
+    """
+    Change the URLs of the BabelFy disambiguation and BabelNet synset ID services.
+    """
+    global babelfy_url, babelnet_url
+    babelfy_url = babelfy
+    babelnet_url = babelnet
+
 def get_annotations(text):
     """
     get BabelFy annotations from a text.
@@ -22,7 +38,8 @@ def get_annotations(text):
     --------
     A list of dictionaries, where each dictionary is an annotation.
     """
-    js = pool.request('GET',"https://babelfy.io/v1/disambiguate", {'text':text, 'lang':lang, 'key':key}).data.decode(errors='ignore')
+    with Metrics.timer('babelfy_disambiguate_seconds', "Duration of the BabelFy disambiguation requests"):
+        js = pool.request('GET', babelfy_url, {'text':text, 'lang':lang, 'key':key}).data.decode(errors='ignore')
     return parse_json(js, text)
 
 def get_id(text):
@@ -37,8 +54,9 @@ def get_id(text):
     --------
     A Babelnet ID.
     """
-    js = pool.request('GET',"https://babelnet.io/v4/getSynsetIds", {'word':text, 'langs':lang, 'key':key}).data.decode(errors='ignore')
-    print(js)
+    with Metrics.timer('babelnet_synset_ids_seconds', "Duration of the BabelNet synset ID requests"):
+        js = pool.request('GET', babelnet_url, {'word':text, 'langs':lang, 'key':key}).data.decode(errors='ignore')
+    logger.debug("BabelNet response: %s", js)
     try:
         return json.loads(js)[0]['id']
     except Exception:
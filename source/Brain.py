@@ -1,11 +1,115 @@
 """
     This module implements an interface to intelligent tasks to be performed by the application.
 """
+import logging
+import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor
 import DataAccessManager
-from SentenceAnalysis import extract_entities, sentence_similarity
+import Metrics
+from Profiling import profile_request
+from AnswerCache import AnswerCache
+from SentenceAnalysis import extract_entities, rank_sentences
 from RemoteClassifier import remote_predict
+from LinearClassifier import get_fallback_classifier
+from QuestionPatterns import PatternMatcher
 from Settings import QuestionClassifierServer_Port, QuestionClassifierServer_Host,\
-    questionPatternsByRelation
+    questionPatternsByRelation, questionTemplates, ANSWER_CACHE_SIZE, PIPELINE_WORKERS,\
+    RELATION_MIN_CONFIDENCE, RELATION_PREDICTION_TIMEOUT, RELATION_FIRST_PASS_CONFIDENCE, USE_QUESTION_PATTERNS
+
+# answers to the questions already asked, dropped when the entities involved change
+_answer_cache = AnswerCache(ANSWER_CACHE_SIZE)
+DataAccessManager.add_update_listener(_answer_cache.invalidate_entities)
+
+# recognizes the questions built on the question patterns
+_pattern_matcher = PatternMatcher(questionTemplates)
+
+# runs the relation prediction concurrently with the entity extraction
+_pipeline_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS)
+
+logger = logging.getLogger(__name__)
+
+Metrics.gauge('answer_cache_size', "Number of answers in the answer cache", lambda: len(_answer_cache))
+Metrics.gauge('answer_cache_hits', "Questions answered from the cache", lambda: _answer_cache.hits)
+Metrics.gauge('answer_cache_misses', "Questions not found in the cache", lambda: _answer_cache.misses)
+Metrics.gauge('answer_cache_hit_rate', "Fraction of questions answered from the cache",\
+    lambda: _answer_cache.hit_rate())
+
+def _timed(stage, function, *args, **kwargs):
+    """
+    Call `function(*args, **kwargs)` and record how long it took in the histogram of `stage`.
+    """
+    with Metrics.timer('answer_' + stage + '_seconds', "Duration of the " + stage + " stage of answer_question"):
+        return function(*args, **kwargs)
+
+def _confident_relations(scored_relations):
+    """
+    returns the relations predicted with a probability of at least RELATION_MIN_CONFIDENCE,
+    always including the most probable one.
+
+    Parameters:
+    -----------
+        - `scored_relations`: list of pairs (relation, probability), from the most
+        probable relation.
+    """
+    return [r for i, (r, p) in enumerate(scored_relations) if i == 0 or p >= RELATION_MIN_CONFIDENCE]
+
+def _predict_relations(question):
+    """
+    Predict the 3 most probable relations of a question, with their probability.
+
+    The question classifier server is used, unless the linear classifier is confident
+    enough (RELATION_FIRST_PASS_CONFIDENCE). If the server does not answer within
+    RELATION_PREDICTION_TIMEOUT seconds, the linear classifier is used instead; if
+    there is no linear classifier yet, the server is waited for.
+    """
+    fallback = get_fallback_classifier()
+    if fallback is not None and RELATION_FIRST_PASS_CONFIDENCE > 0:
+        scored_relations = fallback.predict(question, k=3, with_scores=True)
+        if scored_relations[0][1] >= RELATION_FIRST_PASS_CONFIDENCE:
+            Metrics.counter('relation_prediction_first_pass', "Relations predicted by the linear classifier alone").inc()
+            return scored_relations
+    try:
+        return remote_predict(question, QuestionClassifierServer_Host, QuestionClassifierServer_Port,\
+            timeout=(RELATION_PREDICTION_TIMEOUT or None) if fallback is not None else None,\
+            k=3, with_scores=True)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        # not reachable, timed out, or closed the connection (e.g. restarting) before
+        # sending the whole prediction
+        if fallback is None:
+            raise
+        logger.warning("The question classifier did not answer, relations predicted by the linear classifier.")
+        Metrics.counter('relation_prediction_fallbacks',\
+            "Relations predicted by the linear classifier because the server did not answer").inc()
+        return fallback.predict(question, k=3, with_scores=True)
+
+def _match_question_pattern(question):
+    """
+    Find the relations and the entities of a question that matches a question pattern
+    exactly, looking up the entities by name in the Knowledge Graph.
+
+    Returns:
+    --------
+    A pair (relations, entities), with the entities in the format returned by
+    extract_entities, or `None` if the question does not match any pattern or one of
+    its entities is not known (or ambiguous).
+    """
+    match = _pattern_matcher.match(question)
+    if match is None:
+        return None
+    relations, candidates = match
+    # the first way of splitting the question where all the entities are known
+    for spans in candidates:
+        entities = list()
+        # X, the subject of the question, comes first
+        for slot in sorted(spans):
+            bab_id = DataAccessManager.find_entity(spans[slot])
+            if bab_id is None:
+                break
+            entities.append((slot, {'bab_id' : bab_id, 'mention' : spans[slot]}))
+        else:
+            return relations, entities
+    return None
 
 def analize_answer(answer, c1):
     """
@@ -27,19 +131,19 @@ def analize_answer(answer, c1):
     """
     annotations_with_dep = extract_entities(answer)
     if len(annotations_with_dep) == 0:
-        print("No entities!")
+        logger.debug("No entities!")
         return None
 
     elif len(annotations_with_dep) == 1:
         # there is only one entity, it must be that
-        print('Concept chosen from answer:', annotations_with_dep[0][1]['mention'])
+        logger.debug("Concept chosen from answer: %s", annotations_with_dep[0][1]['mention'])
         return annotations_with_dep[0][1]['bab_id'], annotations_with_dep[0][1]['mention']
 
     else:
         candidates = list()
         for dependency, annotation in annotations_with_dep:
             if 'obj' in dependency  and annotation['bab_id'] != c1:
-                print('Concept chosen from asnwer:', annotation['mention'])
+                logger.debug("Concept chosen from answer: %s", annotation['mention'])
                 return annotation['bab_id'], annotation['mention']
 
 
@@ -47,10 +151,16 @@ def answer_question(question):
     """
     return the answer to a question.
 
-    This function performs the following steps:
-        * first, it predicts the relation involved by looking at the question. It does so
-        using a machine learning classifier that is hosted on a server (in another process).
-        * then, it extracts entities from the question
+    Answers are cached: if the same question (up to case, spacing and punctuation)
+    was already answered and the entities involved did not change since, the cached
+    answer is returned. If the question matches a question pattern exactly and its
+    entities are known by name, the relations of the pattern and those entities are
+    used to search the Knowledge Graph directly. Otherwise, this function performs the
+    following steps:
+        * it predicts the relation involved by looking at the question. It does so
+        using a machine learning classifier that is hosted on a server (in another process),
+        or a linear classifier in this process if the server does not answer in time.
+        * at the same time, it extracts entities from the question
         * lastly, it uses the information gathered to search the Knowledge Graph for the best
         answer.
     
@@ -62,46 +172,82 @@ def answer_question(question):
     --------
     `None` if no answer can be found, a string containing the answer otherwise.
     """
-    print("answering a question..")
-    top3relations = remote_predict(question, QuestionClassifierServer_Host, QuestionClassifierServer_Port)
-    entities = extract_entities(question)
-    if len(entities) == 0:
-        print("No entities in the question.")
-        return None #No entities
-    database_entries = DataAccessManager.query_knowledge_graph(entities, top3relations)
-    print("Relations predicted out of the question:", top3relations)
-    print("Entities extracted:", entities)
+    # requests coming from a chat are profiled by Chatbot, with the chat ID
+    with profile_request('-', 'ANSWER_QUESTION'):
+        return _answer_question(question)
+
+def _answer_question(question):
+    """
+    Implementation of answer_question.
+    """
+    found, answer, cache_token = _answer_cache.lookup(question)
+    if found:
+        logger.debug("answer found in cache.")
+        return answer
 
+    logger.debug("answering a question..")
+    database_entries = list()
+    if USE_QUESTION_PATTERNS:
+        pattern_match = _timed('pattern_matching', _match_question_pattern, question)
+        if pattern_match is not None:
+            relations, entities = pattern_match
+            database_entries = _timed('graph_query', DataAccessManager.query_knowledge_graph, entities, relations)
+            logger.debug("Question pattern matched, relations: %s, entities: %s", relations, entities)
+            Metrics.counter('answer_pattern_matches_total', "Questions that matched a question pattern").inc()
+
+    if len(database_entries) == 0:
+        # the two stages are independent: one waits for the classifier process, the
+        # other for spaCy and BabelFy. Run them concurrently.
+        start = time.perf_counter()
+        relations_future = _pipeline_executor.submit(_timed, 'relation_prediction', _predict_relations, question)
+        entities = _timed('entity_extraction', extract_entities, question)
+        if len(entities) == 0:
+            logger.debug("No entities in the question.")
+            # the relations are not needed: free the pipeline thread if the prediction
+            # has not started yet (otherwise its result is just ignored)
+            relations_future.cancel()
+            return None #No entities
+        scored_relations = relations_future.result()
+        Metrics.histogram('answer_prediction_and_extraction_seconds',\
+            "Duration of relation prediction and entity extraction, run concurrently").observe(time.perf_counter() - start)
+        relations = _confident_relations(scored_relations)
+        database_entries = _timed('graph_query', DataAccessManager.query_knowledge_graph, entities, relations)
+        logger.debug("Relations predicted out of the question: %s, used: %s", scored_relations, relations)
+        logger.debug("Entities extracted: %s", entities)
+
+    entity_ids = [annotation['bab_id'] for _, annotation in entities]
     if len(database_entries) == 0:
-        print("Entities in the question were not found in the Knowledge Graph")
+        logger.debug("Entities in the question were not found in the Knowledge Graph")
+        _answer_cache.store(question, None, entity_ids, cache_token)
         return None
     
     # get the most similar question according to "sentence similarity"
-    chonsen_entry = None
-    max_sim = -1
-    for entry in database_entries:
-        entry_answer = entry['answer']
-        entry_question = entry['question']
-        s = sentence_similarity(question, entry_question)
-        if s > max_sim:
-            max_sim = s
-            chonsen_entry = entry
+    ranking = _timed('ranking', rank_sentences, question, [entry['question'] for entry in database_entries])
+    chosen_index, max_sim = ranking[0]
+    chonsen_entry = database_entries[chosen_index]
 
     answer = chonsen_entry['answer']
-    print("Dataset entry chosen:", chonsen_entry)
+    logger.debug("Dataset entry chosen: %s", chonsen_entry)
 
     # There are two types of question. One with only one entity, asking for the
     # related one. Another with 2 entities, asking if they are related according
     # to a given relation.
 
-    if len(entities) == 1:
-        return answer
-    else:
+    if len(entities) > 1:
         # must return yes or no
         if 'no' in answer and len(answer) < 5:
-            return "No"
+            answer = "No"
         else:
-            return "Yes"
+            answer = "Yes"
+
+    _answer_cache.store(question, answer, entity_ids, cache_token)
+    return answer
+
+def answer_cache_stats():
+    """
+    returns a dictionary with the counters (hits, misses, hit rate...) of the answer cache.
+    """
+    return _answer_cache.stats()
 
 def _single_ent_question(q):
     if 'Y ' in q or ' Y' in q:
@@ -127,7 +273,7 @@ def ask_question(domain):
         - `relation` is the relation chosen.
     """
     entity_id, entity_id_and_text, relation = DataAccessManager.pick_subject_to_ask_about(domain)
-    print("subject selected", entity_id_and_text, "relation:", relation)
+    logger.debug("subject selected %s relation: %s", entity_id_and_text, relation)
     visual_name = entity_id_and_text.split(':')[0]
     question = set([q for q in questionPatternsByRelation[relation] if _single_ent_question(q)]).pop()
     question = question.replace('X', visual_name)
@@ -0,0 +1,135 @@
+"""
+This module implements the state of the conversations with the users, kept apart
+from the code that handles messages so that many chats can be served by a few threads.
+"""
+import os
+import pickle
+import time
+from collections import OrderedDict
+from threading import Lock
+
+class ChatSession:
+    """
+    The state of the conversation with a single user, i.e. the state of the FSA
+    implemented in the Chatbot module plus the data it needs.
+    """
+    __slots__ = ('chat_id', 'state', 'current_domain', 'enriching_data', 'busy', 'last_seen')
+
+    def __init__(self, chat_id, state):
+        self.chat_id = chat_id
+        # interaction state variable
+        self.state = state
+        self.current_domain = None
+        # (question, entity, relation) of the last question asked to the user
+        self.enriching_data = None
+        # True while a job of this chat is being executed
+        self.busy = False
+        self.last_seen = time.time()
+
+    def __getstate__(self):
+        return (self.chat_id, self.state, self.current_domain, self.enriching_data, self.last_seen)
+
+    def __setstate__(self, values):
+        self.chat_id, self.state, self.current_domain, self.enriching_data, self.last_seen = values
+        # jobs do not survive a restart
+        self.busy = False
+
+class SessionStore:
+    """
+    Keeps the sessions of the active chats in memory, evicting the least recently
+    used ones when there are too many of them, and the ones that are idle for longer
+    than a given time. Optionally, the sessions can be saved on disk so that a
+    restart of the bot does not interrupt the conversations.
+    """
+    def __init__(self, initial_state, max_sessions=100000, ttl=1000, path=None):
+        """
+        Parameters:
+        -----------
+            - `initial_state`: FSA state of a new session.
+            - `max_sessions`: maximum number of sessions kept in memory.
+            - `ttl`: seconds of inactivity after which a session is discarded.
+            - `path`: file where sessions are saved and loaded from, or `None` to
+            keep them only in memory.
+        """
+        self.initial_state = initial_state
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.path = path
+        # chat ID -> ChatSession, ordered from the least to the most recently used
+        self._sessions = OrderedDict()
+        self._lock = Lock()
+        self.evictions = 0
+
+    def get(self, chat_id):
+        """
+        Get the session of a chat, creating a new one if the chat has none (or if it
+        has been evicted).
+
+        Parameters:
+        -----------
+            - `chat_id`: the Telegram chat ID.
+        
+        Returns:
+        --------
+        A `ChatSession` instance.
+        """
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session is not None and (session.busy or now - session.last_seen < self.ttl):
+                self._sessions.move_to_end(chat_id)
+                session.last_seen = now
+            else:
+                # a new session is needed (an expired one is removed by _evict)
+                session = None
+            self._evict(now, 0 if session is not None else 1)
+            if session is None:
+                session = ChatSession(chat_id, self.initial_state)
+                session.last_seen = now
+                self._sessions[chat_id] = session
+            return session
+
+    def _evict(self, now, room=0):
+        """
+        Remove idle sessions and, if needed, the least recently used ones, so that
+        `room` new sessions can be added. Since sessions are ordered by last use, only
+        the oldest ones must be checked. The caller must hold the lock.
+        """
+        for chat_id, oldest in list(self._sessions.items()):
+            if len(self._sessions) + room <= self.max_sessions and now - oldest.last_seen < self.ttl:
+                break
+            # a session whose job is still running is kept until the job ends, and the
+            # next ones are considered instead
+            if oldest.busy:
+                continue
+            del self._sessions[chat_id]
+            self.evictions += 1
+
+    def save(self):
+        """
+        Save the sessions on disk, if a path was given.
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            sessions = list(self._sessions.values())
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(sessions, f)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        """
+        Load the sessions saved on disk, if any, discarding the expired ones.
+        """
+        if self.path is None or not os.path.isfile(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            sessions = pickle.load(f)
+        with self._lock:
+            for session in sorted(sessions, key=lambda s: s.last_seen):
+                self._sessions[session.chat_id] = session
+            self._evict(time.time())
+
+    def __len__(self):
+        return len(self._sessions)
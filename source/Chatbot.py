@@ -1,15 +1,26 @@
 """
 In this module, the bot's logic of interaction is implemented.
 
-The bot's behavior is described as a FSA having 5 states.
+The bot's behavior is described as a FSA having 5 states. The state of each
+conversation is a `ChatSession` kept in a shared `SessionStore`, and the functions
+that handle messages are stateless: they receive the session and a function to
+send replies to the user.
 """
+import logging
 import telepot
+import Metrics
 from Brain import answer_question, ask_question, analize_answer
 from SentenceAnalysis import tell_domain, predefinedDomains
 from Utilities import correct_grammatical_errors
+from WorkerPool import WorkerPool
+from ChatSession import SessionStore
+from Profiling import profile_request
+from Settings import CHATBOT_ASYNC, CHATBOT_WORKERS, CHATBOT_QUEUE_SIZE,\
+    SESSION_MAX_NUMBER, SESSION_TTL, SESSION_STORE_PATH
 import DataAccessManager
-import time
 from random import random
+
+logger = logging.getLogger(__name__)
 # Define a list of names that are used to refer to the interaction state.
 S_START = 0                # beginning of the conversation
 S_DOMAIN = 1               # choose a domain
@@ -17,132 +28,234 @@ S_DIRECTION = 2            # determine the direction of the conversation
 S_WAITING_FOR_ANSWER = 3   # waiting for an answer from the user
 S_ANOTHER_INPUT = 4
 
-class Chatbot(telepot.helper.ChatHandler):
+STATE_NAMES = {
+    S_START : 'START',
+    S_DOMAIN : 'DOMAIN',
+    S_DIRECTION : 'DIRECTION',
+    S_WAITING_FOR_ANSWER : 'WAITING_FOR_ANSWER',
+    S_ANOTHER_INPUT : 'ANOTHER_INPUT'
+}
+
+# shared by all the chats when running in asynchronous mode
+_worker_pool = WorkerPool(CHATBOT_WORKERS, CHATBOT_QUEUE_SIZE) if CHATBOT_ASYNC else None
+
+# the state of all the conversations
+sessions = SessionStore(S_START, SESSION_MAX_NUMBER, SESSION_TTL, SESSION_STORE_PATH)
+
+Metrics.gauge('chat_sessions', "Number of conversation sessions in memory", lambda: len(sessions))
+if _worker_pool is not None:
+    Metrics.gauge('worker_pool_queue_depth', "Jobs waiting for a worker", _worker_pool.queue_depth)
+    Metrics.gauge('worker_pool_rejected', "Jobs rejected because the queue was full",\
+        lambda: _worker_pool.rejected)
+
+def worker_pool_stats():
     """
-    Represents a chat session with a Telegram user. Each time a user contacts the
-    bot, telepot get the associated Chatbot instance from a pool. Each instance is
-    associated to a single user, and runs on its own thread.
+    returns the counters of the shared worker pool (queue depth, completed jobs..),
+    or `None` if the bot is not running in asynchronous mode.
     """
-    def __init__(self, *args, **kwargs):
-        super(Chatbot, self).__init__(*args, **kwargs)
-        # interaction state variable
-        self._int_state = S_START
-        self.current_domain = None
-    
-    def bot_ask_question(self):
-        """
-        ask a random question to a user and register the answer.
-        """
-        question, entity_1, relation = ask_question(self.current_domain)
-        self.sender.sendMessage(question)
-        self.enriching_data = (question, entity_1, relation)
+    return None if _worker_pool is None else _worker_pool.stats()
+
+def _run(session, send, job, *args):
+    """
+    Execute a heavy step of the conversation, in the worker pool if the bot runs
+    in asynchronous mode, or directly otherwise.
+    """
+    if _worker_pool is None:
+        _execute(session, send, job, args)
         return
+    session.busy = True
+    if not _worker_pool.submit(_run_job, session, send, job, args):
+        session.busy = False
+        send("I am very busy right now, please send your message again in a while.")
+
+def _run_job(session, send, job, args):
+    """
+    Executed by a worker: run the job and make the chat accept new messages. If the
+    job fails, the user is told, and the error is logged by the worker pool.
+    """
+    try:
+        _execute(session, send, job, args)
+    except Exception:
+        try:
+            send("Sorry, something went wrong. Please try again.")
+        except Exception:
+            logger.exception("Error while sending the error message.")
+        raise
+    finally:
+        session.busy = False
+
+def _execute(session, send, job, args):
+    """
+    Run a heavy step of the conversation, profiling it if slow requests profiling
+    is enabled.
+    """
+    with profile_request(session.chat_id, STATE_NAMES[session.state]):
+        job(session, send, *args)
+
+def bot_ask_question(session, send):
+    """
+    ask a random question to a user and register the answer.
+    """
+    question, entity_1, relation = ask_question(session.current_domain)
+    send(question)
+    session.enriching_data = (question, entity_1, relation)
+    session.state = S_WAITING_FOR_ANSWER
+    return
+
+def bot_answer_question(session, send, question):
+    """
+    answer a question and reply to the user.
+    """
+    ans = answer_question(correct_grammatical_errors(question))
+    if ans is None:
+        ans = "I don't know (or the question is not well formulated)."
+    send(ans)
+    next_interaction(session, send)
+
+def record_answer(session, send, answer):
+
+    question, entity_1, relation = session.enriching_data
+    extracted_info = analize_answer(answer, entity_1)
+
+    if extracted_info is None:
+        send("Are you sure the answer is correct? "\
+        "I don't see any entity. Try to answer again!")
+        return
+    else:
+        send("I am recording the answer, wait..")
+        entity_2 = extracted_info[1] + "::" + extracted_info[0]
+        
+        dataEntry = {
+            'question' : question, 
+            'answer'   : answer, 
+            'relation' : relation, 
+            'context' : "", 
+            'domains' : [session.current_domain], 
+            'c1' : entity_1, 
+            'c2': entity_2
+        }
+        logger.debug("Sending data to server..")
+        DataAccessManager.add_entry_to_knowledge_base(dataEntry)
+        DataAccessManager.update_knowledge_graph()
+        logger.debug("Local knowledge base updated.")
+        next_interaction(session, send)
+
+def next_interaction(session, send):
+    """
+    decide randomly the next step of the discussion (ask or answer a question)
+    """
+    send("Should I ask or you have a question? Reply 'ask me' to make"\
+    " me ask a question, or send me a question directly.")
+    session.state = S_DIRECTION
+
+def handle_message(session, msg, send):
+    """
+    This function is called on an incoming message from the user. The first thing
+    to do is to determine the status of the conversation, i.e. the FSA state the
+    chatbot is in.
 
-    def bot_answer_question(self, question):
-        """
-        answer a question and reply to the user.
-        """
-        ans = answer_question(correct_grammatical_errors(question))
-        if ans is None:
-            ans = "I don't know (or the question is not well formulated)."
-        self.sender.sendMessage(ans)
+    Parameters:
+    -----------
+        - `session`: the `ChatSession` of the chat the message comes from.
+        - `msg`: the Telegram message.
+        - `send`: function that sends a text message to the user.
     
-    def record_answer(self, answer):
+    Returns:
+    --------
+    Nothing
+    """
+    # perform input validation
+    content_type, chat_type, chat_id = telepot.glance(msg)
+    if content_type != 'text':
+        send("Please, only text messages for now :)")
+        return
+
+    # the reply to the previous message is still being computed
+    if session.busy:
+        send("I am still working on your previous message, just a moment..")
+        return
+
+    # now, check if the message is a command that override the usual workflow
+    if msg['text'] == '/domain': # this command is used to change domain
+        session.state = S_START
 
-        question, entity_1, relation = self.enriching_data
-        extracted_info = analize_answer(answer, entity_1)
+    # handle the message considering the interaction progess
+    if session.state == S_START:
+        
+        message = "Hi! I am here to answer your questions. And to ask you some too.\n"\
+        "In case you can't answer to a question of mine, just reply 'I don't know'.\n"\
+        "If you want to change domain, type '/domain'\n"\
+        "\nWhat do you want to talk about? Reply with a domain."
+        send(message)
+
+        # change state
+        session.state = S_DOMAIN
+    
+    elif session.state == S_DOMAIN:
+        # msg should contain the domain we want to talk about
+        # let's try to map it to one of the predefined ones.
+        
+        domain = tell_domain(msg['text'])
 
-        if extracted_info is None:
-            self.sender.sendMessage("Are you sure the answer is correct? "\
-            "I don't see any entity. Try to answer again!")
+        if domain is None:
+            send("I didn't understand the domain. Please make sure it is correct.")
             return
+        
+        send("You chose {} as domain. You start or should I?".format(domain))
+        send("Reply 'ask me' to make me ask a question, or send me a question directly.")
+        session.current_domain = domain
+        session.state = S_DIRECTION
+        return
+
+    elif session.state == S_DIRECTION:
+        if msg['text'].lower() in ['you', 'ask me', 'ask me anything']:
+            _run(session, send, bot_ask_question)
+
         else:
-            self.sender.sendMessage("I am recording the answer, wait..")
-            entity_2 = extracted_info[1] + "::" + extracted_info[0]
-            
-            dataEntry = {
-                'question' : question, 
-                'answer'   : answer, 
-                'relation' : relation, 
-                'context' : "", 
-                'domains' : [self.current_domain], 
-                'c1' : entity_1, 
-                'c2': entity_2
-            }
-            print("Sending data to server..")
-            DataAccessManager.add_entry_to_knowledge_base(dataEntry)
-            DataAccessManager.update_knowledge_graph()
-            print("Local knowledge base updated.")
-            self.next_interaction()
-
-    def next_interaction(self):
-        """
-        decide randomly the next step of the discussion (ask or answer a question)
-        """
-        time.sleep(0.5)
-        self.sender.sendMessage("Should I ask or you have a question? Reply 'ask me' to make"\
-        " me ask a question, or send me a question directly.")
-        self._int_state = S_DIRECTION
+            _run(session, send, bot_answer_question, msg['text'])
+    
+    elif session.state == S_WAITING_FOR_ANSWER:
+        # record the answer
+        answer = msg['text']
 
-    def on_chat_message(self, msg):
-        """
-        This method is called on an incoming message from the user. The first thing
-        to do is to determine the status of the conversation, i.e. the FSA state the
-        chatbot is in.
-        """
-        # perform input validation
-        content_type, chat_type, chat_id = telepot.glance(msg)
-        if content_type != 'text':
-            self.sender.sendMessage("Please, only text messages for now :)")
+        if "i don't know" in answer.lower():
+            next_interaction(session, send)
             return
 
-        # now, check if the message is a command that override the usual workflow
-        if msg['text'] == '/domain': # this command is used to change domain
-            self._int_state = S_START
-
-        # handle the message considering the interaction progess
-        if self._int_state == S_START:
-            
-            message = "Hi! I am here to answer your questions. And to ask you some too.\n"\
-            "In case you can't answer to a question of mine, just reply 'I don't know'.\n"\
-            "If you want to change domain, type '/domain'\n"\
-            "\nWhat do you want to talk about? Reply with a domain."
-            self.sender.sendMessage(message)
-
-            # change state
-            self._int_state = S_DOMAIN
-        
-        elif self._int_state == S_DOMAIN:
-            # msg should contain the domain we want to talk about
-            # let's try to map it to one of the predefined ones.
-            
-            domain = tell_domain(msg['text'])
-
-            if domain is None:
-                self.sender.sendMessage("I didn't understand the domain. Please make sure it is correct.")
-                return
-            
-            self.sender.sendMessage("You chose {} as domain. You start or should I?".format(domain))
-            self.sender.sendMessage("Reply 'ask me' to make me ask a question, or send me a question directly.")
-            self.current_domain = domain
-            self._int_state = S_DIRECTION
-            return
+        _run(session, send, record_answer, answer)
 
-        elif self._int_state == S_DIRECTION:
-            if msg['text'].lower() in ['you', 'ask me', 'ask me anything']:
-                self.bot_ask_question()
-                self._int_state = S_WAITING_FOR_ANSWER
+def message_handler(bot):
+    """
+    Get a function that handles the messages received by `bot`, to be used with
+    telepot's `MessageLoop`. No thread is created per chat: messages are handled on
+    the loop thread, and the heavy steps run in the shared worker pool.
 
-            else:
-                self.bot_answer_question(msg['text'])
-                self.next_interaction()
-        
-        elif self._int_state == S_WAITING_FOR_ANSWER:
-            # record the answer
-            answer = msg['text']
+    Parameters:
+    -----------
+        - `bot`: a `telepot.Bot` instance.
+    
+    Returns:
+    --------
+    A function that takes a Telegram message as argument.
+    """
+    def on_message(msg):
+        # callback queries, inline queries... are not handled
+        if telepot.flavor(msg) != 'chat':
+            return
+        chat_id = msg['chat']['id']
+        handle_message(sessions.get(chat_id), msg, lambda text: bot.sendMessage(chat_id, text))
+    return on_message
 
-            if "i don't know" in answer.lower():
-                self.next_interaction()
-                return
+class Chatbot(telepot.helper.ChatHandler):
+    """
+    Handles the messages of a chat with a Telegram user. Each time a user contacts the
+    bot, telepot get the associated Chatbot instance from a pool. Each instance is
+    associated to a single user, and runs on its own thread.
 
-            self.record_answer(answer)
\ No newline at end of file
+    The conversation state is not kept in the instance but in the shared session
+    store, so it survives the instance being closed for inactivity. When the bot runs
+    in asynchronous mode, `message_handler` should be preferred, as it does not need
+    a thread per chat.
+    """
+    def on_chat_message(self, msg):
+        handle_message(sessions.get(self.chat_id), msg, self.sender.sendMessage)
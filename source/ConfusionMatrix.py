@@ -1,7 +1,8 @@
 """
-
+This module implements a confusion matrix, together with the metrics (accuracy,
+precision, recall and F-measure) that can be derived from it.
 """
-from functools import reduce
+import numpy
 
 class ConfusionMatrix:
     """
@@ -10,9 +11,9 @@ class ConfusionMatrix:
     """
     def __init__(self, truth, predicted, labels_mapping=None):
         """
-        creates a new instance of ConfusionMatrix. Labels can be scalars or
-        one-hot vectors. In case of one-hot vectors, they are converted to
-        integers corresponding to the index of 1 in the vector.
+        creates a new instance of ConfusionMatrix. Labels can be scalars, one-hot
+        vectors or probability distributions. In case of vectors, they are converted
+        to integers corresponding to the index of the largest value in the vector.
 
         Optionally, you can pass labels_mapping to map integers to string
         so to display the graphical label when printing the confusion
@@ -20,9 +21,9 @@ class ConfusionMatrix:
 
         Parameters
         -------------
-            - truth: an array of labels where the i-th element represents 
+            - truth: an array of labels where the i-th element represents
               the ground truth for the i-th sample.
-            - predicted: array where the i-th element in is the label 
+            - predicted: array where the i-th element in is the label
               assigned to the sample by a classifier.
             - labels_mapping: maps integer to labels
         """
@@ -30,48 +31,80 @@ class ConfusionMatrix:
             print("ConfusionMatrix: truth and predicted lists are not of the same size.")
             return
 
-        # check if it is one hot representation
-        if isinstance(predicted[0], list) and max(predicted[0]) == 1:
-            # convert to one hot if it is a probability distribution and then 
-            # convert one-hot to an integer
-            predicted = [y.index(1) for y in predicted]
-            truth = [y.index(1) for y in truth]
-        
+        truth = ConfusionMatrix._to_label_array(truth)
+        predicted = ConfusionMatrix._to_label_array(predicted)
+
+        # assign an index to each class label (the sorted labels that appear in the
+        # data), and translate the labels into indexes
+        labels, indexes = numpy.unique(numpy.concatenate((truth, predicted)), return_inverse=True)
+        n_labels = len(labels)
+        truth_indexes = indexes[:len(truth)]
+        predicted_indexes = indexes[len(truth):]
+
+        # each (truth, predicted) pair is counted in the cell truth * n_labels + predicted
+        counts = numpy.bincount(truth_indexes * n_labels + predicted_indexes, minlength=n_labels * n_labels)
+        self._set_matrix(counts.reshape(n_labels, n_labels), labels.tolist(), labels_mapping)
+
+    def from_matrix(matrix, labels, labels_mapping=None):
+        """
+        creates a new instance of ConfusionMatrix from the counts, e.g. accumulated
+        over the batches of a large test set.
+
+        Parameters:
+        -----------
+            - `matrix`: 2D array where the element (i, j) is the number of samples of
+            class labels[i] classified as labels[j].
+            - `labels`: the class labels, in the order of the rows of `matrix`.
+            - `labels_mapping`: maps integer to labels.
+
+        Returns:
+        --------
+        A ConfusionMatrix instance.
+        """
+        cm = ConfusionMatrix.__new__(ConfusionMatrix)
+        cm._set_matrix(numpy.asarray(matrix), labels, labels_mapping)
+        return cm
+
+    def _to_label_array(y):
+        """
+        returns a 1D array of labels from a list of labels, or from a 2D array of
+        one-hot vectors or probability distributions (taking the index of the maximum).
+        """
+        if len(y) > 0 and isinstance(y[0], (list, tuple, numpy.ndarray)):
+            return numpy.argmax(numpy.asarray(y), axis=1)
+        return numpy.asarray(y)
+
+    def _set_matrix(self, matrix, labels, labels_mapping):
+        """
+        store the confusion matrix and compute all the metrics from it.
+
+        Parameters:
+        -----------
+            - `matrix`: 2D array where the element (i, j) is the number of samples of
+            class labels[i] classified as labels[j].
+            - `labels`: the class labels, in the order of the rows of `matrix`.
+            - `labels_mapping`: maps integer to labels.
+        """
         # used to map a label to a graphical representation
         self.labels_mapping = labels_mapping
-        #first, find all the class labels
-        s_labels = set()
-        for i in truth:
-            s_labels.add(i)
-        for i in predicted:
-            s_labels.add(i)
-
-        #now we assign an index to each class label
-        #we will need a way to recover one given the other
-        counter = 0
-        self.indexesLabel = list()
-        self.labelIndexes = dict()
-        for label in s_labels:
-            self.labelIndexes[label] = counter
-            self.indexesLabel += [label]
-            counter += 1
-
-        n_labels = len(s_labels)
-        self.confusionMatrix = [[0]*n_labels for i in range(n_labels)]
-
-        #now compute the confusion matrix. Meanwhile we can compute the accuracy
-        #of the classifier
-        self.accuracy = 0
-        for i in range(len(truth)):
-            if truth[i] == predicted[i]:
-                self.accuracy += 1
-            j = self.labelIndexes[truth[i]]
-            k = self.labelIndexes[predicted[i]]
-            self.confusionMatrix[j][k] += 1
-
-        self.accuracy = (self.accuracy / len(truth))*100
-        self.labels = s_labels
-        return
+        self.confusionMatrix = matrix
+        self.indexesLabel = list(labels)
+        self.labelIndexes = {label : i for i, label in enumerate(self.indexesLabel)}
+        self.labels = set(self.indexesLabel)
+
+        # the marginals: samples of each class (rows) and samples assigned to each
+        # class (columns)
+        true_positives = numpy.diag(matrix).astype(float)
+        self._row_sums = matrix.sum(axis=1)
+        self._column_sums = matrix.sum(axis=0)
+        total = matrix.sum()
+
+        self.accuracy = (true_positives.sum() / total) * 100 if total > 0 else 0
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            self._precisions = numpy.where(self._column_sums > 0, true_positives / self._column_sums * 100, 0)
+            self._recalls = numpy.where(self._row_sums > 0, true_positives / self._row_sums * 100, 0)
+            p_plus_r = self._precisions + self._recalls
+            self._fmeasures = numpy.where(p_plus_r > 0, 2 * self._precisions * self._recalls / p_plus_r, 0)
 
     def getAccuracy(self):
         '''
@@ -89,106 +122,55 @@ class ConfusionMatrix:
         """
         returns the precision for class "attrName"
         """
-        #first, get the index of the attribute
-        ind = self.labelIndexes[attrName]
-        TP = self.confusionMatrix[ind][ind]
-        TPFP = reduce(lambda x, y: x+y, [self.confusionMatrix[i][ind] for i in range(len(self.confusionMatrix))])
-        if TPFP == 0:
-            return 0
-        else:
-            return (TP/TPFP)*100
+        return float(self._precisions[self.labelIndexes[attrName]])
 
     def getRecall(self, attrName):
         """
         returns the recall for class "attrName"
         """
-        #first, get the index of the attribute
-        ind = self.labelIndexes[attrName]
-        TP = self.confusionMatrix[ind][ind]
-        TPFN = reduce(lambda x, y: x+y, [self.confusionMatrix[ind][i] for i in range(len(self.confusionMatrix))])
-        if TPFN == 0:
-            return 0
-        else:
-            return (TP/TPFN)*100
+        return float(self._recalls[self.labelIndexes[attrName]])
 
     def getMeanFMeasure(self):
         """
         returns the mean fmeasure computed averaging the fmeasure of each class.
         """
-        val = reduce(lambda x, y: x+y, [self.getFMeasure(label) for label in self.labels])
-        return val / len(self.labels)
+        return float(self._fmeasures.mean())
 
     def getFMeasure(self, attrName):
         """
         returns the fmeasure value for class "attrName"
         """
-        p = self.getPrecision(attrName)
-        r = self.getRecall(attrName)
-        if p + r == 0:
-            return 0
-        else:
-            return 2*((p*r)/(p+r))
+        return float(self._fmeasures[self.labelIndexes[attrName]])
 
     def getMeanPrecision(self):
         """
         get the mean precision computed averaging the precision of each class.
         """
-        val = reduce(lambda x, y: x+y, [self.getPrecision(label) for label in self.labels])
-        return val / len(self.labels)
+        return float(self._precisions.mean())
 
     def getMeanRecall(self):
         """
         get the mean recall computed averaging the precision of each class.
         """
-        val = reduce(lambda x, y: x+y, [self.getRecall(label) for label in self.labels])
-        return (val / len(self.labels))
-    
+        return float(self._recalls.mean())
+
     def getPercentageMatrix(self):
         """
         returns a matrix containing values in percentage form.
         """
-        perc_matrix = []
-        for i in range(len(self.confusionMatrix)):
-            row = []
-            s = sum(self.confusionMatrix[i])
-            for j in range(len(self.confusionMatrix[0])):
-                row += [(self.confusionMatrix[i][j] / s)*100]
-            perc_matrix += [row]
-        return perc_matrix
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            perc_matrix = self.confusionMatrix / self._row_sums[:, None] * 100
+        return numpy.nan_to_num(perc_matrix).tolist()
 
     def __str__(self):
         """
         return a string representation of the confusion matrix.
         """
-        # first, find the largest value in confusion matrix
-        largest = -1
-        for row in self.confusionMatrix:
-            for e in row:
-                if e > largest:
-                    largest = e
-        # lets see how many digits we need to represent that number
-        # check the content of the matrix
-        d = 0
-        while(largest > 0):
-            largest //= 10
-            d += 1
-        d += 1
-        #but also the labels that will be the headers
+        # the cells must contain the largest value in confusion matrix
+        d = len(str(self.confusionMatrix.max())) + 1
+        # but also the labels that will be the headers
         if not(self.labels_mapping is None):
-            max_lab_len = -1
-            for x in self.labels_mapping:
-                if isinstance(x, str):
-                    x_len = len(x)
-                    if x_len > max_lab_len:
-                        max_lab_len = x_len
-                else:
-                    x_len = 0
-                    while(x > 0):
-                        x //=10
-                        x_len += 1
-                    if x_len > max_lab_len:
-                        max_lab_len = x_len
-            max_lab_len += 1
+            max_lab_len = max(len(str(self._label_name(i))) for i in range(len(self.indexesLabel))) + 1
             if (max_lab_len > d):
                 d = max_lab_len
 
@@ -198,36 +180,43 @@ class ConfusionMatrix:
             s += self._f_s_cell(d, i)
         s += " <- classified as\n"
         # print the separating line
-        for i in range(len(self.indexesLabel)):
-            s += "-" * d
+        s += "-" * d * len(self.indexesLabel)
         s +="\n"
         for i, row in enumerate(self.confusionMatrix):
             for val in row:
                 s += self._f_v_cell(d, val)
             s+= " |" + self._f_s_cell(d, i) + "\n"
         return s
-    
-    def _f_s_cell(self, d, i):
+
+    def _label_name(self, i):
         """
-        format an header cell to contain a label name.
+        returns the graphical representation of the i-th label.
         """
         l = self.indexesLabel[i]
         if not(self.labels_mapping is None):
             l = self.labels_mapping[l]
+        return l
+
+    def _f_s_cell(self, d, i):
+        """
+        format an header cell to contain a label name.
+        """
+        l = self._label_name(i)
         sy = 's' if isinstance(l, str) else 'd'
         fm = "{:" + str(d) + sy + "}"
         return fm.format(l)
-    
+
     def _f_v_cell(self, d, i):
         """
         format an internal cell to contain a value
         """
         fm = "{:" + str(d) + "d}"
-        return fm.format(i)
+        return fm.format(int(i))
 
     def print_report(self):
         rep = "{:20s} {:20s} {:20s} {:20s}\n".format("Class", "Precision", "Recall", "FMeasure")
 
-        for c in self.labels:
-            rep += "{:20s} {:17.3f} {:17.3f} {:17.3f}\n".format(c, self.getPrecision(c), self.getRecall(c), self.getFMeasure(c))
+        for i, c in enumerate(self.indexesLabel):
+            rep += "{:20s} {:17.3f} {:17.3f} {:17.3f}\n".format(str(self._label_name(i)), self._precisions[i],\
+                self._recalls[i], self._fmeasures[i])
         print(rep)
@@ -1,26 +1,57 @@
 """
     This module acts as interface to both local and remote data available to the application.
 """
+import logging
 import pickle
-import re
 import os
-import traceback
+import Metrics
+from DomainIndex import get_domain_index
+from EntryNormalization import normalize_entries
 from Settings import domainsToRelationsMapping, KG_DUMP_PATH, KB_DUMP_PATH
 from KnowledgeGraph import KnowledgeGraph
 import KnowledgeBaseServer as KBS
 
+logger = logging.getLogger(__name__)
+
 knowledgeGraph = KnowledgeGraph(domainsToRelationsMapping)
 
+# functions called with the set of touched node IDs after each Knowledge Graph update
+_update_listeners = list()
+
 ##################################################################################################
 #
 #                                       Knowledge Graph API
 #
 ##################################################################################################
+def add_update_listener(listener):
+    """
+    Register a function to be called each time the Knowledge Graph is updated.
+
+    Parameters:
+    -----------
+        - `listener`: a function that takes as argument the set of IDs of the nodes
+        touched by the update.
+    
+    Returns:
+    --------
+    Nothing
+    """
+    _update_listeners.append(listener)
+
+def _update_graph(data, total_downloaded):
+    """
+    Update the Knowledge Graph and notify the listeners about the touched nodes.
+    """
+    touched = knowledgeGraph.update(data, total_downloaded)
+    for listener in _update_listeners:
+        listener(touched)
+
 def dump_knowledge_graph():
     """
     Save the Knowledge Graph structure on a file.
     """
-    pickle.dump(knowledgeGraph, open(KG_DUMP_PATH, "wb"))
+    with Metrics.timer('knowledge_graph_dump_seconds', "Duration of the knowledge graph dumps"):
+        pickle.dump(knowledgeGraph, open(KG_DUMP_PATH, "wb"))
 
 def initialize_knowledge_graph():
     """
@@ -29,15 +60,20 @@ def initialize_knowledge_graph():
     """
     if os.path.isfile(KG_DUMP_PATH):
         global knowledgeGraph
-        knowledgeGraph = pickle.load(open(KG_DUMP_PATH, 'rb'))
+        dumped_graph = pickle.load(open(KG_DUMP_PATH, 'rb'))
+        if getattr(dumped_graph, 'format_version', 1) == KnowledgeGraph.FORMAT_VERSION:
+            knowledgeGraph = dumped_graph
+            return
+        # the dump has been made by an older version, the graph must be rebuilt
+        logger.info("The knowledge graph dump has an old format, rebuilding it.")
+
+    if os.path.isfile(KB_DUMP_PATH):
+        kb = load_knowledge_base_dump()
+        ckb = _clean_downloaded_data(kb)
+        _update_graph(ckb, len(kb))
     else:
-        if os.path.isfile(KB_DUMP_PATH):
-            kb = load_knowledge_base_dump()
-            ckb = _clean_downloaded_data(kb)
-            knowledgeGraph.update(ckb, len(kb))
-        else:
-            update_knowledge_graph()
-        dump_knowledge_graph()
+        update_knowledge_graph()
+    dump_knowledge_graph()
 
 def update_knowledge_graph():
     """
@@ -48,17 +84,19 @@ def update_knowledge_graph():
     The number of new entries.
     """
     try:
-        data = KBS.get_all_items_from(knowledgeGraph.entry_counter)
-        cleaned_data = _clean_downloaded_data(data)
-        # TODO: also update the local mirror dump
-        print(data)
-        knowledgeGraph.update(cleaned_data, len(data))
+        with Metrics.timer('kbs_sync_seconds', "Duration of the synchronizations with the KBS"):
+            data = KBS.get_all_items_from(knowledgeGraph.entry_counter)
+            cleaned_data = _clean_downloaded_data(data)
+            # TODO: also update the local mirror dump
+            logger.debug("new entries from the KBS: %s", data)
+            _update_graph(cleaned_data, len(data))
+        Metrics.counter('kbs_synced_entries_total', "Entries downloaded from the KBS").inc(len(data))
         if len(data) > 0:
             dump_knowledge_graph()
         return len(data)
     except Exception:
-        traceback.print_exc()
-        print("Error while updating the knowledge graph.")
+        Metrics.counter('kbs_sync_errors_total', "Failed synchronizations with the KBS").inc()
+        logger.exception("Error while updating the knowledge graph.")
         return
     
 def query_knowledge_graph(entities, relation):
@@ -75,7 +113,15 @@ def query_knowledge_graph(entities, relation):
     --------
     A list of dictionaries, where each dictionary is in the KBS entry format.
     """
-    return knowledgeGraph.query(entities, relation)
+    with Metrics.timer('knowledge_graph_query_seconds', "Duration of the knowledge graph queries"):
+        return knowledgeGraph.query(entities, relation)
+
+def find_entity(name):
+    """
+    returns the ID of the only concept of the knowledge graph called `name`, or None
+    (see KnowledgeGraph.find_entity).
+    """
+    return knowledgeGraph.find_entity(name)
 
 def pick_subject_to_ask_about(domain):
     """
@@ -130,7 +176,8 @@ def add_entry_to_knowledge_base(entry):
     try:
         KBS.add_item(entry)
     except Exception:
-        print("Error while adding a new entry.")
+        Metrics.counter('kbs_add_errors_total', "Entries that could not be added to the KBS").inc()
+        logger.exception("Error while adding a new entry.")
     
     return
 
@@ -142,17 +189,12 @@ def add_entry_to_knowledge_base(entry):
 
 def _clean_downloaded_data(data):
     """
-    fix noise in order to be able to save data locally in the graph.
+    fix noise in order to be able to save data locally in the graph: invalid entries
+    are discarded, the valid ones are normalized (see EntryNormalization) and those
+    without domains get the domains of their concepts (see DomainIndex).
     """
-    new_data = list()
-
-    for d in data:
-        c1 = d['c1']
-        c2 = d['c2']
-
-        if re.match(r"^([A-Za-z0-9 ]+::)bn(:|::)[0-9]+[a-z]$",c1) is None or\
-        re.match(r"^([A-Za-z0-9 ]+::)bn(:|::)[0-9]+[a-z]$",c2) is None:
-            continue
-        new_data.append(d)
-
-    return new_data
\ No newline at end of file
+    cleaned_data = normalize_entries(data)
+    domain_index = get_domain_index()
+    if domain_index is not None:
+        domain_index.annotate(cleaned_data)
+    return cleaned_data
\ No newline at end of file
@@ -0,0 +1,181 @@
+"""
+This module implements the assignment of domains to the KB entries, based on the
+BabelDomains mapping from BabelNet synset IDs to domains.
+
+The mapping is read once from the BabelDomains text file and stored in a SQLite
+index (synset ID -> domain), which is then queried only for the synsets of the
+entries that need a domain. Entries can thus be annotated while they are ingested,
+including the new ones coming from a synchronization with the KBS, without loading
+the whole mapping in memory.
+
+The index is rebuilt automatically when the BabelDomains file changes.
+"""
+import logging
+import os
+import sqlite3
+import sys
+from threading import Lock
+import Metrics
+from Settings import BABELDOMAINS_PATH, DOMAIN_INDEX_PATH
+
+logger = logging.getLogger(__name__)
+
+# synsets per query, below the SQLite limit on the number of parameters
+_QUERY_CHUNK_SIZE = 500
+# rows per insert while building the index
+_BUILD_BATCH_SIZE = 50000
+
+def _read_babeldomains(source_path):
+    """
+    Generate the pairs (synset ID, domain) from the BabelDomains file, whose lines are
+    "synset ID <tab> domain <tab> score ...".
+    """
+    with open(source_path) as f:
+        for line in f:
+            fields = line.split('\t')
+            if len(fields) >= 2:
+                yield fields[0], fields[1].strip()
+
+def build_index(source_path=BABELDOMAINS_PATH, index_path=DOMAIN_INDEX_PATH):
+    """
+    Build the SQLite index from the BabelDomains file.
+
+    The index is written in a temporary file and moved in place at the end, so that
+    readers never see a partially built index.
+
+    Parameters:
+    -----------
+        - `source_path`: the BabelDomains file.
+        - `index_path`: where the index is stored.
+
+    Returns:
+    --------
+    The number of synsets in the index.
+    """
+    tmp_path = index_path + ".tmp"
+    if os.path.isfile(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.execute("CREATE TABLE synset_domain (synset TEXT PRIMARY KEY, domain TEXT NOT NULL) WITHOUT ROWID")
+    connection.execute("CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)")
+
+    batch = list()
+    for pair in _read_babeldomains(source_path):
+        batch.append(pair)
+        if len(batch) == _BUILD_BATCH_SIZE:
+            connection.executemany("INSERT OR REPLACE INTO synset_domain VALUES (?, ?)", batch)
+            batch = list()
+    connection.executemany("INSERT OR REPLACE INTO synset_domain VALUES (?, ?)", batch)
+    connection.execute("INSERT INTO info VALUES ('source_mtime', ?)", (str(os.path.getmtime(source_path)),))
+    connection.commit()
+    size = connection.execute("SELECT COUNT(*) FROM synset_domain").fetchone()[0]
+    connection.close()
+    os.replace(tmp_path, index_path)
+    logger.info("domain index built in %s with %d synsets", index_path, size)
+    return size
+
+def _is_up_to_date(source_path, index_path):
+    """
+    returns True if the index exists and has been built from the current version of
+    the BabelDomains file (or if the BabelDomains file is not available).
+    """
+    if not os.path.isfile(index_path):
+        return False
+    if not os.path.isfile(source_path):
+        return True
+    try:
+        connection = sqlite3.connect(index_path)
+        row = connection.execute("SELECT value FROM info WHERE key = 'source_mtime'").fetchone()
+        connection.close()
+    except sqlite3.Error:
+        return False
+    return row is not None and row[0] == str(os.path.getmtime(source_path))
+
+class DomainIndex:
+    """
+    Read access to the synset ID -> domain index.
+    """
+    def __init__(self, index_path=DOMAIN_INDEX_PATH):
+        # the connection is shared by the threads that ingest data, under the lock
+        self._connection = sqlite3.connect("file:{}?mode=ro".format(index_path), uri=True, check_same_thread=False)
+        self._lock = Lock()
+
+    def lookup(self, bab_ids):
+        """
+        Find the domains of a set of synsets.
+
+        Parameters:
+        -----------
+            - `bab_ids`: an iterable of canonical BabelNet IDs.
+
+        Returns:
+        --------
+        A dictionary from the IDs that have a domain to their domain.
+        """
+        bab_ids = list(set(bab_ids))
+        domains = dict()
+        with self._lock:
+            for i in range(0, len(bab_ids), _QUERY_CHUNK_SIZE):
+                chunk = bab_ids[i:i + _QUERY_CHUNK_SIZE]
+                query = "SELECT synset, domain FROM synset_domain WHERE synset IN ({})".format(",".join("?" * len(chunk)))
+                for synset, domain in self._connection.execute(query, chunk):
+                    domains[synset] = sys.intern(domain)
+        return domains
+
+    def annotate(self, entries, overwrite=False):
+        """
+        Assign to the entries the domains of their concepts.
+
+        Parameters:
+        -----------
+            - `entries`: a list of normalized entries (see EntryNormalization).
+            - `overwrite`: if False, only the entries without domains are annotated;
+            otherwise the domains of all the entries are replaced.
+
+        Returns:
+        --------
+        The number of entries that received at least one domain.
+        """
+        to_annotate = [e for e in entries if overwrite or len(e['domain_keys']) == 0]
+        if len(to_annotate) == 0:
+            return 0
+        domains = self.lookup(c for e in to_annotate for c in (e['c1_id'], e['c2_id']))
+        annotated = 0
+        for entry in to_annotate:
+            entry_domains = list()
+            for bab_id in (entry['c1_id'], entry['c2_id']):
+                domain = domains.get(bab_id)
+                if domain is not None and domain not in entry_domains:
+                    entry_domains.append(domain)
+            if len(entry_domains) > 0 or overwrite:
+                entry['domains'] = entry_domains
+                entry['domain_keys'] = [sys.intern(d.lower()) for d in entry_domains]
+            if len(entry_domains) > 0:
+                annotated += 1
+        Metrics.counter('kb_entries_domain_annotated_total', "KB entries whose domains come from the domain index")\
+            .inc(annotated)
+        return annotated
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+_domain_index = None
+_domain_index_lock = Lock()
+
+def get_domain_index():
+    """
+    returns the shared DomainIndex, building (or rebuilding) the index on first use if
+    needed, or `None` if neither the index nor the BabelDomains file is available.
+    """
+    global _domain_index
+    with _domain_index_lock:
+        if _domain_index is None:
+            if not _is_up_to_date(BABELDOMAINS_PATH, DOMAIN_INDEX_PATH):
+                if not os.path.isfile(BABELDOMAINS_PATH):
+                    return None
+                build_index(BABELDOMAINS_PATH, DOMAIN_INDEX_PATH)
+            _domain_index = DomainIndex(DOMAIN_INDEX_PATH)
+        return _domain_index
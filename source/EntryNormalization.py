@@ -0,0 +1,128 @@
+"""
+This module implements the validation and normalization of the KBS entries.
+
+Each entry is checked and canonicalized once, when it enters the application, and
+the results are stored in the entry itself, so that the download, ingestion and query
+paths do not have to parse the same strings again. A normalized entry has, in addition
+to the KBS fields, the following ones:
+    - `c1_id`, `c2_id`: the canonical BabelNet IDs of the two concepts (`bn::` is
+    turned into `bn:`).
+    - `c1_name`, `c2_name`: the textual representation of the two concepts.
+    - `relation_key`: the relation, lower case.
+    - `domain_keys`: the list of domains, lower case.
+All these strings are interned, since the same values repeat over many entries.
+"""
+import logging
+import re
+import sys
+from collections import Counter
+import Metrics
+
+logger = logging.getLogger(__name__)
+
+# "name::bn:00012345n", also tolerating "name::bn::00012345n"
+_CONCEPT_PATTERN = re.compile(r"^([A-Za-z0-9 ]+)::bn::?([0-9]+[a-z])$")
+_BAB_ID_PATTERN = re.compile(r"bn::?([0-9]+[a-z])$")
+
+_REQUIRED_FIELDS = ('c1', 'c2', 'relation')
+# fields added by normalize_entry
+NORMALIZED_FIELDS = ('c1_name', 'c1_id', 'c2_name', 'c2_id', 'relation_key', 'domain_keys')
+
+# number of entries rejected, by reason
+rejected_entries = Counter()
+
+def canonical_bab_id(bab_id):
+    """
+    returns the canonical form "bn:<number><pos>" of a BabelNet ID, or the ID itself
+    if it is not recognized.
+    """
+    match = _BAB_ID_PATTERN.search(bab_id)
+    if match is None:
+        return bab_id
+    return sys.intern("bn:" + match.group(1))
+
+def parse_concept(concept):
+    """
+    Split a concept in the KBS format "name::bn:id" in its name and canonical ID.
+
+    Returns:
+    --------
+    A pair (name, id), or `None` if the concept is malformed.
+    """
+    match = _CONCEPT_PATTERN.match(concept)
+    if match is None:
+        return None
+    return sys.intern(match.group(1)), sys.intern("bn:" + match.group(2))
+
+def _reject(reason):
+    rejected_entries[reason] += 1
+    Metrics.counter('kb_entries_rejected_' + reason + '_total', "KB entries rejected: " + reason).inc()
+    return None
+
+def normalize_entry(entry):
+    """
+    Validate and normalize a KBS entry, adding the normalized fields to it.
+
+    Parameters:
+    -----------
+        - `entry`: a dictionary in the KBS entry format.
+    
+    Returns:
+    --------
+    The entry itself, or `None` if it is not valid (the reason is counted in
+    `rejected_entries`).
+    """
+    if not isinstance(entry, dict):
+        return _reject('not_a_dict')
+    for field in _REQUIRED_FIELDS:
+        if not isinstance(entry.get(field), str):
+            return _reject('missing_' + field)
+
+    c1 = parse_concept(entry['c1'])
+    if c1 is None:
+        return _reject('malformed_c1')
+    c2 = parse_concept(entry['c2'])
+    if c2 is None:
+        return _reject('malformed_c2')
+
+    entry['c1_name'], entry['c1_id'] = c1
+    entry['c2_name'], entry['c2_id'] = c2
+    entry['relation_key'] = sys.intern(entry['relation'].lower())
+    entry['domain_keys'] = [sys.intern(d.lower()) for d in entry.get('domains') or []]
+    return entry
+
+def is_normalized(entry):
+    """
+    returns True if normalize_entry has already been applied to the entry.
+    """
+    return 'relation_key' in entry
+
+def strip_normalized_fields(entry):
+    """
+    Remove from an entry the fields added by normalize_entry, e.g. before saving it in
+    the KBS format: saved normalized fields would be trusted by is_normalized even if
+    the entry changed.
+    """
+    for field in NORMALIZED_FIELDS:
+        entry.pop(field, None)
+    return entry
+
+def normalize_entries(data):
+    """
+    Validate and normalize a list of KBS entries.
+
+    Parameters:
+    -----------
+        - `data`: list of dictionaries in the KBS entry format.
+    
+    Returns:
+    --------
+    The list of the valid entries, normalized.
+    """
+    normalized = list()
+    for d in data:
+        if normalize_entry(d) is not None:
+            normalized.append(d)
+    if len(normalized) < len(data):
+        logger.debug("%d entries rejected out of %d", len(data) - len(normalized), len(data))
+    return normalized
@@ -0,0 +1,187 @@
+"""
+This module implements an inference-only version of the question classifier.
+
+The trained keras model (a single LSTM layer followed by a softmax Dense layer) is
+exported, together with the bag of words and the label mapping, in a `.npz` file.
+`InferenceClassifier` loads it and computes the forward pass with NumPy: it does not
+import keras, and it avoids the per-call overhead of `model.predict`, which
+dominates the latency when classifying one question at a time.
+
+Since the words are one-hot vectors, the product between the input and the LSTM
+kernel is a row lookup, done once for all the time steps of a sentence.
+
+The weight matrices can be exported quantized, to float16 or to int8 (symmetric,
+with a scale for each column). The input kernel is kept quantized in memory and
+only the rows of the words in a sentence are converted; the recurrent and dense
+kernels, which are used in every product, are converted to float32 when loading.
+"""
+import numpy
+from nltk import word_tokenize
+from Utilities import top_k_labels, write_atomically
+
+_ACTIVATIONS = {
+    'sigmoid' : lambda x: 1 / (1 + numpy.exp(-x)),
+    'hard_sigmoid' : lambda x: numpy.clip(0.2 * x + 0.5, 0, 1),
+    'tanh' : numpy.tanh,
+    'relu' : lambda x: numpy.maximum(x, 0),
+    'linear' : lambda x: x
+}
+
+# quantized weight matrices
+_QUANTIZED = ('kernel', 'recurrent_kernel', 'dense_kernel')
+
+def _quantize(W, quantization):
+    """
+    returns a dictionary with the arrays that represent `W` quantized: the values
+    and, for int8, the scale of each column.
+    """
+    if quantization is None:
+        return {'' : W}
+    if quantization == 'float16':
+        return {'' : W.astype(numpy.float16)}
+    if quantization == 'int8':
+        scale = numpy.abs(W).max(axis=0) / 127
+        scale[scale == 0] = 1
+        return {'' : numpy.round(W / scale).astype(numpy.int8), '_scale' : scale.astype(numpy.float32)}
+    raise ValueError("unknown quantization: {}".format(quantization))
+
+def _dequantize(data, name):
+    """
+    returns the weight matrix `name` of an export as a float32 array.
+    """
+    W = data[name].astype(numpy.float32)
+    if name + '_scale' in data:
+        W *= data[name + '_scale']
+    return W
+
+def export_model(model, dictionary, labels, path, sequence_length=20, quantization=None):
+    """
+    Save the weights of a trained keras model in the format read by InferenceClassifier.
+
+    Parameters:
+    -----------
+        - `model`: the keras model, an LSTM layer followed by a Dense softmax layer.
+        - `dictionary`: the bag of words, mapping each word to its index.
+        - `labels`: the labels, ordered by ID.
+        - `path`: the `.npz` file to write. It is replaced atomically.
+        - `sequence_length`: number of words the model reads from each sentence.
+        - `quantization`: None, 'float16' or 'int8', the type the weight matrices
+        are stored as.
+
+    Returns:
+    --------
+    Nothing
+    """
+    lstm_layer, dense_layer = model.layers[0], model.layers[-1]
+    config = lstm_layer.get_config()
+    weights = lstm_layer.get_weights()
+    kernel, recurrent_kernel = weights[0], weights[1]
+    bias = weights[2] if config.get('use_bias', True) else numpy.zeros(kernel.shape[1], dtype=kernel.dtype)
+    dense_kernel, dense_bias = dense_layer.get_weights()
+    words = sorted(dictionary, key=dictionary.get)
+    arrays = dict()
+    for name, W in zip(_QUANTIZED, (kernel, recurrent_kernel, dense_kernel)):
+        for suffix, array in _quantize(W, quantization).items():
+            arrays[name + suffix] = array
+    # the server may be loading the export while it is rewritten: replace it atomically
+    # (the trainer and the server may also export it at the same time)
+    write_atomically(path, lambda tmp_path: numpy.savez(tmp_path, bias=bias, dense_bias=dense_bias,\
+        words=numpy.array(words, dtype=str), labels=numpy.array(labels, dtype=str),\
+        activation=config['activation'], recurrent_activation=config['recurrent_activation'],\
+        sequence_length=sequence_length, quantization=str(quantization), **arrays), suffix=".npz")
+
+class InferenceClassifier:
+    """
+    Predicts the relation of a question with the NumPy forward pass of an exported
+    model. It has the same `predict` interface as `QuestionClassifier`.
+    """
+    def __init__(self, path):
+        data = numpy.load(path)
+        self.dictionary = {w : i for i, w in enumerate(data['words'].tolist())}
+        self.labels = numpy.array(data['labels'].tolist(), dtype=object)
+        self.sequence_length = int(data['sequence_length'])
+        self.activation = _ACTIVATIONS[str(data['activation'])]
+        self.recurrent_activation = _ACTIVATIONS[str(data['recurrent_activation'])]
+        self.quantization = str(data['quantization']) if 'quantization' in data else 'None'
+        self.recurrent_kernel = _dequantize(data, 'recurrent_kernel')
+        self.dense_kernel = _dequantize(data, 'dense_kernel')
+        self.dense_bias = data['dense_bias']
+        self.bias = data['bias']
+        # input projection of each word; the last row (zeros) is used for the words
+        # that are not in the dictionary and for padding
+        kernel = data['kernel']
+        self.input_projection = numpy.vstack((kernel, numpy.zeros((1, kernel.shape[1]), dtype=kernel.dtype)))
+        self.input_scale = data['kernel_scale'] if 'kernel_scale' in data else None
+        if self.input_projection.dtype == numpy.float32:
+            # not quantized: the bias can be added once here
+            self.input_projection += self.bias
+            self.bias = None
+        self.units = self.recurrent_kernel.shape[0]
+
+    def sentences_to_indexes(self, X):
+        """
+        returns the word indexes of a list of tokenized sentences, as in
+        `LSTMSentenceClassifier.sentences_to_indexes`.
+        """
+        I = numpy.full((len(X), self.sequence_length), -1, dtype=numpy.int64)
+        for i, x in enumerate(X):
+            I[i, :min(len(x), self.sequence_length)] = [self.dictionary.get(w, -1) for w in x[:self.sequence_length]]
+        return I
+
+    def predict_proba(self, I):
+        """
+        Compute the probability distribution over the labels for each sentence.
+
+        Parameters:
+        -----------
+            - `I`: 2D array of word indexes (see `sentences_to_indexes`).
+
+        Returns:
+        --------
+        A 2D array where the i-th row is the distribution for the i-th sentence.
+        """
+        # (sentences, time steps, 4 * units), -1 selects the last row
+        Z = self.input_projection[I]
+        if self.bias is not None:
+            Z = Z.astype(numpy.float32)
+            if self.input_scale is not None:
+                Z *= self.input_scale
+            Z += self.bias
+        h = numpy.zeros((len(I), self.units), dtype=numpy.float32)
+        c = numpy.zeros((len(I), self.units), dtype=numpy.float32)
+        u = self.units
+        for t in range(I.shape[1]):
+            z = Z[:, t] + h @ self.recurrent_kernel
+            # gates in the keras order: input, forget, cell, output
+            i = self.recurrent_activation(z[:, :u])
+            f = self.recurrent_activation(z[:, u:2*u])
+            c = f * c + i * self.activation(z[:, 2*u:3*u])
+            o = self.recurrent_activation(z[:, 3*u:])
+            h = o * self.activation(c)
+        logits = h @ self.dense_kernel + self.dense_bias
+        exp = numpy.exp(logits - logits.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def predict_batch(self, sentences, k=3, with_scores=False):
+        """
+        Like `predict`, for a list of sentences.
+        """
+        Y = self.predict_proba(self.sentences_to_indexes([word_tokenize(s) for s in sentences]))
+        return top_k_labels(Y, self.labels, k, with_scores)
+
+    def predict(self, sentence, k=3, with_scores=False):
+        """
+        Predicts the relations a sentence most likely refers to.
+
+        Parameters:
+        -----------
+            - `sentence`: the sentence in input to the classifier.
+            - `k`: number of relations to return.
+            - `with_scores`: if True, each relation is paired with its probability.
+
+        Returns:
+        --------
+        A list of the `k` most probable relations, from the most probable one (pairs
+        (relation, probability) if `with_scores` is True).
+        """
+        return self.predict_batch([sentence], k, with_scores)[0]
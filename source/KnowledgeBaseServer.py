@@ -2,28 +2,42 @@
 This module implements the interface to the Knowledge Base System. The KBS is located on a server
 and it is accessible using REST API.
 """
+import logging
 import urllib3
 from bs4 import BeautifulSoup
 import json
 import time
 from Settings import KBS_host, KBS_path, KBS_port, BabelNetKEY
 
+logger = logging.getLogger(__name__)
+
 main_url = "http://" + KBS_host + ":" + KBS_port
+_path = KBS_path
 
 # create an instance of request pool
 _connection_pool = urllib3.connection_from_url(main_url)
 
+def connect(host, port, path):
+    """
+    Make the module talk to a different server (e.g. a local one) than the one
+    in the settings.
+    """
+    global main_url, _path, _connection_pool
+    main_url = "http://" + host + ":" + str(port)
+    _path = path
+    _connection_pool = urllib3.connection_from_url(main_url)
+
 def do_get(endpoint, params):
     """
     performs a GET request to the server.
     """
-    return _connection_pool.request('GET', KBS_path + endpoint, params).data.decode('utf8', 'ignore')
+    return _connection_pool.request('GET', _path + endpoint, params).data.decode('utf8', 'ignore')
 
 def do_post(endpoint, post_data):
     """
     performs a POST request to the server.
     """
-    return _connection_pool.request('POST', KBS_path + endpoint + "?key=" + BabelNetKEY, \
+    return _connection_pool.request('POST', _path + endpoint + "?key=" + BabelNetKEY, \
     body=post_data, headers={'Content-Type':'application/json'}).data.decode('utf8', 'ignore')
 
 def items_number_from(id):
@@ -52,7 +66,7 @@ def items_from(start_id, nItems=1000):
             final_resp += resp[1:-1] + ","
             counter += ld
             c_id = c_id + ld
-            print("{}/{}          ".format(counter, nItems), end='\r')
+            logger.debug("downloaded %d/%d items", counter, nItems)
             time.sleep(0.5)
     except Exception:
         time.sleep(5)
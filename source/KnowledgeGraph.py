@@ -1,17 +1,28 @@
+import logging
 from Graph import Graph
 from random import randint
+from EntryNormalization import normalize_entry, is_normalized, canonical_bab_id
+
+logger = logging.getLogger(__name__)
 
 class KnowledgeGraph:
     """
     This class is used to model the knowledge contained in KBS as a directed annotated graph.
     """
+    # version of the structure of the graph and of its entries. Dumps with a different
+    # version must be rebuilt.
+    FORMAT_VERSION = 3
+
     def __init__(self, domains_to_relations):
+        self.format_version = KnowledgeGraph.FORMAT_VERSION
         self._graph = Graph()
         # entry_counter is the next DataEntry ID expected to be added in the dataset.
         # In other words, is the number of DataEntry objects inserted in the graph.
         self.entry_counter = 0
         self.relations = set()
         self.domain_to_nodes = dict()
+        # lowercased name of the concepts -> IDs of the nodes with that name
+        self.name_to_nodes = dict()
         self.domains_to_relations = domains_to_relations
 
     def update(self, data, total_downloaded):
@@ -21,26 +32,24 @@ class KnowledgeGraph:
         Parameters:
         -----------
             -   `data`: json data fetched from the Knowledge Base Server that is also
-            put under a process of data validation.
+            put under a process of data validation (see EntryNormalization). Entries
+            that have not been normalized yet are normalized here.
             -   `total_downloaded`: the total number of data entries downloaded, that
             may differ from the one of data entries passed to this function. This number
             is used to keep track of the last record fetched from the KBS.
         
         Returns:
         --------
-        Nothing
+        The set of IDs of the nodes touched by the update.
         """
+        touched = set()
         for di in data:
-            node1 = di['c1']
-            node2 = di['c2']
+            if not is_normalized(di) and normalize_entry(di) is None:
+                continue
+            node1 = di['c1_id']
+            node2 = di['c2_id']
 
-            i1 = node1.rfind('bn:')
-            i2 = node2.rfind('bn:')
-            
-            node1 = node1[i1:]
-            node2 = node2[i2:]
-            for dom in di['domains']:
-                dom = dom.lower()
+            for dom in di['domain_keys']:
                 nodes_in_domain = None
                 try:
                     nodes_in_domain = self.domain_to_nodes[dom]
@@ -49,11 +58,17 @@ class KnowledgeGraph:
                     self.domain_to_nodes[dom] = nodes_in_domain
                 nodes_in_domain.add(node1)
 
-            self.relations.add(di['relation'].lower())
+            for name, node in ((di['c1_name'], node1), (di['c2_name'], node2)):
+                self.name_to_nodes.setdefault(KnowledgeGraph._name_key(name), set()).add(node)
+
+            self.relations.add(di['relation_key'])
             self._graph.add_edge(node1, node2, di)
+            touched.add(node1)
+            touched.add(node2)
 
         self.entry_counter += total_downloaded
         self.nodes = list(set(self._graph.outgoing.keys()).union(set(self._graph.incoming.keys())))
+        return touched
         
     def pick_entity_and_relation(self, domain):
         """
@@ -80,7 +95,7 @@ class KnowledgeGraph:
         try:
             nodesToChooseFrom = list(self.domain_to_nodes[domain])
         except KeyError:
-            print("No nodes in the current domain.")
+            logger.debug("No nodes in the current domain.")
             nodesToChooseFrom = list(self._graph.outgoing.keys())
         
         while len(unseen_relations) == 0 and len(nodesToChooseFrom) > 0:
@@ -88,12 +103,12 @@ class KnowledgeGraph:
             seen_relations = set()
             for other in self._graph.outgoing[chosenEntity].keys():
                 for relation in self._graph.outgoing[chosenEntity][other]:
-                    seen_relations.add(relation['relation'].lower())
+                    seen_relations.add(relation['relation_key'])
                     entityName = relation['c1']
             try:
                 unseen_relations = self.domains_to_relations[domain].difference(seen_relations)
             except KeyError:
-                print("No specialized relations")
+                logger.debug("No specialized relations")
                 unseen_relations = self.relations.difference(seen_relations)
 
         if len(unseen_relations) == 0:
@@ -119,14 +134,15 @@ class KnowledgeGraph:
         result = list()
 
         if len(entities) == 1:
-            ent_id = entities[0][1]['bab_id']
+            ent_id = canonical_bab_id(entities[0][1]['bab_id'])
             try:
                 outg = self._graph.outgoing[ent_id]
                 for relation in relations:
+                    relation = relation.lower()
                     if len(result) == 0:
                         for key in outg.keys():
                             for r in outg[key]:
-                                if r['relation'].lower() == relation.lower():
+                                if r['relation_key'] == relation:
                                     result.append( r )
             except KeyError:
                 pass
@@ -139,21 +155,52 @@ class KnowledgeGraph:
             
             for entities in couples:
                 # two entities
-                ent_1 = entities[0][1]['bab_id']
-                ent_2 = entities[1][1]['bab_id']
+                ent_1 = canonical_bab_id(entities[0][1]['bab_id'])
+                ent_2 = canonical_bab_id(entities[1][1]['bab_id'])
                 
                 try:
                     for relation in relations:
+                        relation = relation.lower()
                         if len(result) == 0:
                             g_relations = self._graph.outgoing[ent_1][ent_2]
                             for r in g_relations:
-                                if r['relation'] == relation:
+                                if r['relation_key'] == relation:
                                     result.append( r )        
                 except KeyError:
                     pass
             
         return result
 
+    def _name_key(name):
+        """
+        returns the key of a concept name in name_to_nodes.
+        """
+        return " ".join(name.replace('_', ' ').lower().split())
+
+    def find_entity(self, name):
+        """
+        Find a concept by its name.
+
+        Parameters:
+        -----------
+            - `name`: the name of the concept, e.g. as written in a question. A
+            leading article is ignored if the name is not found with it.
+
+        Returns:
+        --------
+        The ID of the only node with that name, or `None` if there is no such node or
+        the name is ambiguous.
+        """
+        key = KnowledgeGraph._name_key(name)
+        nodes = self.name_to_nodes.get(key)
+        if nodes is None:
+            words = key.split(' ', 1)
+            if len(words) == 2 and words[0] in ('a', 'an', 'the'):
+                nodes = self.name_to_nodes.get(words[1])
+        if nodes is None or len(nodes) != 1:
+            return None
+        return next(iter(nodes))
+
     def stats(self):
         nodes = set(self._graph.incoming.keys()).union(set(self._graph.outgoing.keys()))
         return len(nodes)
\ No newline at end of file
@@ -8,12 +8,14 @@ as the function that computes the most frequent words.
 import keras
 import pickle
 import numpy
-from statistics import stdev
+from collections import Counter
 from keras.models import Sequential
 from math import floor
+from statistics import stdev
 from keras.layers import Activation, Dense
 from keras.layers.recurrent import LSTM
 from ConfusionMatrix import ConfusionMatrix
+from Utilities import top_k_labels
 
 class LabelMapping:
     """
@@ -48,6 +50,130 @@ class WordTranslation:
         self._lookup_function = lookup_function
         self._dictionary = dictionary
 
+class WordCounts:
+    """
+    Counts the occurrences of each word in the sentences of each category (label).
+
+    Counts can be updated with new sentences at any time, and the set of frequent
+    words (see `frequent_words`) is computed from the counts without going through
+    the sentences again.
+    """
+    def __init__(self):
+        # category -> Counter of the words in its sentences
+        self._counts = dict()
+
+    def update(self, X, Y):
+        """
+        Add the words of new sentences to the counts.
+
+        Parameters:
+        -----------
+            - `X`: list of lists of words.
+            - `Y`: list of labels, the category of each sentence.
+        
+        Returns:
+        --------
+        Nothing
+        """
+        # group the words by category, so that each Counter is updated only once
+        words_per_category = dict()
+        for sentence, category in zip(X, Y):
+            try:
+                words_per_category[category].extend(sentence)
+            except KeyError:
+                words_per_category[category] = list(sentence)
+        for category, words in words_per_category.items():
+            try:
+                self._counts[category].update(words)
+            except KeyError:
+                self._counts[category] = Counter(words)
+
+    def matrix(self):
+        """
+        returns a triple (M, categories, words) where M is the (category x word) matrix
+        of the counts, whose rows and columns are in the order of `categories` and
+        `words`.
+        """
+        M, categories, words, _ = self._matrix()
+        return M, categories, words
+
+    def _matrix(self):
+        """
+        like `matrix`, also returning for each category the columns of its words, in
+        the order in which they were first counted in that category.
+        """
+        categories = list(self._counts.keys())
+        words = dict()
+        columns = [numpy.array([words.setdefault(w, len(words)) for w in self._counts[c]], dtype=numpy.int64)\
+            for c in categories]
+        M = numpy.zeros((len(categories), len(words)), dtype=numpy.int64)
+        for i, c in enumerate(categories):
+            M[i, columns[i]] = list(self._counts[c].values())
+        return M, categories, list(words), columns
+
+    def frequent_words(self, vect_dimension):
+        """
+        Constructs the set of frequent words and associates to each of them an integer.
+        In this way we have a mapping to translate sentences in bag-of-words.
+
+        For each category, the words whose relative frequency is at least half a
+        standard deviation above the average are kept. Then, the words kept for a
+        single category are preferred, since they characterize it, followed by those
+        kept for more categories, each group by decreasing frequency.
+
+        The result is the one of the original algorithm on all the sentences counted so
+        far, with ties broken in the same order (categories in order of appearance, and
+        words in order of appearance in each category), except that a category with a
+        single word keeps it, where the original algorithm failed.
+
+        Parameters:
+        -----------
+            - `vect_dimension`: dimension of the vectors that will represent a word.
+        
+        Returns:
+        --------
+        A dictionary that maps frequent words to integers.
+        """
+        M, categories, words, columns = self._matrix()
+        present = M > 0
+        # relative frequency of the words in each category
+        totals = M.sum(axis=1, keepdims=True)
+        F = M / numpy.maximum(totals, 1)
+        # average and (sample) standard deviation of the frequencies of the words that
+        # appear in each category, computed like the original algorithm did (summing in
+        # the order of the words, and with an exact stdev), so that words right at the
+        # threshold are kept or dropped the same way
+        avg = numpy.zeros((len(categories), 1))
+        std = numpy.zeros((len(categories), 1))
+        for i, cols in enumerate(columns):
+            items = (M[i, cols] / totals[i, 0]).tolist()
+            avg[i, 0] = sum(items) / max(1, len(items))
+            std[i, 0] = stdev(items) if len(items) > 1 else 0
+        important = present & (F >= avg + std / 2)
+
+        # number of categories each word is important for, and its total frequency
+        # (summed over the categories in order, as the original algorithm did)
+        rarity = important.sum(axis=0)
+        frequency = numpy.zeros(len(words))
+        for i in range(len(categories)):
+            frequency += numpy.where(important[i], F[i], 0)
+
+        # the important words in the order in which the original algorithm met them:
+        # category by category, each in the order its words were first counted
+        met = numpy.concatenate([cols[important[i, cols]] for i, cols in enumerate(columns)] +\
+            [numpy.zeros(0, dtype=numpy.int64)])
+        _, first = numpy.unique(met, return_index=True)
+        met = met[numpy.sort(first)]
+
+        def by_frequency(selected):
+            indexes = met[selected[met]]
+            return indexes[numpy.argsort(-frequency[indexes], kind='stable')]
+
+        h = floor(vect_dimension / 2.5)
+        uniques = by_frequency(rarity == 1)[:h]
+        commons = by_frequency(rarity > 1)[:vect_dimension - h]
+        return {words[w] : i for i, w in enumerate(numpy.concatenate((uniques, commons)).tolist())}
+
 def _compute_frequent_words(X, Y, vect_dimension):
     """
     Given a list of sentences, constructs the set of frequent words
@@ -65,66 +191,9 @@ def _compute_frequent_words(X, Y, vect_dimension):
     --------
     A dictionary that maps frequent words to integers.
     """
-    # first of all, associate to each category the most frequent words in it
-    frequencies_per_category = dict()
-    avg_per_category = dict()
-
-    for i, v in enumerate(Y):
-        current_dict = None 
-        try:
-            current_dict = frequencies_per_category[v]
-        except KeyError:
-            frequencies_per_category[v] = dict()
-            current_dict = frequencies_per_category[v]
-        
-        sentence = X[i]
-    
-        for word in sentence:
-            try:
-                current_dict[word] += 1
-            except KeyError:
-                current_dict[word] = 1
-        
-    words_rarity = dict()
-    words_frequency = dict()
-
-    for k in list(frequencies_per_category.keys()):
-        total = sum([frequencies_per_category[k][v] for v in frequencies_per_category[k].keys()]) 
-        current_dict = frequencies_per_category[k]
-        items = [current_dict[v]/total for v in current_dict.keys()]
-        # the first step is to remove words that have a frequency below average
-        avg = sum(items) / len(items)
-        std = stdev(items)
-        for v in list(current_dict.keys()):
-            current_dict[v] = current_dict[v] / total
-            if current_dict[v] < avg + std/2:
-                del current_dict[v]
-            else:
-                try:
-                    words_rarity[v] += 1
-                except KeyError:
-                    words_rarity[v] = 1
-                
-                try:
-                    words_frequency[v] += current_dict[v]
-                except KeyError:
-                    words_frequency[v] = current_dict[v]
-    
-    # in this second steps, we first chose the keywords that are unique 
-    # for each category, so that to characterize that cateogory
-    uniques = [w for w in words_rarity.keys() if words_rarity[w] == 1 ]
-    uniques = sorted(uniques, key=lambda x : words_frequency[x], reverse=True)
-
-    commons = [w for w in words_rarity.keys() if words_rarity[w] > 1]
-    commons = sorted(commons, key=lambda x : words_frequency[x], reverse=True)
-
-    h = floor(vect_dimension / 2.5)
-    all_important_words = uniques[:h] + commons[:vect_dimension - h]
-    mapping = dict()
-    for i, v in enumerate(all_important_words):
-        mapping[v] = i
-    
-    return mapping
+    counts = WordCounts()
+    counts.update(X, Y)
+    return counts.frequent_words(vect_dimension)
     
 
 def _word_to_one_hot(word, dictionary):
@@ -207,6 +276,36 @@ class LSTMSentenceClassifier:
             new_X.append(new_x)
         return new_X
 
+    def sentences_to_indexes(self, X, sequence_length = 20):
+        """
+        Compact form of `preprocess_input_sentences`: each word is represented by the
+        index of the 1 in its one-hot vector, or by -1 if its vector is all zeros (words
+        not in the dictionary and padding).
+
+        Parameters:
+        -----------
+            - `X`: a list of list of words
+            - `sequence_length`: an integer dictating how long a sequence must be.
+
+        Returns:
+        --------
+        A 2D array of shape (len(X), sequence_length).
+        """
+        I = numpy.full((len(X), sequence_length), -1, dtype=numpy.int16)
+        for i, x in enumerate(X):
+            I[i, :min(len(x), sequence_length)] = [self.dictionary.get(w, -1) for w in x[:sequence_length]]
+        return I
+
+    def indexes_to_input(self, I):
+        """
+        returns the 3D input of the model (as given by `preprocess_input_sentences`)
+        corresponding to the word indexes `I` given by `sentences_to_indexes`.
+        """
+        # the last row is the vector of the index -1
+        vectors = numpy.vstack((numpy.eye(len(self.dictionary), dtype=numpy.float32),\
+            numpy.zeros((1, len(self.dictionary)), dtype=numpy.float32)))
+        return vectors[I]
+
     def set_label_mapping(self, mapping):
         """
         Set the mapping that associate a number to each label.
@@ -220,6 +319,8 @@ class LSTMSentenceClassifier:
         Nothing
         """
         self.mapping = mapping
+        # labels by ID, to decode many predictions at once
+        self._label_array = numpy.array([mapping.IDToLabel(i) for i in range(len(mapping))], dtype=object)
 
     def preprocess_labels(self, Y):
         """
@@ -242,7 +343,63 @@ class LSTMSentenceClassifier:
             new_Y.append(nv)
         return new_Y
 
-    def train_LSTM_model(self, X, Y, params = None):
+    def labels_to_indexes(self, Y):
+        """
+        returns an array with the ID of each label in `Y`, or -1 for the labels that
+        are not in the label mapping.
+        """
+        return numpy.array([self.mapping._labelToIDMapping.get(y, -1) for y in Y], dtype=numpy.int16)
+
+    def indexes_to_labels(self, Y):
+        """
+        returns the one-hot labels (as given by `preprocess_labels`) corresponding to
+        the label IDs `Y`.
+        """
+        return numpy.eye(len(self.mapping), dtype=numpy.float32)[Y]
+
+    def index_batches(self, I, Y, batch_size, shuffle = True):
+        """
+        Generate endlessly batches (X, Y) of model inputs and one-hot labels from word
+        indexes and label IDs, skipping the samples with unknown labels (ID -1).
+
+        `I` and `Y` can be memory-mapped arrays: only the rows of the current batch are
+        read and expanded.
+        """
+        samples = numpy.flatnonzero(numpy.asarray(Y) >= 0)
+        while True:
+            if shuffle:
+                numpy.random.shuffle(samples)
+            for i in range(0, len(samples), batch_size):
+                # sorted, so that the rows are read in the order they are on disk
+                batch = numpy.sort(samples[i:i + batch_size])
+                yield self.indexes_to_input(I[batch]), self.indexes_to_labels(Y[batch])
+
+    def _steps(self, Y, batch_size):
+        """
+        returns the number of batches of `index_batches` in an epoch.
+        """
+        return max(1, -(-int((numpy.asarray(Y) >= 0).sum()) // batch_size))
+
+    def _build_model(self, params, input_shape):
+        """
+        Create and compile the keras model.
+        """
+        self.model = Sequential()
+        self.model.add(LSTM(params['lstm_units'], return_sequences=False, input_shape=input_shape,\
+            dropout=params['dropout'], use_bias=params['bias'], recurrent_dropout=params['rec_dropout'],\
+            recurrent_activation=params['rec_activation'], activation=params['lstm_activation']))
+        
+        dense_out = len(self.mapping)
+        self.model.add(Dense(dense_out, activation='softmax'))
+        self.model.compile(loss=params['loss'], optimizer=params['optimizer'], metrics=['accuracy'])
+
+    def _early_stopping(self, validation_data, patience):
+        if validation_data is not None and patience is not None:
+            # the model keeps the weights of the best epoch, not those of the last one
+            return [keras.callbacks.EarlyStopping(monitor='val_loss', patience=patience, restore_best_weights=True)]
+        return list()
+
+    def train_LSTM_model(self, X, Y, params = None, validation_data = None, patience = None, verbose = 1):
         """
         Train a LSTM model (neural network) using the training data in (X, Y).
         
@@ -255,10 +412,16 @@ class LSTMSentenceClassifier:
             `X`. It is assumed that the labels have already been preprocessed using the
             `preprocess_labels` function.
             - `params`: dictionary containing the parameters for the keras model (LSTM classifier).
+            - `validation_data`: optional pair (X, Y), preprocessed in the same way, on which
+            the model is evaluated after each epoch.
+            - `patience`: if given (together with `validation_data`), training stops when the
+            validation loss has not improved for this many epochs, and the weights of
+            the epoch with the lowest validation loss are restored.
+            - `verbose`: verbosity of the keras training.
         
         Returns:
         --------
-        Nothing
+        The keras `History` of the training.
 
         TODO:
         -----
@@ -270,15 +433,41 @@ class LSTMSentenceClassifier:
             params = self.default_lstm_params
         
         # now that preprocessing is done, lets build and train the model
-        self.model = Sequential()
-        self.model.add(LSTM(params['lstm_units'], return_sequences=False, input_shape=(len(X[0]), len(X[0][0])),\
-            dropout=params['dropout'], use_bias=params['bias'], recurrent_dropout=params['rec_dropout'],\
-            recurrent_activation=params['rec_activation'], activation=params['lstm_activation']))
-        
-        dense_out = len(self.mapping)
-        self.model.add(Dense(dense_out, activation='softmax'))
-        self.model.compile(loss=params['loss'], optimizer=params['optimizer'], metrics=['accuracy'])
-        self.model.fit(X, Y, verbose=1, batch_size=params['batch_size'], epochs=params['epochs'])
+        self._build_model(params, (len(X[0]), len(X[0][0])))
+        return self.model.fit(X, Y, verbose=verbose, batch_size=params['batch_size'], epochs=params['epochs'],\
+            validation_data=validation_data, callbacks=self._early_stopping(validation_data, patience))
+
+    def train_LSTM_model_on_indexes(self, I, Y, params = None, validation_data = None, patience = None,\
+        verbose = 1):
+        """
+        Like `train_LSTM_model`, but the training data are word indexes and label IDs
+        (see `sentences_to_indexes` and `labels_to_indexes`), e.g. memory-mapped from
+        the dataset cache. They are expanded to the model input one batch at a time.
+
+        Parameters:
+        -----------
+            - `I`, `Y`: word indexes and label IDs of the training set.
+            - `params`: dictionary containing the parameters for the keras model (LSTM classifier).
+            - `validation_data`: optional pair (I, Y) of word indexes and label IDs.
+            - `patience`: as in `train_LSTM_model`.
+            - `verbose`: verbosity of the keras training.
+
+        Returns:
+        --------
+        The keras `History` of the training.
+        """
+        if params is None:
+            params = self.default_lstm_params
+
+        self._build_model(params, (I.shape[1], len(self.dictionary)))
+        validation_generator, validation_steps = None, None
+        if validation_data is not None:
+            validation_generator = self.index_batches(validation_data[0], validation_data[1], params['batch_size'], False)
+            validation_steps = self._steps(validation_data[1], params['batch_size'])
+        return self.model.fit_generator(self.index_batches(I, Y, params['batch_size']),\
+            steps_per_epoch=self._steps(Y, params['batch_size']), epochs=params['epochs'], verbose=verbose,\
+            validation_data=validation_generator, validation_steps=validation_steps,\
+            callbacks=self._early_stopping(validation_data, patience))
     
     def save_model(self, path):
         """
@@ -345,33 +534,45 @@ class LSTMSentenceClassifier:
         print("")
         return
 
-    def _prediction_to_top_3_labels(self, Y):
-        new_Y = list()
-        for y in Y:
-            L = sorted(list(enumerate(y)), key=lambda x: x[1], reverse=True)
-            top_3_labels = list()
-            for i in range(3):
-                top_3_labels.append(self.mapping.IDToLabel(L[i][0]))
-            new_Y.append(top_3_labels)
-        return new_Y
+    def _decode_top_k(self, Y, k, with_scores):
+        """
+        Translate the probability distributions given by the model into the `k` most
+        probable labels (and optionally their probabilities) for each sample.
+        """
+        return top_k_labels(Y, self._label_array, k, with_scores)
+
+    def predict_proba(self, X, batch_size=256):
+        """
+        Compute the probability distribution over the labels for each sequence in X.
+
+        Parameters:
+        -----------
+            - `X`: the 3D input, i.e. a list of lists of vectors.
+            - `batch_size`: number of sequences given to the model at a time.
+
+        Returns:
+        --------
+        A 2D array where the i-th row is the distribution for X[i]; the j-th column
+        refers to the label with ID j in the label mapping.
+        """
+        return self.model.predict(numpy.asarray(X), batch_size=batch_size)
 
 
-    def predict(self, X):
+    def predict(self, X, k=3, with_scores=False):
         """
-        Assign a label to each sequence in X.
+        Assign labels to each sequence in X.
         
         Parameters:
         -----------
             - `X`: the 3D input, i.e. a list of lists of vectors.
+            - `k`: number of labels assigned to each sequence.
+            - `with_scores`: if True, each label is paired with its probability.
         
         Returns:
         --------
-        A list of one predicted labels.
+        A list with, for each sequence, the list of its `k` most probable labels,
+        from the most probable one. If `with_scores` is True, the elements of the
+        lists are pairs (label, probability).
         """
         Y = self.model.predict(numpy.asarray(X))
-        return self._prediction_to_top_3_labels(Y)
-        # Y = LSTMSentenceClassifier._prob_dist_to_one_hot(Y)
-        # new_Y = list()
-        # for y in Y:
-        #     new_Y.append(self.mapping.IDToLabel(y.index(1)))
-        # return new_Y
+        return self._decode_top_k(Y, k, with_scores)
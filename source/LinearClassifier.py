@@ -0,0 +1,217 @@
+"""
+This module implements a lightweight relation classifier: a logistic regression over
+the hashed words and pairs of consecutive words of a question, trained with NumPy.
+
+It is much less accurate than the LSTM, but it needs no keras and it classifies a
+question in a few microseconds, so it lives in the bot process and is used when the
+question classifier server does not answer in time (see Brain).
+"""
+import logging
+import os
+import re
+import pickle
+import zlib
+from threading import Lock
+import numpy
+from ConfusionMatrix import ConfusionMatrix
+from Utilities import top_k_labels, write_atomically
+from Settings import TMP_QC_PREFIX
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_MODEL_PATH = TMP_QC_PREFIX + "linear_model.npz"
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+def _tokenize(sentence):
+    return _TOKEN.findall(sentence.lower())
+
+class LinearClassifier:
+    """
+    Multinomial logistic regression over hashed bag-of-words features (words and pairs
+    of consecutive words). It has the same `predict` interface as `QuestionClassifier`.
+    """
+    def __init__(self, labels, n_features=2 ** 18):
+        """
+        Parameters:
+        -----------
+            - `labels`: the relations the classifier can predict.
+            - `n_features`: number of buckets the words are hashed into (a power of 2).
+        """
+        self.labels = numpy.array(labels, dtype=object)
+        self.labelIndexes = {label : i for i, label in enumerate(labels)}
+        self.n_features = n_features
+        # one row per bucket, plus the bias (always active) and the padding (always 0)
+        self.weights = numpy.zeros((n_features + 2, len(labels)), dtype=numpy.float32)
+        self._bias_index = n_features
+        self._padding_index = n_features + 1
+
+    def load(path):
+        """
+        returns the LinearClassifier saved in `path` (see `save`).
+        """
+        data = numpy.load(path)
+        clf = LinearClassifier(data['labels'].tolist(), int(data['n_features']))
+        clf.weights = data['weights']
+        return clf
+
+    def save(self, path):
+        """
+        Save the classifier in `path` (a `.npz` file). The file is replaced atomically,
+        so that a process loading it never reads it half written.
+        """
+        write_atomically(path, lambda tmp_path: numpy.savez(tmp_path, weights=self.weights,\
+            labels=numpy.array(self.labels.tolist(), dtype=str), n_features=self.n_features), suffix=".npz")
+
+    def features(self, tokens):
+        """
+        returns the sorted indexes of the buckets of the words and pairs of consecutive
+        words in `tokens`, and of the bias.
+        """
+        mask = self.n_features - 1
+        buckets = {zlib.crc32(t.encode()) & mask for t in tokens}
+        buckets.update(zlib.crc32((a + " " + b).encode()) & mask for a, b in zip(tokens, tokens[1:]))
+        buckets.add(self._bias_index)
+        return sorted(buckets)
+
+    def features_matrix(self, sentences):
+        """
+        returns a 2D array where the i-th row contains the features of the i-th sentence
+        (a string), padded with the index of the padding row.
+        """
+        features = [self.features(_tokenize(s)) for s in sentences]
+        width = max((len(f) for f in features), default=1)
+        F = numpy.full((len(features), width), self._padding_index, dtype=numpy.int32)
+        for i, f in enumerate(features):
+            F[i, :len(f)] = f
+        return F
+
+    def predict_proba_features(self, F):
+        """
+        returns the probability distribution over the labels for each row of features
+        in `F` (see `features_matrix`).
+        """
+        logits = self.weights[F].sum(axis=1)
+        exp = numpy.exp(logits - logits.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def train(self, sentences, Y, epochs=3, learning_rate=0.5, batch_size=256, verbose=1):
+        """
+        Train the classifier with AdaGrad on mini-batches.
+
+        Parameters:
+        -----------
+            - `sentences`: list of questions (strings).
+            - `Y`: the relation of each question; relations not in the labels of the
+            classifier are skipped.
+            - `epochs`: number of passes over the data.
+            - `learning_rate`: AdaGrad learning rate.
+            - `batch_size`: questions in each update.
+            - `verbose`: if 1, the loss of each epoch is printed.
+
+        Returns:
+        --------
+        Nothing
+        """
+        known = [i for i, y in enumerate(Y) if y in self.labelIndexes]
+        F = self.features_matrix([sentences[i] for i in known])
+        targets = numpy.array([self.labelIndexes[Y[i]] for i in known], dtype=numpy.int64)
+        squared_gradients = numpy.full(self.weights.shape, 1e-8, dtype=numpy.float32)
+
+        for epoch in range(epochs):
+            loss = 0.0
+            for batch in numpy.array_split(numpy.random.permutation(len(F)), max(1, len(F) // batch_size)):
+                Fb, tb, rows = F[batch], targets[batch], numpy.arange(len(batch))
+                P = self.predict_proba_features(Fb)
+                loss -= float(numpy.log(P[rows, tb] + 1e-12).sum())
+                # gradient of the cross entropy with respect to the logits
+                P[rows, tb] -= 1
+                P /= len(batch)
+                # each active bucket receives the gradient of the sentences it appears in
+                buckets, inverse = numpy.unique(Fb, return_inverse=True)
+                G = numpy.zeros((len(buckets), self.weights.shape[1]), dtype=numpy.float32)
+                numpy.add.at(G, inverse.ravel(), numpy.repeat(P, Fb.shape[1], axis=0))
+                squared_gradients[buckets] += G ** 2
+                self.weights[buckets] -= learning_rate * G / numpy.sqrt(squared_gradients[buckets])
+                self.weights[self._padding_index] = 0
+            if verbose:
+                print("epoch {}: loss {:.4f}".format(epoch + 1, loss / max(1, len(F))))
+
+    def predict_batch(self, sentences, k=3, with_scores=False):
+        """
+        Like `predict`, for a list of sentences.
+        """
+        return top_k_labels(self.predict_proba_features(self.features_matrix(sentences)), self.labels, k, with_scores)
+
+    def predict(self, sentence, k=3, with_scores=False):
+        """
+        Predicts the `k` relations a sentence most likely refers to, like
+        `QuestionClassifier.predict`.
+        """
+        return self.predict_batch([sentence], k, with_scores)[0]
+
+    def evaluate(self, sentences, Y, batch_size=4096):
+        """
+        returns the ConfusionMatrix of the most probable relation predicted for each
+        sentence against the relations in `Y`.
+        """
+        predicted = list()
+        for i in range(0, len(sentences), batch_size):
+            predicted += [p[0] for p in self.predict_batch(sentences[i:i + batch_size], k=1)]
+        return ConfusionMatrix(list(Y), predicted)
+
+def load_questions(split):
+    """
+    returns the questions (as strings) and the relations of a split of the dataset
+    built by QuestionClassifier.
+    """
+    X = pickle.load(open(TMP_QC_PREFIX + "x_" + split + ".bin", 'rb'))
+    Y = pickle.load(open(TMP_QC_PREFIX + "y_" + split + ".bin", 'rb'))
+    return [" ".join(x) for x in X], Y
+
+def train_fallback_classifier(path=FALLBACK_MODEL_PATH, verbose=1):
+    """
+    Train a LinearClassifier on the training split of the question classifier, report
+    its accuracy on the test split and save it in `path`.
+
+    The splits must have been built already (see `QuestionClassifier.load_dataset`).
+
+    Returns:
+    --------
+    The trained LinearClassifier.
+    """
+    X, Y = load_questions('training')
+    clf = LinearClassifier(sorted(set(Y)))
+    clf.train(X, Y, verbose=verbose)
+    del X, Y
+    X_test, Y_test = load_questions('test')
+    cm = clf.evaluate(X_test, Y_test)
+    if verbose:
+        cm.print_report()
+    logger.info("linear classifier trained, test accuracy %.3f%%", cm.getAccuracy())
+    clf.save(path)
+    return clf
+
+_fallback_classifier = None
+_fallback_mtime = None
+_fallback_lock = Lock()
+
+def get_fallback_classifier(path=FALLBACK_MODEL_PATH):
+    """
+    returns the LinearClassifier saved in `path`, loading it on first use and again
+    whenever the file changes, or None if it has not been trained yet.
+    """
+    global _fallback_classifier, _fallback_mtime
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return _fallback_classifier
+    if mtime != _fallback_mtime:
+        with _fallback_lock:
+            if mtime != _fallback_mtime:
+                try:
+                    _fallback_classifier = LinearClassifier.load(path)
+                except Exception:
+                    logger.exception("Error while loading the linear classifier, the current one is kept.")
+                _fallback_mtime = mtime
+    return _fallback_classifier
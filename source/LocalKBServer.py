@@ -0,0 +1,212 @@
+"""
+This module implements a local stand-in for the Knowledge Base Server, to be used
+for development, benchmarks and regression tests on machines without network.
+
+It serves the same REST endpoints used by the `KnowledgeBaseServer` module
+(`items_number_from`, `items_from`, `add_item` and `add_items`) over a file-backed
+store that is seeded from the KB dump. Page size, artificial latency and error
+injection can be configured to reproduce the behavior of the remote server.
+
+It can also be started as a script from the `source` folder:
+``python LocalKBServer.py [--port PORT] [--page-size N] [--latency S] [--error-rate P]``
+"""
+import argparse
+import json
+import os
+import pickle
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+from urllib.parse import urlparse, parse_qs
+from Settings import KB_DUMP_PATH, KBS_path
+
+LOCAL_KBS_STORE_PATH = "tmp/local_kbs.jsonl"
+
+class KBStore:
+    """
+    The entries of the local KBS. They are kept in memory and in a file with one JSON
+    entry per line, where new entries are appended.
+    """
+    def __init__(self, path=LOCAL_KBS_STORE_PATH, seed_path=KB_DUMP_PATH):
+        """
+        Parameters:
+        -----------
+            - `path`: the file backing the store. If it does not exist, it is created
+            with the entries of `seed_path`.
+            - `seed_path`: a pickled KB dump, or `None` to start with an empty store.
+        """
+        self.path = path
+        self._lock = Lock()
+        if not os.path.isfile(path):
+            entries = list()
+            if seed_path is not None and os.path.isfile(seed_path):
+                entries = pickle.load(open(seed_path, 'rb'))
+            self._write(entries)
+        with open(path) as f:
+            self.entries = [json.loads(line) for line in f if len(line.strip()) > 0]
+
+    def _write(self, entries, mode='w'):
+        with open(self.path, mode) as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+
+    def count_from(self, start_id):
+        """
+        returns the number of entries with id greater or equal to `start_id`.
+        """
+        return max(0, len(self.entries) - start_id)
+
+    def items_from(self, start_id, n_items):
+        """
+        returns at most `n_items` entries with id greater or equal to `start_id`.
+        """
+        return self.entries[start_id:start_id + n_items]
+
+    def add(self, entries):
+        """
+        append new entries to the store.
+        """
+        with self._lock:
+            self._write(entries, 'a')
+            self.entries.extend(entries)
+
+class _KBSRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles the HTTP requests to the local KBS, see `LocalKBServer`.
+    """
+    def do_GET(self):
+        url, params = self._parse()
+        if url is None:
+            return
+        start_id = int(params.get('id', 0))
+        if url == 'items_number_from':
+            self._reply(200, str(self.server.store.count_from(start_id)))
+        elif url == 'items_from':
+            items = self.server.store.items_from(start_id, self.server.page_size)
+            self._reply(200, json.dumps(items) if len(items) > 0 else "")
+        else:
+            self._reply(404, "")
+
+    def do_POST(self):
+        url, params = self._parse()
+        if url is None:
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            data = json.loads(body.decode('utf8'))
+        except ValueError:
+            self._reply(400, "-1")
+            return
+        if url == 'add_item':
+            self.server.store.add([data])
+        elif url == 'add_items':
+            self.server.store.add(data)
+        else:
+            self._reply(404, "")
+            return
+        self._reply(200, "1")
+
+    def _parse(self):
+        """
+        Apply latency and error injection, then return the endpoint name and the query
+        parameters of the request, or (None, None) if the request has been answered
+        already.
+        """
+        server = self.server
+        if server.latency > 0:
+            time.sleep(server.latency)
+        url = urlparse(self.path)
+        if not url.path.startswith(server.path):
+            self._reply(404, "")
+            return None, None
+        if server.error_rate > 0 and random.random() < server.error_rate:
+            with server.counters_lock:
+                server.injected_errors += 1
+            self._reply(500, "Internal Server Error")
+            return None, None
+        params = {k : v[0] for k, v in parse_qs(url.query).items()}
+        return url.path[len(server.path):], params
+
+    def _reply(self, status, body):
+        data = body.encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        return
+
+class LocalKBServer:
+    """
+    A HTTP server that implements the KBS REST API over a `KBStore`.
+    """
+    def __init__(self, store, host='localhost', port=0, path=KBS_path, page_size=1000,\
+        latency=0, error_rate=0):
+        """
+        Parameters:
+        -----------
+            - `store`: the `KBStore` holding the entries.
+            - `host`, `port`: address to listen on. With port 0, a free port is chosen.
+            - `path`: prefix of the endpoints, as in the KBS settings.
+            - `page_size`: maximum number of entries returned by `items_from`.
+            - `latency`: seconds each request is delayed.
+            - `error_rate`: probability (between 0 and 1) of answering a request with
+            an error.
+        """
+        self._server = ThreadingHTTPServer((host, port), _KBSRequestHandler)
+        self._server.daemon_threads = True
+        self._server.store = store
+        self._server.path = path
+        self._server.page_size = page_size
+        self._server.latency = latency
+        self._server.error_rate = error_rate
+        self._server.injected_errors = 0
+        self._server.counters_lock = Lock()
+        self.host, self.port = self._server.server_address[:2]
+        self.path = path
+        self._thread = None
+
+    def start(self):
+        """
+        Start serving requests in a background thread.
+        """
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def serve_forever(self):
+        """
+        Serve requests in the calling thread.
+        """
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def injected_errors(self):
+        """
+        returns the number of requests answered with an injected error.
+        """
+        return self._server.injected_errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--store', default=LOCAL_KBS_STORE_PATH, help="file backing the store")
+    parser.add_argument('--seed', default=KB_DUMP_PATH, help="KB dump used to create the store")
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0, help="seconds each request is delayed")
+    parser.add_argument('--error-rate', type=float, default=0, help="probability of answering with an error")
+    args = parser.parse_args()
+
+    server = LocalKBServer(KBStore(args.store, args.seed), args.host, args.port, KBS_path,\
+        args.page_size, args.latency, args.error_rate)
+    print("Local KBS listening on http://{}:{}{}".format(server.host, server.port, server.path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,243 @@
+"""
+This module implements lightweight metrics (counters, gauges and latency histograms)
+used to observe the question-answer pipeline.
+
+Metrics are kept in a process-wide registry. They can be exposed in the Prometheus
+text format through a local HTTP `/metrics` endpoint (see `start_metrics_server`)
+and summarized periodically in the log (see `start_summary_logger`).
+"""
+import logging
+import time
+from bisect import bisect_left
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (in seconds) of the buckets of latency histograms
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Counter:
+    """
+    A value that can only increase, e.g. the number of requests served.
+    """
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self):
+        return ["# HELP {} {}".format(self.name, self.description),\
+            "# TYPE {} counter".format(self.name),\
+            "{} {}".format(self.name, self.value)]
+
+    def summary(self):
+        return "{}={}".format(self.name, self.value)
+
+class Gauge:
+    """
+    A value that is read, when needed, by calling a function (e.g. a queue depth).
+    """
+    def __init__(self, name, description, function):
+        self.name = name
+        self.description = description
+        self.function = function
+
+    def render(self):
+        return ["# HELP {} {}".format(self.name, self.description),\
+            "# TYPE {} gauge".format(self.name),\
+            "{} {}".format(self.name, self.function())]
+
+    def summary(self):
+        return "{}={}".format(self.name, self.function())
+
+class Histogram:
+    """
+    Counts the observed values (e.g. latencies in seconds) in a fixed set of buckets.
+    """
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        # the last one counts the values greater than the largest bucket bound
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self._lock = Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.bucket_counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """
+        returns an upper bound of the `q`-th quantile (0 < q <= 1) of the observed
+        values, i.e. the bound of the bucket it falls in.
+        """
+        with self._lock:
+            counts = list(self.bucket_counts)
+            total = self.count
+        if total == 0:
+            return 0
+        cumulative = 0
+        for bound, c in zip(self.buckets + (float('inf'),), counts):
+            cumulative += c
+            if cumulative >= q * total:
+                return bound
+        return float('inf')
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.description),\
+            "# TYPE {} histogram".format(self.name)]
+        with self._lock:
+            cumulative = 0
+            for bound, c in zip(self.buckets, self.bucket_counts):
+                cumulative += c
+                lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, bound, cumulative))
+            lines.append('{}_bucket{{le="+Inf"}} {}'.format(self.name, self.count))
+            lines.append("{}_sum {}".format(self.name, self.sum))
+            lines.append("{}_count {}".format(self.name, self.count))
+        return lines
+
+    def summary(self):
+        if self.count == 0:
+            return "{}: no data".format(self.name)
+        return "{}: count={} mean={:.4f}s p50<={}s p95<={}s p99<={}s".format(self.name, self.count,\
+            self.sum / self.count, self.quantile(0.5), self.quantile(0.95), self.quantile(0.99))
+
+# all the metrics of the process, by name
+_registry = dict()
+_registry_lock = Lock()
+
+def _get_or_create(name, factory):
+    with _registry_lock:
+        try:
+            return _registry[name]
+        except KeyError:
+            metric = factory()
+            _registry[name] = metric
+            return metric
+
+def counter(name, description=""):
+    """
+    Get the counter called `name`, creating it if it does not exist.
+    """
+    return _get_or_create(name, lambda: Counter(name, description))
+
+def histogram(name, description="", buckets=DEFAULT_BUCKETS):
+    """
+    Get the histogram called `name`, creating it if it does not exist.
+    """
+    return _get_or_create(name, lambda: Histogram(name, description, buckets))
+
+def gauge(name, description, function):
+    """
+    Register a gauge whose value is obtained by calling `function`.
+    """
+    with _registry_lock:
+        _registry[name] = Gauge(name, description, function)
+
+class timer:
+    """
+    Context manager that records, in the histogram called `name`, how long the
+    enclosed block takes.
+
+    Example:
+    --------
+        with Metrics.timer('knowledge_graph_query_seconds'):
+            result = knowledgeGraph.query(entities, relation)
+    """
+    def __init__(self, name, description=""):
+        self.histogram = histogram(name, description)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed)
+        return False
+
+def timed(name, description=""):
+    """
+    Decorator that records, in the histogram called `name`, the duration of each
+    call to the decorated function.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(name, description):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def render():
+    """
+    returns all the metrics in the Prometheus text exposition format.
+    """
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+    lines = list()
+    for metric in metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+def summary():
+    """
+    returns a human readable summary of all the metrics, one per line.
+    """
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+    return "\n".join(metric.summary() for metric in metrics)
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+            return
+        data = render().encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        return
+
+def start_metrics_server(host, port):
+    """
+    Expose the metrics on `http://host:port/metrics`, serving requests from a
+    background thread.
+
+    Returns:
+    --------
+    The `ThreadingHTTPServer` instance.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("metrics available at http://%s:%d/metrics", host, server.server_address[1])
+    return server
+
+def start_summary_logger(interval):
+    """
+    Log a summary of all the metrics every `interval` seconds, from a background thread.
+    """
+    def log_summary():
+        while True:
+            time.sleep(interval)
+            logger.info("metrics summary:\n%s", summary())
+    Thread(target=log_summary, daemon=True).start()
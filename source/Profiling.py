@@ -0,0 +1,94 @@
+"""
+This module implements an opt-in profiler for slow requests.
+
+When enabled in the settings (`PROFILE_SLOW_REQUESTS`), requests wrapped in
+`profile_request` are run under cProfile, and the profile of any request slower than
+`PROFILE_THRESHOLD` seconds is written in `PROFILE_DIR`, tagged with the chat ID and
+the FSA state. Only the newest `PROFILE_MAX_FILES` profiles are kept.
+
+Profiles can be inspected with `python -m pstats <file>` or any cProfile viewer.
+Note that cProfile only sees the thread it runs in: time spent waiting for work done
+in other threads (e.g. the relation prediction in Brain) shows up as a wait.
+"""
+import cProfile
+import logging
+import os
+import random
+import time
+from threading import local, Lock
+from Settings import PROFILE_SLOW_REQUESTS, PROFILE_THRESHOLD, PROFILE_SAMPLE_RATE, PROFILE_DIR,\
+    PROFILE_MAX_FILES
+
+logger = logging.getLogger(__name__)
+
+# tells whether a profiler is already running in the current thread
+_thread_state = local()
+_files_lock = Lock()
+
+class profile_request:
+    """
+    Context manager that profiles the enclosed block, and saves the profile if the
+    block takes longer than the threshold. It does nothing if profiling is disabled,
+    if the request is not sampled, or if a profiler is already active in the thread.
+
+    Example:
+    --------
+        with profile_request(chat_id, 'DIRECTION'):
+            bot_answer_question(session, send, question)
+    """
+    def __init__(self, chat_id, state):
+        self.chat_id = chat_id
+        self.state = state
+        self.profiler = None
+
+    def __enter__(self):
+        if not PROFILE_SLOW_REQUESTS or getattr(_thread_state, 'active', False):
+            return self
+        if random.random() >= PROFILE_SAMPLE_RATE:
+            return self
+        self.profiler = cProfile.Profile()
+        try:
+            self.profiler.enable()
+        except ValueError:
+            # another profiling tool is active
+            self.profiler = None
+            return self
+        _thread_state.active = True
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler is None:
+            return False
+        self.profiler.disable()
+        _thread_state.active = False
+        elapsed = time.perf_counter() - self.start
+        if elapsed >= PROFILE_THRESHOLD:
+            try:
+                path = _save_profile(self.profiler, self.chat_id, self.state, elapsed)
+                logger.warning("slow request (%.3fs, chat %s, state %s), profile saved in %s",\
+                    elapsed, self.chat_id, self.state, path)
+            except OSError:
+                logger.exception("Error while saving a profile.")
+        return False
+
+def _save_profile(profiler, chat_id, state, elapsed):
+    """
+    Write a profile in the profiles directory, removing the oldest ones if there are
+    more than PROFILE_MAX_FILES.
+
+    Returns:
+    --------
+    The path of the profile.
+    """
+    now = time.time()
+    name = "{}.{:03d}_{:06d}ms_chat{}_{}.prof".format(time.strftime("%Y%m%d-%H%M%S", time.localtime(now)),\
+        int(now * 1000) % 1000, int(elapsed * 1000), chat_id, state)
+    path = os.path.join(PROFILE_DIR, name)
+    with _files_lock:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(path)
+        profiles = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith('.prof'))
+        for old in profiles[:max(0, len(profiles) - PROFILE_MAX_FILES)]:
+            os.remove(os.path.join(PROFILE_DIR, old))
+    return path
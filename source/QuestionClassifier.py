@@ -2,16 +2,30 @@
 This module implements a machine learning classifier that is able to predict a relation
 given a question. It is built on top of a LSTMSentenceClassifier.
 """
+import logging
 import os
+import time
+import numpy
 from nltk import word_tokenize
 import pickle
 from ConfusionMatrix import ConfusionMatrix
 import LSTMSentenceClassifier as lstm
 from LSTMSentenceClassifier import LSTMSentenceClassifier
-from Utilities import random_plit
+from Utilities import random_plit, top_k_indexes, write_atomically
 import DataAccessManager
 from math import floor
-from Settings import TMP_QC_PREFIX
+from InferenceClassifier import InferenceClassifier, export_model
+from LinearClassifier import train_fallback_classifier
+from Settings import TMP_QC_PREFIX, QC_USE_EXPORTED_MODEL, QC_QUANTIZATION, QC_MAX_ACCURACY_DROP
+
+logger = logging.getLogger(__name__)
+
+EXPORTED_MODEL_PATH = TMP_QC_PREFIX + "lstm_model.npz"
+# bag of words updated with new entries, used from the next training on (see
+# `update_bag_of_words`)
+PENDING_BAG_OF_WORDS_PATH = TMP_QC_PREFIX + "bow_next.bin"
+
+_DATASET_SPLITS = ('training', 'test', 'dev')
 
 def _extract_question_relation_pairs(jdata):
     """
@@ -78,8 +92,13 @@ def _build_training_validation_test_sets(verbose=1):
         del unprocessed_training
         pickle.dump(x_training, open(TMP_QC_PREFIX + "x_training.bin", 'wb'))
         pickle.dump(y_training, open(TMP_QC_PREFIX + "y_training.bin", 'wb'))
-        translationData = lstm.get_bag_of_words_translator(x_training, y_training, 80)
-        pickle.dump(translationData, open(TMP_QC_PREFIX + "bow.bin", 'wb'))
+        word_counts = lstm.WordCounts()
+        word_counts.update(x_training, y_training)
+        _save_bag_of_words(word_counts, 80, TMP_QC_PREFIX + "bow.bin")
+        if os.path.isfile(PENDING_BAG_OF_WORDS_PATH):
+            # computed from the counts of the previous dataset
+            os.remove(PENDING_BAG_OF_WORDS_PATH)
+        get_label_mapping(y_training)
         del x_training
         del y_training
 
@@ -101,6 +120,110 @@ def _build_training_validation_test_sets(verbose=1):
         del x_dev
         del y_dev
 
+        if verbose:
+            print("writing the vectorized datasets")
+        for split in _DATASET_SPLITS:
+            _write_dataset_cache(split)
+
+def _dataset_cache_paths(split):
+    return TMP_QC_PREFIX + "x_" + split + ".npy", TMP_QC_PREFIX + "y_" + split + ".npy"
+
+def _write_dataset_cache(split):
+    """
+    Vectorize a dataset split with the current bag of words and label mapping, and save
+    it as two `.npy` files: the word indexes of the questions and the label IDs of the
+    relations (see `LSTMSentenceClassifier.sentences_to_indexes` and `labels_to_indexes`).
+    """
+    clf = LSTMSentenceClassifier(pickle.load(open(TMP_QC_PREFIX + "bow.bin", 'rb')))
+    clf.set_label_mapping(get_label_mapping(pickle.load(open(TMP_QC_PREFIX + "y_training.bin", 'rb'))))
+    arrays = (clf.sentences_to_indexes(pickle.load(open(TMP_QC_PREFIX + "x_" + split + ".bin", 'rb'))),\
+        clf.labels_to_indexes(pickle.load(open(TMP_QC_PREFIX + "y_" + split + ".bin", 'rb'))))
+    for path, array in zip(_dataset_cache_paths(split), arrays):
+        def save(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                numpy.save(f, array)
+        # other processes may be reading the old version, or writing a new one
+        write_atomically(path, save)
+
+def load_dataset(split):
+    """
+    Open a dataset split in vectorized form, memory-mapped: loading is almost
+    instantaneous, and the processes that use the same split share one copy of it.
+
+    The `.npy` files are created, or recreated, if they are older than the split,
+    the bag of words or the label mapping.
+
+    Parameters:
+    -----------
+        - `split`: one of 'training', 'test' and 'dev'.
+
+    Returns:
+    --------
+    A pair (I, Y) of read-only arrays: the word indexes of the questions and the
+    label IDs of their relations (-1 for relations not in the label mapping).
+    """
+    if not os.path.isfile(TMP_QC_PREFIX + "x_training.bin"):
+        _build_training_validation_test_sets()
+    paths = _dataset_cache_paths(split)
+    sources = [TMP_QC_PREFIX + f for f in ("x_" + split + ".bin", "y_" + split + ".bin", "bow.bin", "labelMapping.bin")]
+    latest_source = max(os.path.getmtime(f) for f in sources if os.path.isfile(f))
+    if any(not os.path.isfile(p) or os.path.getmtime(p) < latest_source for p in paths):
+        _write_dataset_cache(split)
+    return tuple(numpy.load(p, mmap_mode='r') for p in paths)
+
+def _save_bag_of_words(word_counts, dim, path):
+    """
+    Save in the temp folder the word counts, and in `path` the bag of words computed
+    from them.
+    """
+    pickle.dump(word_counts, open(TMP_QC_PREFIX + "word_counts.bin", 'wb'))
+    translationData = lstm.WordTranslation(lstm._word_to_one_hot, word_counts.frequent_words(dim))
+    def save(tmp_path):
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(translationData, f)
+    write_atomically(path, save)
+
+def update_bag_of_words(jdata, dim=80):
+    """
+    Add the questions of new KBS entries to the word counts, and recompute the bag of
+    words from the updated counts instead of processing the whole training set again.
+
+    The trained model only works with the bag of words it was trained on, so the new
+    one is saved in PENDING_BAG_OF_WORDS_PATH, and it replaces the current one at the
+    beginning of the next training (see `QuestionClassifier.train_model`).
+
+    Parameters:
+    -----------
+        - `jdata`: list of new KBS data entries.
+        - `dim`: number of words in the bag of words.
+
+    Returns:
+    --------
+    Nothing
+    """
+    if os.path.isfile(TMP_QC_PREFIX + "word_counts.bin"):
+        word_counts = pickle.load(open(TMP_QC_PREFIX + "word_counts.bin", 'rb'))
+    else:
+        # the bag of words was computed by an older version, start from the training set
+        if not os.path.isfile(TMP_QC_PREFIX + "x_training.bin"):
+            _build_training_validation_test_sets()
+        word_counts = lstm.WordCounts()
+        word_counts.update(pickle.load(open(TMP_QC_PREFIX + "x_training.bin", 'rb')),\
+            pickle.load(open(TMP_QC_PREFIX + "y_training.bin", 'rb')))
+    x_new, y_new = _extract_question_relation_pairs(jdata)
+    word_counts.update(x_new, y_new)
+    _save_bag_of_words(word_counts, dim, PENDING_BAG_OF_WORDS_PATH)
+
+def get_label_mapping(y_train):
+    """
+    returns the mapping between relations and IDs used by the classifier, creating
+    it from the relations of the training set `y_train` if it does not exist yet.
+    """
+    if not os.path.isfile(TMP_QC_PREFIX + "labelMapping.bin"):
+        mapping = lstm.LabelMapping(set(y_train))
+        pickle.dump(mapping, open(TMP_QC_PREFIX + "labelMapping.bin", 'wb'))
+    return pickle.load(open(TMP_QC_PREFIX + "labelMapping.bin", 'rb'))
+
 class QuestionClassifier:
     """
     Based on LSTM, this classifier can predict a relation a given question refers to.
@@ -123,75 +246,302 @@ class QuestionClassifier:
     def train_model(self):
         """
         Train the Question Classifier using the datasets in the temp directory.
+
+        If a bag of words updated with new entries is pending, it replaces the current
+        one before training (the datasets are vectorized again with it).
         """
-        if not os.path.isfile(TMP_QC_PREFIX + "x_training.bin"):
-            _build_training_validation_test_sets()
-        
-        x_train = pickle.load(open(TMP_QC_PREFIX + "x_training.bin", 'rb'))
-        y_train = pickle.load(open(TMP_QC_PREFIX + "y_training.bin", 'rb'))
-        
-        if not os.path.isfile(TMP_QC_PREFIX + "labelMapping.bin"):
-            labels = set(y_train)
-            mapping = lstm.LabelMapping(labels)
-            pickle.dump(mapping, open(TMP_QC_PREFIX + "labelMapping.bin", 'wb'))
-        
-        mapping = pickle.load(open(TMP_QC_PREFIX + "labelMapping.bin", 'rb'))
-        self._lstm_classifier.set_label_mapping(mapping)
-        x_train = self._lstm_classifier.preprocess_input_sentences(x_train)
-        y_train = self._lstm_classifier.preprocess_labels(y_train)
+        if os.path.isfile(PENDING_BAG_OF_WORDS_PATH):
+            os.replace(PENDING_BAG_OF_WORDS_PATH, TMP_QC_PREFIX + "bow.bin")
+            self._lstm_classifier = LSTMSentenceClassifier(pickle.load(open(TMP_QC_PREFIX + "bow.bin", 'rb')))
+        x_train, y_train = load_dataset('training')
+        self._lstm_classifier.set_label_mapping(pickle.load(open(TMP_QC_PREFIX + "labelMapping.bin", 'rb')))
         print("training started..")
-        self._lstm_classifier.train_LSTM_model(x_train, y_train, self.params)
+        self._lstm_classifier.train_LSTM_model_on_indexes(x_train, y_train, self.params)
         self._lstm_classifier.save_model(TMP_QC_PREFIX + "lstm_model")
+        self.export_inference_model()
+        # the fallback of the bot process is trained on the same data
+        train_fallback_classifier()
+
+    def export_inference_model(self, path=EXPORTED_MODEL_PATH, quantization=QC_QUANTIZATION,\
+        max_accuracy_drop=QC_MAX_ACCURACY_DROP):
+        """
+        Export the trained model for the InferenceClassifier.
+
+        If `quantization` is given, the quantized model is calibrated against the
+        float32 one on the dev split (see `calibrate_quantization`), and it is exported
+        only if its accuracy is not more than `max_accuracy_drop` points lower.
+
+        Parameters:
+        -----------
+            - `path`: the `.npz` file to write.
+            - `quantization`: None, 'float16' or 'int8'.
+            - `max_accuracy_drop`: largest accepted drop of the top-1 accuracy, in
+            percentage points.
+
+        Returns:
+        --------
+        The result of the calibration, or None if the model is not quantized.
+        """
+        mapping = self._lstm_classifier.mapping
+        labels = [mapping.IDToLabel(i) for i in range(len(mapping))]
+        export_model(self._lstm_classifier.model, self._lstm_classifier.dictionary, labels, path)
+        if quantization is None:
+            return None
+
+        quantized_path = "{}_{}.npz".format(os.path.splitext(path)[0], quantization)
+        export_model(self._lstm_classifier.model, self._lstm_classifier.dictionary, labels, quantized_path,\
+            quantization=quantization)
+        calibration = calibrate_quantization(path, quantized_path)
+        if calibration['accuracy_drop'] <= max_accuracy_drop:
+            os.replace(quantized_path, path)
+        else:
+            os.remove(quantized_path)
+            logger.warning("%s quantization lowers the dev accuracy by %.3f points, the float32 model is used",\
+                quantization, calibration['accuracy_drop'])
+        return calibration
 
-    def predict(self, sentence):
+    def predict(self, sentence, k=3, with_scores=False):
         """
-        Predicts a relation given a sentence.
+        Predicts the relations a sentence most likely refers to.
 
         Parameters:
         -----------
             - `sentence`: the sentence in input to the classifier.
+            - `k`: number of relations to return.
+            - `with_scores`: if True, each relation is paired with its probability.
         
         Returns:
         --------
-        A string containing the relation.
+        A list of the `k` most probable relations, from the most probable one (pairs
+        (relation, probability) if `with_scores` is True).
         """
         tok = word_tokenize(sentence)
         X = [tok]
         X = self._lstm_classifier.preprocess_input_sentences(X)
-        Y = self._lstm_classifier.predict(X)
+        Y = self._lstm_classifier.predict(X, k, with_scores)
         return Y[0]
 
     def test(self, x_test, y_test):
         """
-        Predicts a relation given a sentence.
+        Test the classifier against a test set.
 
         Parameters:
         -----------
-            - `sentence`: the sentence in input to the classifier.
+            - `x_test`: list of tokenized questions.
+            - `y_test`: the corresponding relations.
         
         Returns:
         --------
-        A string containing the relation.
+        A `ConfusionMatrix` instance.
+        """
+        return self.evaluate(x_test, y_test)['confusion_matrix']
+
+    def evaluate(self, x_test, y_test, batch_size=1024, k=3):
+        """
+        Evaluate the classifier on a test set, processing it in batches so that only
+        one batch at a time is converted into the input of the model.
+
+        Parameters:
+        -----------
+            - `x_test`: list of tokenized questions.
+            - `y_test`: the corresponding relations.
+            - `batch_size`: number of questions processed at a time.
+            - `k`: a question counts as correct for the top-k accuracy if its relation
+            is among the `k` most probable ones.
+
+        Returns:
+        --------
+        A dictionary with the following keys:
+            - `confusion_matrix`: a `ConfusionMatrix` of the most probable relations.
+            - `top1_accuracy`, `topk_accuracy`: percentages of correct questions.
+            - `samples`, `seconds`: number of questions and time taken to classify them.
+            - `throughput`: questions classified per second.
+        """
+        mapping = self._lstm_classifier.mapping
+        labels = [mapping.IDToLabel(i) for i in range(len(mapping))]
+        # relations never seen in training get an ID after the known ones
+        labels += sorted(set(y_test) - set(labels))
+        label_ids = {label : i for i, label in enumerate(labels)}
+        truth = numpy.array([label_ids[y] for y in y_test], dtype=numpy.int64)
+        return self._evaluate_indexes(self._lstm_classifier.sentences_to_indexes(x_test), truth, labels, batch_size, k)
+
+    def evaluate_split(self, split='test', batch_size=1024, k=3):
+        """
+        Like `evaluate`, on a split of the dataset built by the classifier, read from
+        its memory-mapped vectorized form (see `load_dataset`).
+
+        Parameters:
+        -----------
+            - `split`: one of 'training', 'test' and 'dev'.
+            - `batch_size`, `k`: as in `evaluate`.
+
+        Returns:
+        --------
+        The same dictionary returned by `evaluate`.
+        """
+        I, Y = load_dataset(split)
+        mapping = self._lstm_classifier.mapping
+        labels = [mapping.IDToLabel(i) for i in range(len(mapping))]
+        truth = numpy.asarray(Y, dtype=numpy.int64)
+        if (truth < 0).any():
+            # relations never seen in training
+            truth = numpy.where(truth < 0, len(labels), truth)
+            labels.append("<unknown>")
+        return self._evaluate_indexes(I, truth, labels, batch_size, k)
+
+    def _evaluate_indexes(self, I, truth, labels, batch_size, k):
+        """
+        Implementation of evaluate, given the word indexes of the questions and the IDs
+        of their relations in `labels`.
         """
-        X = self._lstm_classifier.preprocess_input_sentences(x_test)
-        Y = self._lstm_classifier.predict(X)
-        cm = ConfusionMatrix(y_test, Y)
-        return cm
+        n_labels = len(labels)
+        counts = numpy.zeros(n_labels * n_labels, dtype=numpy.int64)
+        correct_top1, correct_topk = 0, 0
+        start = time.perf_counter()
+        for i in range(0, len(I), batch_size):
+            X = self._lstm_classifier.indexes_to_input(I[i:i + batch_size])
+            batch_truth = truth[i:i + batch_size]
+            top = top_k_indexes(self._lstm_classifier.predict_proba(X), k)
+            counts += numpy.bincount(batch_truth * n_labels + top[:, 0], minlength=n_labels * n_labels)
+            correct_top1 += int((top[:, 0] == batch_truth).sum())
+            correct_topk += int((top == batch_truth[:, None]).any(axis=1).sum())
+        seconds = time.perf_counter() - start
+
+        # like ConfusionMatrix(truth, predicted), only the labels that appear in the
+        # truth or in the predictions, sorted: the others would only add empty rows
+        # and lower the mean precision, recall and F-measure
+        counts = counts.reshape(n_labels, n_labels)
+        used = sorted(numpy.flatnonzero(counts.sum(axis=0) + counts.sum(axis=1)), key=lambda i: labels[i])
+        n_samples = max(1, len(I))
+        return {
+            'confusion_matrix' : ConfusionMatrix.from_matrix(counts[numpy.ix_(used, used)], [labels[i] for i in used]),
+            'top1_accuracy' : correct_top1 / n_samples * 100,
+            'topk_accuracy' : correct_topk / n_samples * 100,
+            'samples' : len(I),
+            'seconds' : seconds,
+            'throughput' : len(I) / seconds if seconds > 0 else 0
+        }
+
+def calibrate_quantization(reference_path, quantized_path, split='dev', batch_size=1024):
+    """
+    Compare the predictions of a quantized export of the model with the float32 one.
+
+    Parameters:
+    -----------
+        - `reference_path`: the float32 model exported for the InferenceClassifier.
+        - `quantized_path`: the quantized export of the same model.
+        - `split`: the dataset split used for the comparison.
+        - `batch_size`: number of questions classified at a time.
+
+    Returns:
+    --------
+    A dictionary with the top-1 accuracy of both models and the drop between them (in
+    percentage points), the percentage of questions where their top relation agrees
+    and the largest difference between their probabilities.
+    """
+    reference = InferenceClassifier(reference_path)
+    quantized = InferenceClassifier(quantized_path)
+    I, Y = load_dataset(split)
+    correct_reference, correct_quantized, agreements, max_difference = 0, 0, 0, 0.0
+    for i in range(0, len(I), batch_size):
+        batch = numpy.asarray(I[i:i + batch_size])
+        truth = Y[i:i + batch_size]
+        P_reference, P_quantized = reference.predict_proba(batch), quantized.predict_proba(batch)
+        top_reference, top_quantized = P_reference.argmax(axis=1), P_quantized.argmax(axis=1)
+        correct_reference += int((top_reference == truth).sum())
+        correct_quantized += int((top_quantized == truth).sum())
+        agreements += int((top_reference == top_quantized).sum())
+        max_difference = max(max_difference, float(numpy.abs(P_reference - P_quantized).max()))
+
+    n_samples = max(1, len(I))
+    result = {
+        'reference_accuracy' : correct_reference / n_samples * 100,
+        'quantized_accuracy' : correct_quantized / n_samples * 100,
+        'agreement' : agreements / n_samples * 100,
+        'max_probability_difference' : max_difference
+    }
+    result['accuracy_drop'] = result['reference_accuracy'] - result['quantized_accuracy']
+    logger.info("quantization %s: dev accuracy %.3f%% (float32 %.3f%%), top relation agreement %.3f%%",\
+        quantized.quantization, result['quantized_accuracy'], result['reference_accuracy'], result['agreement'])
+    return result
 
 def get_question_classifier():
     """
     Get an instance of a Question Classifier.
 
-    If there is a trained model already, return that. Otherwise, train a new model.
+    If there is a trained model already, return that. Otherwise, or if the model is
+    older than its bag of words or label mapping, train a new model.
 
     Returns:
     --------
     An instance of QuestionClassifier. 
     """
-    if os.path.isfile(TMP_QC_PREFIX + "lstm_model"):
+    if _trained_model_is_current():
         q = QuestionClassifier(TMP_QC_PREFIX + "lstm_model")
         return q
     else:
         q = QuestionClassifier()
         q.train_model()
         return q
+
+# the files that make up a trained classifier
+_CLASSIFIER_FILES = ("lstm_model", "labelMapping.bin", "bow.bin")
+
+def _trained_model_is_current():
+    """
+    returns True if all the files of the trained classifier exist and the model is not
+    older than the others, i.e. it was trained with the current bag of words and label
+    mapping.
+    """
+    try:
+        mtimes = [os.path.getmtime(TMP_QC_PREFIX + f) for f in _CLASSIFIER_FILES]
+    except OSError:
+        return False
+    return mtimes[0] >= max(mtimes[1:])
+
+def question_classifier_version():
+    """
+    returns the modification times of the files of the trained classifier (model, label
+    mapping and bag of words, and the exported model if QC_USE_EXPORTED_MODEL is True),
+    or `None` if some of them is missing or if the model is older than the other files,
+    i.e. it has not been retrained after they changed. A different value means that a
+    new model has been saved or exported.
+    """
+    if not _trained_model_is_current():
+        return None
+    try:
+        version = tuple(os.path.getmtime(TMP_QC_PREFIX + f) for f in _CLASSIFIER_FILES)
+    except OSError:
+        return None
+    if QC_USE_EXPORTED_MODEL:
+        # a missing export is written by load_question_classifier
+        exported = os.path.getmtime(EXPORTED_MODEL_PATH) if os.path.isfile(EXPORTED_MODEL_PATH) else None
+        version += (exported,)
+    return version
+
+def load_question_classifier():
+    """
+    Load the trained classifier saved in the temp directory (training it if there is
+    none), and make a first prediction so that it is ready to answer as soon as it
+    is returned.
+
+    If QC_USE_EXPORTED_MODEL is True, the model exported for the InferenceClassifier
+    is used, exporting it first if it is older than the keras model. A model older
+    than its bag of words or label mapping is trained again first.
+
+    Returns:
+    --------
+    An instance of QuestionClassifier or of InferenceClassifier.
+    """
+    if QC_USE_EXPORTED_MODEL:
+        model_path = TMP_QC_PREFIX + "lstm_model"
+        if not _trained_model_is_current():
+            # a new model is trained, and exported
+            get_question_classifier()
+        if not os.path.isfile(EXPORTED_MODEL_PATH) or os.path.getmtime(EXPORTED_MODEL_PATH) < os.path.getmtime(model_path):
+            QuestionClassifier(model_path).export_inference_model()
+        q = InferenceClassifier(EXPORTED_MODEL_PATH)
+    else:
+        q = get_question_classifier()
+    q.predict("what is the capital of italy?")
+    return q
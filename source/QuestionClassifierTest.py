@@ -1,10 +1,18 @@
 from QuestionClassifier import QuestionClassifier, get_question_classifier
-import pickle
+from LinearClassifier import get_fallback_classifier, train_fallback_classifier, load_questions
 
 qc = get_question_classifier()
-x_test = pickle.load(open('tmp/qc_x_test.bin', 'rb'))
-y_test = pickle.load(open('tmp/qc_y_test.bin', 'rb'))
 
 
-a = qc.test(x_test, y_test)
-a.print_report()
\ No newline at end of file
+result = qc.evaluate_split('test', batch_size=1024, k=3)
+result['confusion_matrix'].print_report()
+print("top-1 accuracy: {:.3f}%".format(result['top1_accuracy']))
+print("top-3 accuracy: {:.3f}%".format(result['topk_accuracy']))
+print("{} questions in {:.2f}s: {:.1f} questions/s".format(result['samples'], result['seconds'], result['throughput']))
+
+# the linear classifier used by the bot when the classifier server does not answer
+fallback = get_fallback_classifier() or train_fallback_classifier(verbose=0)
+x_test, y_test = load_questions('test')
+cm = fallback.evaluate(x_test, y_test)
+cm.print_report()
+print("linear classifier accuracy: {:.3f}%".format(cm.getAccuracy()))
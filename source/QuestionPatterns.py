@@ -0,0 +1,114 @@
+"""
+This module compiles the question templates of question_patterns.tsv (e.g. "What color
+is X?", "Is X a part of Y?") into regular expressions that recognize the questions
+built on a template and find the text of their X and Y entities. The templates are
+grouped by their first word, and each group is compiled in a single alternation, so
+that a question is only matched against the templates that start like it.
+
+A question that matches a template exactly does not need the relation classifier,
+and its entities can be looked up by name in the Knowledge Graph instead of calling
+BabelFy (see Brain).
+"""
+import re
+
+_SLOT = re.compile(r"\b([XY])\b")
+# the slots, after a template has been normalized
+_NORMALIZED_SLOT = re.compile(r"\{([xy])\}")
+
+def normalize_question(text):
+    """
+    returns `text` lowercased, with single spaces, no spaces before punctuation and no
+    final question mark, so that questions and templates can be compared.
+    """
+    text = re.sub(r"\s+", " ", text.lower()).strip()
+    text = re.sub(r" ([?.,!;:'])", r"\1", text)
+    return text.rstrip(" ?.!")
+
+class PatternMatcher:
+    """
+    Matches questions against a set of templates with the slots X and Y.
+    """
+    def __init__(self, templates):
+        """
+        Parameters:
+        -----------
+            - `templates`: list of pairs (template, relation). Templates without the
+            slot X are ignored: in those with Y only (e.g. "What is a component of
+            Y?"), the entity is the object of the relation, while the Knowledge Graph is
+            searched from the subject. A template listed with several relations
+            matches all of them.
+        """
+        # template pieces (literal text and slots) -> relations
+        relations_by_template = dict()
+        for template, relation in templates:
+            if "X" not in _SLOT.findall(template):
+                continue
+            # the template is normalized like the questions, then split in literal
+            # text and slots
+            pieces = _NORMALIZED_SLOT.split(normalize_question(_SLOT.sub(r"{\1}", template)))
+            pieces = tuple(p.upper() if i % 2 == 1 else p for i, p in enumerate(pieces))
+            if re.search(r"\w", "".join(pieces[::2])) is None:
+                # e.g. "X?", that would match any question
+                continue
+            relations = relations_by_template.setdefault(pieces, list())
+            if relation not in relations:
+                relations.append(relation)
+
+        # the templates with more literal text are tried first, so that "what is X used
+        # for" is preferred to "what is X"
+        self._templates = sorted(relations_by_template.items(),\
+            key=lambda t: -sum(len(p) for p in t[0][::2]))
+        # first word -> alternatives of the templates that start with it; the key None
+        # collects the templates that start with a slot
+        alternatives = dict()
+        for i, (pieces, _) in enumerate(self._templates):
+            regex = ""
+            for j, piece in enumerate(pieces):
+                if j % 2 == 0:
+                    regex += re.escape(piece)
+                else:
+                    regex += "(?P<{}{}>.+?)".format(piece, i)
+            first_word = pieces[0].split(" ", 1)[0] if " " in pieces[0] else None
+            alternatives.setdefault(first_word, list()).append("(?P<t{}>{})".format(i, regex))
+        self._regexes = {word : re.compile("^(?:" + "|".join(a) + ")$") for word, a in alternatives.items()}
+
+    def __len__(self):
+        return len(self._templates)
+
+    def match(self, question):
+        """
+        Match a question against the templates.
+
+        Parameters:
+        -----------
+            - `question`: the question, as written by the user.
+
+        Returns:
+        --------
+        `None` if the question does not match any template, otherwise a pair
+        (relations, candidates) where `relations` is the list of relations of the
+        template and `candidates` is a list of dictionaries, each mapping the slots of
+        the template ('X', 'Y') to the text they match. There is more than one candidate
+        when the slots are separated only by a space (e.g. "Is X Y?"): one for each
+        point where the text can be split between them, from the shortest X.
+        """
+        question = normalize_question(question)
+        m = None
+        regex = self._regexes.get(question.split(" ", 1)[0])
+        if regex is not None:
+            m = regex.match(question)
+        if m is None and None in self._regexes:
+            m = self._regexes[None].match(question)
+        if m is None:
+            return None
+        # the group of the whole template is the last one to be closed
+        i = int(m.lastgroup[1:])
+        pieces, relations = self._templates[i]
+        spans = {slot : m.group(slot + str(i)).strip() for slot in pieces[1::2]}
+        if len(pieces) == 5 and pieces[2].strip() == "":
+            # adjacent slots: the regex always gives the first word to the first slot
+            first, second = pieces[1], pieces[3]
+            words = (spans[first] + " " + spans[second]).split(" ")
+            return relations, [{first : " ".join(words[:k]), second : " ".join(words[k:])}\
+                for k in range(1, len(words))]
+        return relations, [spans]
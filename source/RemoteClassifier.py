@@ -3,14 +3,17 @@
     Machine Learning classifier that enables the classifier to be used through an
     IP network.
 """
+import logging
 import socket
 import socketserver
+import struct
 from threading import Thread, Lock
 import time
 import pickle
 
+logger = logging.getLogger(__name__)
 
-def remote_predict(data, host, port):
+def remote_predict(data, host, port, timeout=None, **kwargs):
     """
     Request a predict call to a remote classifier.
 
@@ -19,25 +22,37 @@ def remote_predict(data, host, port):
         - data: data to use as argument to the predict function. 
         - host: host name where to send data to
         - port: port the server is listening to
+        - timeout: seconds to wait for each step of the request (connection,
+        sending and receiving), None to wait indefinitely. If it expires,
+        socket.timeout is raised. It is also sent to the server, which does not
+        process the request if it has been waiting longer than that.
+        - kwargs: additional keyword arguments of the predict function.
     
     Returns:
     --------
         - predicted data. 
     """
     s = socket.socket()
-    host = socket.gethostbyname(host)
-    s.connect((host, port))
-    _send_socket(data, s)
-    message = _recv_socket(s)
-    s.close()
+    s.settimeout(timeout)
+    try:
+        host = socket.gethostbyname(host)
+        s.connect((host, port))
+        _send_socket((data, kwargs, timeout), s)
+        message = _recv_socket(s)
+    finally:
+        s.close()
     return message
 
+# header of each message: the length of the serialized object, as a 4 bytes unsigned
+# integer in network byte order
+_HEADER = struct.Struct('!I')
+
 def _send_socket(data, sock):
     """
     Send data through a socket.
 
     This method serializes the object and, together with _recv_socket, implements
-    a simple protocol where the first 5 bytes sent are the length of the sequence 
+    a simple protocol where the first 4 bytes sent are the length of the sequence 
     of bytes transmitted next.
 
     Parameters:
@@ -50,16 +65,27 @@ def _send_socket(data, sock):
     Nothing
     """
     data_dump = pickle.dumps(data)
-    data_length = pickle.dumps(len(data_dump))
-    sock.send(data_length)
-    sock.send(data_dump)
+    sock.sendall(_HEADER.pack(len(data_dump)) + data_dump)
+
+def _recv_exactly(sock, length):
+    """
+    Receive exactly `length` bytes from a socket, raising ConnectionError if the
+    connection is closed before.
+    """
+    message = bytearray()
+    while len(message) < length:
+        current = sock.recv(length - len(message))
+        if len(current) == 0:
+            raise ConnectionError("connection closed after {} of {} bytes".format(len(message), length))
+        message += current
+    return bytes(message)
 
 def _recv_socket(sock):
     """
     Receive data through a socket.
     
     This method receives the object as sequence of bytes and, together with 
-    _send_socket, implements a simple protocol where the first 5 bytes received 
+    _send_socket, implements a simple protocol where the first 4 bytes received 
     are the length of the incoming sequence of bytes.
 
     Parameters:
@@ -70,17 +96,8 @@ def _recv_socket(sock):
     --------
     An object 
     """
-    length = pickle.loads(sock.recv(5))
-    message = b""
-    total_received = 0
-    while len(message) < length:
-        current = sock.recv(length - total_received)
-        if current is None or len(current) == 0:
-            break
-        total_received += len(current)
-        message += current
-    message = pickle.loads(message)
-    return message
+    length, = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return pickle.loads(_recv_exactly(sock, length))
 
 def _process_request_async(c, addr, classifier):
     """
@@ -92,9 +109,13 @@ def _process_request_async(c, addr, classifier):
         - addr: client address
         - classifier: reference to the classifier object
     """
-    # the first 5 bytes tells the length of the message
-    message = _recv_socket(c)
-    classifier._enqueue_predict_request(c, message)
+    try:
+        message = _recv_socket(c)
+    except OSError:
+        logger.debug("client disconnected before sending the request")
+        c.close()
+        return
+    classifier._enqueue_predict_request(c, message, time.monotonic())
     return
 
 def _server_listener_fuction(classifier):
@@ -109,6 +130,46 @@ def _server_listener_fuction(classifier):
         c, addr = classifier._sockServer.accept()
         Thread(target=_process_request_async, args=(c, addr, classifier)).start()
 
+def _classifier_watcher_function(classifier, version_function, load_function, interval):
+    """
+    check periodically whether a new version of the classifier is available and, if so,
+    load it and replace the one in use.
+
+    Parameters:
+    -----------
+        - classifier: reference to the RemoteClassifierServer object
+        - version_function: function that returns the version of the classifier
+        available, or None if there is none.
+        - load_function: function that loads the available classifier.
+        - interval: seconds between two checks.
+    """
+    current_version = version_function()
+    candidate_version = current_version
+    while True:
+        time.sleep(interval)
+        version = version_function()
+        if version is None or version == current_version:
+            candidate_version = version
+            continue
+        if version != candidate_version:
+            # the files may still be being written: load them only if they do not
+            # change until the next check
+            candidate_version = version
+            continue
+        logger.info("loading a new version of the classifier")
+        try:
+            clf = load_function()
+        except Exception:
+            logger.exception("Error while loading the new classifier, the current one is kept.")
+            current_version = version
+            continue
+        if version_function() != version:
+            # the files changed while loading, try again
+            continue
+        classifier.set_classifier(clf)
+        current_version = version
+        logger.info("new classifier in use")
+
 class RemoteClassifierServer:
     """
     A container for a classifier that implements the `predict` method. It enables
@@ -122,7 +183,7 @@ class RemoteClassifierServer:
         host = socket.gethostbyname(host)
         self._sockServer.bind((host, port))
 
-    def _enqueue_predict_request(self, client, data):
+    def _enqueue_predict_request(self, client, data, received):
         """
         Add a predict request to the requests queue.
 
@@ -130,6 +191,7 @@ class RemoteClassifierServer:
         -----------
             - client: the client socket the request came from
             - data: data arrived from the socket
+            - received: time.monotonic() when the request was received
         
         Returns:
         --------
@@ -137,7 +199,7 @@ class RemoteClassifierServer:
         """
         self._queueLock.acquire()
         try:
-            self._queue.insert(0, (client, data))
+            self._queue.insert(0, (client, data, received))
         finally:
             self._queueLock.release()
         return
@@ -156,6 +218,35 @@ class RemoteClassifierServer:
             self._queueLock.release()
         return popped_item
     
+    def set_classifier(self, clf):
+        """
+        Replace the classifier. The request being processed, if any, is completed by
+        the old one, the next ones are processed by `clf`.
+        """
+        self._clf = clf
+
+    def watch_classifier(self, version_function, load_function, interval):
+        """
+        Start a background thread that replaces the classifier whenever a new version
+        becomes available.
+
+        Parameters:
+        -----------
+            - `version_function`: function with no arguments that returns an
+            identifier of the version of the classifier available (e.g. the
+            modification times of its files), or None if there is none.
+            - `load_function`: function with no arguments that loads and returns the
+            available classifier, ready to be used.
+            - `interval`: seconds between two checks for a new version.
+
+        Returns:
+        --------
+        Nothing
+        """
+        self._watcher_thread = Thread(target=_classifier_watcher_function,\
+            args=(self, version_function, load_function, interval), daemon=True)
+        self._watcher_thread.start()
+
     def activate(self):
         """
         Make the classifier start listening for prediction requests.
@@ -166,12 +257,26 @@ class RemoteClassifierServer:
 
         # go on checking for prediction requests
         while True:
-            time.sleep(0.3)
             req = self._pop_predict_request()
             if req is None:
+                time.sleep(0.01)
                 continue
 
-            client, data = req
-            y_pred = self._clf.predict(data)
-            _send_socket(y_pred, client)
-            client.close()
\ No newline at end of file
+            client, (data, kwargs, timeout), received = req
+            if timeout is not None and time.monotonic() - received > timeout:
+                # the client stopped waiting: under load, predicting anyway would
+                # only delay the next requests past their timeout too
+                logger.debug("request dropped, its client stopped waiting")
+                client.close()
+                continue
+            # a single read, so that a request is served by one classifier even if
+            # it is replaced meanwhile
+            clf = self._clf
+            y_pred = clf.predict(data, **kwargs)
+            try:
+                _send_socket(y_pred, client)
+            except OSError:
+                # the client stopped waiting (see the timeout of remote_predict)
+                logger.debug("client disconnected before receiving the prediction")
+            finally:
+                client.close()
\ No newline at end of file
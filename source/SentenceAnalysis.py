@@ -2,11 +2,44 @@
 This module implements functions that perform several operations on sentences,
 like extracting entities and computing the similarity between two sentences.
 """
-import spacy
-dep_parser = spacy.load('en')
+import numpy
+from itertools import tee
+from threading import Lock
 from nltk import Tree, word_tokenize
 from BabelFy import get_annotations, get_id
-from Settings import predefinedDomains
+from Settings import predefinedDomains, SPACY_MODEL, SPACY_ENABLE_NER, SPACY_ENABLE_VECTORS
+
+# pipeline components whose output is never used by the functions in this module
+UNNEEDED_COMPONENTS = [] if SPACY_ENABLE_NER else ['ner']
+
+# the spaCy model is loaded on first use, see get_dep_parser
+_dep_parser = None
+_dep_parser_lock = Lock()
+
+def get_dep_parser():
+    """
+    Get the spaCy pipeline used to parse sentences, loading it the first time.
+
+    Loading the model is expensive, so it is not done at import time: processes that
+    import this module but never parse a sentence (e.g. the question classifier
+    server) do not pay for it. Only the tagger and the parser are loaded, unless NER
+    and word vectors are enabled in the settings.
+
+    Returns:
+    --------
+    The spaCy `Language` object.
+    """
+    global _dep_parser
+    if _dep_parser is None:
+        with _dep_parser_lock:
+            if _dep_parser is None:
+                import spacy
+                nlp = spacy.load(SPACY_MODEL, disable=UNNEEDED_COMPONENTS)
+                if not SPACY_ENABLE_VECTORS:
+                    # similarity is computed on parse trees, vectors are never used
+                    nlp.vocab.reset_vectors(shape=(0, 0))
+                _dep_parser = nlp
+    return _dep_parser
 
 def extract_entities(sentence):
     """
@@ -22,9 +55,23 @@ def extract_entities(sentence):
         - `a` is a spaCy dep tag
         - `B` is a dictionary representing a babelnet annotation
     """
-    
-    doc = dep_parser(sentence)
+    return _extract_entities_from_doc(sentence, get_dep_parser()(sentence))
+
+def _extract_entities_from_doc(sentence, doc):
+    """
+    Extract a list of entities from a sentence that has already been parsed.
+
+    Supports the functions extract_entities and extract_entities_batch.
+
+    Parameters:
+    -----------
+        - `sentence`: the sentence which entities must be extracted from.
+        - `doc`: the spaCy document obtained by parsing `sentence`.
 
+    Returns:
+    --------
+    The same list returned by extract_entities.
+    """
     annotations_by_start = dict()
     annotations = [ann for ann in get_annotations(sentence) if ann['bab_id'][-1] != 'v']
     if len(annotations) == 0:
@@ -80,8 +127,17 @@ def sentence_similarity(sent1, sent2):
     --------
     A value between 0 (totally different) and 1 (the same sentence) 
     """
-    sent1_tree = list(dep_parser(sent1).sents)[0].root
-    sent2_tree = list(dep_parser(sent2).sents)[0].root
+    dep_parser = get_dep_parser()
+    return _sentence_similarity_from_docs(dep_parser(sent1), dep_parser(sent2))
+
+def _sentence_similarity_from_docs(doc1, doc2):
+    """
+    Measure the similarity between two sentences that have already been parsed.
+
+    Supports the functions sentence_similarity and sentence_similarity_batch.
+    """
+    sent1_tree = list(doc1.sents)[0].root
+    sent2_tree = list(doc2.sents)[0].root
 
     v = _support_sentence_similarity(sent1_tree, sent2_tree)
 
@@ -90,6 +146,102 @@ def sentence_similarity(sent1, sent2):
     
     return v / max_v
 
+def parse_sentences(sentences, batch_size=1000, n_process=1, disable=None):
+    """
+    Parse a stream of sentences in batches with the spaCy pipeline.
+
+    Parameters:
+    -----------
+        - `sentences`: an iterable of strings. It is consumed lazily, so it can be a
+        generator over a whole dataset.
+        - `batch_size`: number of sentences sent together through the pipeline.
+        - `n_process`: number of processes used for parsing.
+        - `disable`: names of the pipeline components to skip. By default, the ones
+        that are not needed by this module (see `UNNEEDED_COMPONENTS`).
+
+    Returns:
+    --------
+    A generator of spaCy documents, in the same order as `sentences`.
+    """
+    if disable is None:
+        disable = UNNEEDED_COMPONENTS
+    return get_dep_parser().pipe(sentences, batch_size=batch_size, n_process=n_process, disable=disable)
+
+def extract_entities_batch(sentences, batch_size=1000, n_process=1):
+    """
+    Batch version of extract_entities, meant for offline jobs over large corpora.
+
+    Parameters:
+    -----------
+        - `sentences`: an iterable of sentences.
+        - `batch_size`, `n_process`: see parse_sentences.
+
+    Returns:
+    --------
+    A generator that yields, for each sentence, the list returned by extract_entities.
+    """
+    sentences, to_parse = tee(sentences)
+    for sentence, doc in zip(sentences, parse_sentences(to_parse, batch_size, n_process)):
+        yield _extract_entities_from_doc(sentence, doc)
+
+def sentence_similarity_batch(pairs, batch_size=1000, n_process=1):
+    """
+    Batch version of sentence_similarity, meant for offline jobs over large corpora.
+
+    Parameters:
+    -----------
+        - `pairs`: an iterable of pairs of sentences (sent1, sent2).
+        - `batch_size`, `n_process`: see parse_sentences.
+
+    Returns:
+    --------
+    A generator that yields, for each pair, the similarity between its two sentences.
+    """
+    docs = parse_sentences((sent for pair in pairs for sent in pair), batch_size, n_process)
+    for doc1, doc2 in zip(docs, docs):
+        yield _sentence_similarity_from_docs(doc1, doc2)
+
+def rank_sentences(sentence, candidates, k=1, batch_size=256):
+    """
+    Rank a list of candidate sentences by their similarity with `sentence`.
+
+    This is the batch counterpart of `sentence_similarity`: the reference sentence is
+    parsed (and compared with itself) only once, candidates go through the spaCy
+    pipeline in batches, and normalization and top-k selection are done with NumPy
+    on the whole vector of scores.
+
+    Parameters:
+    -----------
+        - `sentence`: the reference sentence.
+        - `candidates`: list of sentences to be compared with `sentence`.
+        - `k`: number of best candidates to return.
+        - `batch_size`: number of candidates parsed together by spaCy.
+
+    Returns:
+    --------
+    A list of at most `k` pairs (i, s), sorted by decreasing similarity, where `i` is
+    the index of the candidate in `candidates` and `s` its similarity with `sentence`.
+    """
+    if len(candidates) == 0:
+        return []
+
+    root = next(get_dep_parser()(sentence).sents).root
+    self_score = _support_sentence_similarity(root, root)
+
+    scores = numpy.empty(len(candidates))
+    norms = numpy.empty(len(candidates))
+    for i, doc in enumerate(parse_sentences(candidates, batch_size)):
+        candidate_root = next(doc.sents).root
+        scores[i] = _support_sentence_similarity(root, candidate_root)
+        norms[i] = _support_sentence_similarity(candidate_root, candidate_root)
+
+    scores /= numpy.maximum(norms, self_score)
+
+    # sort by decreasing score; on ties, prefer the candidate that comes first (the
+    # lists of candidates are small, sorting all of them is cheap)
+    top = numpy.argsort(-scores, kind='stable')[:k]
+    return [(int(i), float(scores[i])) for i in top]
+
 def _support_sentence_similarity(node1, node2):
     """
     Given two parse trees of two sentences, compute a value that measures the
@@ -11,12 +11,67 @@ QuestionClassifierServer_Port = int(_soup.find('port').text)
 QuestionClassifierServer_Host = _soup.find('host').text
 # TEMP folder location
 TMP_QC_PREFIX = "tmp/qc_"
+# Every QC_RELOAD_INTERVAL seconds, the classifier server checks whether a new model
+# has been saved in the TEMP folder and, if so, loads it in place of the current one
+# (0 disables the check).
+QC_RELOAD_INTERVAL = 30
+# If True, the classifier server computes predictions with the NumPy forward pass of
+# the exported model (see InferenceClassifier) instead of keras.
+QC_USE_EXPORTED_MODEL = True
+# Type the weights of the exported model are quantized to: None, 'float16' or 'int8'.
+# The quantized model is used only if its top-1 accuracy on the dev split is at most
+# QC_MAX_ACCURACY_DROP percentage points lower than the one of the float32 model.
+QC_QUANTIZATION = None
+QC_MAX_ACCURACY_DROP = 0.5
+# Threads used by the classifier process: inside a single operation (intra-op) and
+# for independent operations (inter-op, tensorflow only). 0 keeps the default of the
+# libraries, i.e. all the cores; lower them when several classifiers share a host.
+QC_INTRA_OP_THREADS = 0
+QC_INTER_OP_THREADS = 0
+
+# Logging and metrics. LOG_LEVEL is one of DEBUG, INFO, WARNING, ERROR. Metrics are
+# exposed on http://METRICS_HOST:METRICS_PORT/metrics and summarized in the log every
+# METRICS_SUMMARY_INTERVAL seconds (0 disables the summary).
+LOG_LEVEL = 'INFO'
+METRICS_HOST = 'localhost'
+METRICS_PORT = 9100
+METRICS_SUMMARY_INTERVAL = 600
+
+# Profiling of slow requests. When PROFILE_SLOW_REQUESTS is True, a fraction
+# PROFILE_SAMPLE_RATE of the requests is run under cProfile, and the profiles of the
+# ones slower than PROFILE_THRESHOLD seconds are saved in PROFILE_DIR (at most
+# PROFILE_MAX_FILES, the oldest are removed).
+PROFILE_SLOW_REQUESTS = False
+PROFILE_THRESHOLD = 2.0
+PROFILE_SAMPLE_RATE = 1.0
+PROFILE_DIR = "tmp/profiles"
+PROFILE_MAX_FILES = 100
+
+# SpaCy model. The parser is loaded on first use, with only the pipeline
+# components needed by SentenceAnalysis unless explicitly enabled here.
+SPACY_MODEL = 'en'
+SPACY_ENABLE_NER = False
+SPACY_ENABLE_VECTORS = False
 
 # Telegram Bot
 _settings = open('local_data/bot.xml').read()
 _soup = BeautifulSoup(_settings, 'lxml')
 TelegramBotToken = _soup.find('token').text
 
+# When CHATBOT_ASYNC is True, the heavy part of the replies is executed by a shared
+# pool of CHATBOT_WORKERS threads, with at most CHATBOT_QUEUE_SIZE pending jobs,
+# instead of blocking the per-chat handler threads.
+CHATBOT_ASYNC = True
+CHATBOT_WORKERS = 8
+CHATBOT_QUEUE_SIZE = 1000
+
+# Conversation sessions: at most SESSION_MAX_NUMBER are kept in memory, and they are
+# discarded after SESSION_TTL seconds of inactivity. If SESSION_STORE_PATH is not
+# None, sessions are saved there so that conversations survive a restart.
+SESSION_MAX_NUMBER = 100000
+SESSION_TTL = 1000
+SESSION_STORE_PATH = "tmp/sessions.bin"
+
 # Predefined domains
 predefinedDomains = [line.strip().lower() for line in open('local_data/domain_list.txt').readlines()]
 
@@ -33,6 +88,11 @@ BabelNetKEY = _soup.find('key').text
 KB_DUMP_PATH = "local_data/KB_dump.bin" #knowledge base dump
 KG_DUMP_PATH = "tmp/KG_dump.bin" #knowledge graph dump
 
+# BabelDomains mapping from synsets to domains, and the index built from it, used to
+# assign domains to the KB entries that have none
+BABELDOMAINS_PATH = "local_data/babeldomains_babelnet.txt"
+DOMAIN_INDEX_PATH = "tmp/domain_index.db"
+
 # Domains to relation mapping
 _DOM_TO_REL = "local_data/domains_to_relations.tsv"
 
@@ -48,6 +108,25 @@ def _load_domains_to_relations_mapping():
 
 domainsToRelationsMapping = _load_domains_to_relations_mapping()
 
+# Number of threads that run the relation prediction while entities are extracted
+PIPELINE_WORKERS = 32
+
+# Relations predicted with a probability lower than RELATION_MIN_CONFIDENCE are not
+# used to search the answer to a question (the most probable one is always used)
+RELATION_MIN_CONFIDENCE = 0.1
+
+# The question classifier server must answer within RELATION_PREDICTION_TIMEOUT
+# seconds (0 waits indefinitely); if it does not, or it is not reachable, the
+# relations are predicted by the linear classifier of the bot process (see
+# LinearClassifier). The linear classifier is also used alone, without asking the
+# server, when its most probable relation has a probability of at least
+# RELATION_FIRST_PASS_CONFIDENCE (0 disables this).
+RELATION_PREDICTION_TIMEOUT = 1.0
+RELATION_FIRST_PASS_CONFIDENCE = 0
+
+# Maximum number of answers kept in the answer cache
+ANSWER_CACHE_SIZE = 10000
+
 # Answer Generation env variables
 AG_TRAINING_FILE = "local_data/train_v1.1.json"
 AG_TEST_FILE = "local_data/test_public_v1.1.json"
@@ -66,4 +145,21 @@ def _loadQuestionPatterns():
         mapp[c].append(q)
     return mapp
 
-questionPatternsByRelation = _loadQuestionPatterns()
\ No newline at end of file
+questionPatternsByRelation = _loadQuestionPatterns()
+
+def _loadQuestionTemplates():
+    """
+    returns all the question patterns, also the ones with two entities, as pairs
+    (pattern, relation).
+    """
+    templates = list()
+    for line in open("local_data/question_patterns.tsv").readlines():
+        q, c = line.strip().split('\t')
+        templates.append((q, c.lower()))
+    return templates
+
+questionTemplates = _loadQuestionTemplates()
+# If True, the questions that match a question pattern exactly are answered looking
+# up their entities by name in the knowledge graph, without the question classifier
+# and BabelFy (see QuestionPatterns).
+USE_QUESTION_PATTERNS = True
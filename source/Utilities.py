@@ -1,9 +1,16 @@
+import logging
+import os
+import subprocess
+import sys
+import tempfile
 from math import floor
 from random import randint
+import numpy
 """
 This module contains functions that support other functions but are not elegible to stay in the
 same module for semantic reasons.
 """
+logger = logging.getLogger(__name__)
 def random_plit(X, split=0.3, bsize=2000):
     """
     Divide randomly a dataset in two parts, with sizes depending on `split`, 
@@ -57,4 +64,150 @@ def correct_grammatical_errors(question):
     question = question[0].upper() + question[1:]
 
     # TODO: other checks, but maybe are too costly
-    return question
\ No newline at end of file
+    return question
+
+def top_k_indexes(Y, k):
+    """
+    Find the indexes of the `k` largest values of each row of `Y`.
+
+    Parameters:
+    -----------
+        - `Y`: 2D array, e.g. the probability distributions given by the model.
+        - `k`: number of indexes to find for each row.
+
+    Returns:
+    --------
+    A 2D array of integers, where the i-th row contains the indexes of the `k` largest
+    values of `Y[i]`, sorted by decreasing value.
+    """
+    k = min(k, Y.shape[1])
+    if k < Y.shape[1]:
+        # select the k largest values in linear time, then sort only those
+        top = numpy.argpartition(-Y, k - 1, axis=1)[:, :k]
+    else:
+        top = numpy.tile(numpy.arange(Y.shape[1]), (Y.shape[0], 1))
+    order = numpy.argsort(-numpy.take_along_axis(Y, top, axis=1), axis=1, kind='stable')
+    return numpy.take_along_axis(top, order, axis=1)
+
+def top_k_labels(Y, labels, k, with_scores=False):
+    """
+    Translate probability distributions into the `k` most probable labels of each one.
+
+    Parameters:
+    -----------
+        - `Y`: 2D array where the i-th row is a probability distribution over `labels`.
+        - `labels`: array with the label of each column of `Y`.
+        - `k`: number of labels to return for each row.
+        - `with_scores`: if True, each label is paired with its probability.
+
+    Returns:
+    --------
+    A list with, for each row, the list of its `k` most probable labels, from the most
+    probable one (pairs (label, probability) if `with_scores` is True).
+    """
+    top = top_k_indexes(Y, k)
+    top_labels = labels[top].tolist()
+    if not with_scores:
+        return top_labels
+    scores = numpy.take_along_axis(Y, top, axis=1).tolist()
+    return [list(zip(l, s)) for l, s in zip(top_labels, scores)]
+
+def run_python_script(script):
+    """
+    Run a python script in a fresh interpreter and return the numbers it prints on the
+    line that starts with `RESULT` (None if there is no such line).
+    """
+    out = subprocess.check_output([sys.executable, '-c', script], stderr=subprocess.DEVNULL)
+    for line in out.decode().splitlines():
+        if line.startswith('RESULT '):
+            return [float(v) for v in line.split()[1:]]
+
+def import_time(statement):
+    """
+    returns the seconds a fresh interpreter takes to run an import `statement`
+    (e.g. "import keras").
+    """
+    return run_python_script(_IMPORT_SCRIPT.format(statement))[0]
+
+_IMPORT_SCRIPT = """
+import time
+t = time.perf_counter()
+{}
+print('RESULT', time.perf_counter() - t)
+"""
+
+def limit_cpu_threads(intra_op_threads, inter_op_threads=0):
+    """
+    Limit the threads used by the numerical libraries of this process, so that several
+    processes doing inference or training on the same host do not compete for the
+    same cores.
+
+    The limits are set in the environment (read by the BLAS and OpenMP libraries when
+    they are loaded), through threadpoolctl if it is installed (for the libraries
+    already loaded by NumPy) and in tensorflow if it has already been imported.
+
+    Parameters:
+    -----------
+        - `intra_op_threads`: threads used inside a single operation, e.g. a matrix
+        product (0 keeps the default).
+        - `inter_op_threads`: operations that tensorflow runs concurrently (0 keeps
+        the default).
+
+    Returns:
+    --------
+    Nothing
+    """
+    if intra_op_threads > 0:
+        for variable in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+            os.environ[variable] = str(intra_op_threads)
+        try:
+            from threadpoolctl import threadpool_limits
+            threadpool_limits(intra_op_threads)
+        except ImportError:
+            pass
+
+    if 'tensorflow' not in sys.modules or (intra_op_threads <= 0 and inter_op_threads <= 0):
+        return
+    tf = sys.modules['tensorflow']
+    try:
+        if hasattr(tf, 'config') and hasattr(tf.config, 'threading'):
+            if intra_op_threads > 0:
+                tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+            if inter_op_threads > 0:
+                tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+        else:
+            # tensorflow 1: the limits are options of the session used by keras
+            from keras import backend
+            config = tf.ConfigProto(intra_op_parallelism_threads=max(0, intra_op_threads),\
+                inter_op_parallelism_threads=max(0, inter_op_threads))
+            backend.set_session(tf.Session(config=config))
+    except RuntimeError:
+        # tensorflow 2 does not allow to change the limits once it has been initialized
+        logger.warning("tensorflow is already initialized, its thread limits are not changed")
+
+def write_atomically(path, write, suffix=""):
+    """
+    Write a file through a temporary file in the same folder, which then replaces
+    `path`: a process reading `path` never sees it half written, and processes
+    writing it at the same time do not interfere (the last one wins).
+
+    Parameters:
+    -----------
+        - `path`: the file to write.
+        - `write`: function that takes the path of the temporary file and writes it.
+        - `suffix`: suffix of the temporary file, for functions that add an extension
+        otherwise (e.g. ".npz" for numpy.savez).
+
+    Returns:
+    --------
+    Nothing
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=suffix)
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
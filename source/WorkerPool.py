@@ -0,0 +1,86 @@
+"""
+This module implements a pool of worker threads that execute jobs taken from a
+bounded queue. It is used to run the heavy part of the bot's replies on a fixed
+number of threads, independently of the number of active chats.
+"""
+import logging
+from queue import Queue, Full
+from threading import Thread, Lock
+
+logger = logging.getLogger(__name__)
+
+class WorkerPool:
+    """
+    A fixed set of threads that execute jobs submitted to a bounded queue.
+    """
+    def __init__(self, n_workers, max_queue_size):
+        self._queue = Queue(max_queue_size)
+        self._lock = Lock()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.max_queue_depth = 0
+        self._workers = [Thread(target=self._work, daemon=True) for _ in range(n_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, function, *args):
+        """
+        Enqueue a job to be executed by one of the workers.
+
+        Parameters:
+        -----------
+            - `function`: the function to be called.
+            - `args`: the arguments to pass to `function`.
+        
+        Returns:
+        --------
+        True if the job was enqueued, False if the queue is full.
+        """
+        try:
+            self._queue.put_nowait((function, args))
+        except Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        depth = self._queue.qsize()
+        with self._lock:
+            if depth > self.max_queue_depth:
+                self.max_queue_depth = depth
+        return True
+
+    def queue_depth(self):
+        """
+        returns the number of jobs waiting to be executed.
+        """
+        return self._queue.qsize()
+
+    def stats(self):
+        """
+        returns a dictionary with the pool counters.
+        """
+        return {
+            'workers' : len(self._workers),
+            'queue_depth' : self.queue_depth(),
+            'max_queue_depth' : self.max_queue_depth,
+            'completed' : self.completed,
+            'failed' : self.failed,
+            'rejected' : self.rejected
+        }
+
+    def _work(self):
+        """
+        main loop of a worker thread.
+        """
+        while True:
+            function, args = self._queue.get()
+            try:
+                function(*args)
+                with self._lock:
+                    self.completed += 1
+            except Exception:
+                logger.exception("Error while executing a job.")
+                with self._lock:
+                    self.failed += 1
+            finally:
+                self._queue.task_done()
@@ -1,38 +1,42 @@
-import pickle
-
-mapping = dict()
-for line in open('local_data/babeldomains_babelnet.txt'):
-    key, val , _ = line.split('\t')[:3]
-    mapping[key] = val
-
-
-KB = pickle.load(open('local_data/KB_dump.bin', 'rb'))
+"""
+Assign domains to the entries of the KB dump, using the BabelDomains index (see the
+DomainIndex module).
 
-total = len(KB)
-count = 0
-for d in KB:
-    l1 = d['c1'].rfind('bn:')
-    l2 = d['c2'].rfind('bn:')
-    c1 = d['c1'][l1:]
-    c2 = d['c2'][l2:]
+The bot annotates the entries without domains while it ingests them, so this script
+is only needed to produce an annotated copy of the dump, e.g. for training.
 
-    domains = list()
-
-    try:
-        domains.append(mapping[c1])
-    except Exception:
-        pass
-    
-    try:
-        domains.append(mapping[c2])
-    except Exception:
-        pass
-    
-    if len(domains) == 0:
-        count += 1
-    
-    d['domains'] = domains
-
-pickle.dump(KB, open('local_data/KB_dump2.bin', 'wb'))
-
-print(count/total)
+Run it from the `source` folder:
+``python assign_domains.py [--rebuild-index] [--overwrite] [--output PATH]``
+"""
+import argparse
+import pickle
+from DomainIndex import build_index, get_domain_index
+from EntryNormalization import normalize_entries, strip_normalized_fields
+from Settings import BABELDOMAINS_PATH, DOMAIN_INDEX_PATH, KB_DUMP_PATH
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rebuild-index', action='store_true', help="build the index even if it is up to date")
+    parser.add_argument('--overwrite', action='store_true',\
+        help="replace the domains of all the entries, not only of those without domains")
+    parser.add_argument('--input', default=KB_DUMP_PATH)
+    parser.add_argument('--output', default='local_data/KB_dump2.bin')
+    args = parser.parse_args()
+
+    if args.rebuild_index:
+        build_index(BABELDOMAINS_PATH, DOMAIN_INDEX_PATH)
+    domain_index = get_domain_index()
+    if domain_index is None:
+        parser.error("neither the domain index nor {} is available".format(BABELDOMAINS_PATH))
+
+    KB = pickle.load(open(args.input, 'rb'))
+    entries = normalize_entries(KB)
+    annotated = domain_index.annotate(entries, args.overwrite)
+    without_domains = sum(1 for e in entries if len(e['domain_keys']) == 0)
+
+    # the dump keeps the KBS format: only the 'domains' field is changed
+    for entry in entries:
+        strip_normalized_fields(entry)
+    pickle.dump(KB, open(args.output, 'wb'))
+    print("{} entries annotated, {} valid entries without domains ({:.2%})".format(annotated, without_domains,\
+        without_domains / max(1, len(entries))))
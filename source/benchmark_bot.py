@@ -0,0 +1,332 @@
+"""
+Offline load generator and end-to-end latency benchmark for the bot.
+
+A corpus of scripted conversations (domain selection, questions, 'ask me', answers)
+is replayed by a number of concurrent virtual users directly against the Chatbot
+state machine, with a fake `send` function instead of Telegram. The Knowledge Base
+Server is replaced by a `LocalKBServer` and BabelFy by a local stub, both serving data
+from the KB dump, while the real question classifier process is started as in `main.py`.
+
+At the end, the throughput and the p50/p95/p99 latency of each FSA state transition
+are reported.
+
+Run it from the `source` folder: ``python benchmark_bot.py [options]``
+"""
+import argparse
+import json
+import os
+import random
+from math import ceil
+import re
+import socket
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Process
+from threading import Thread, Lock
+from urllib.parse import urlparse, parse_qs
+
+import BabelFy
+import Chatbot
+import DataAccessManager
+import KnowledgeBaseServer as KBS
+from LocalKBServer import LocalKBServer, KBStore
+from main import start_question_classifier_server
+from Settings import predefinedDomains, QuestionClassifierServer_Host,\
+    QuestionClassifierServer_Port
+
+STATE_NAMES = Chatbot.STATE_NAMES
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+BENCHMARK_KBS_STORE_PATH = "tmp/benchmark_kbs.jsonl"
+
+##################################################################################################
+#
+#                                          Local stubs
+#
+##################################################################################################
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """
+    Dispatches GET and POST requests to the `get` and `post` methods of the stub
+    attached to the server.
+    """
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k : v[0] for k, v in parse_qs(url.query).items()}
+        self._reply(self.server.stub.get(url.path.rsplit('/', 1)[-1], params))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._reply(self.server.stub.post(url.path.rsplit('/', 1)[-1], body))
+
+    def _reply(self, response):
+        status, body = response
+        data = body.encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        return
+
+def serve_stub(stub):
+    """
+    Serve a stub on a free local port, in a background thread.
+
+    Returns:
+    --------
+    The `ThreadingHTTPServer` instance. The port is in `server.server_address[1]`.
+    """
+    server = ThreadingHTTPServer(('localhost', 0), _StubHandler)
+    server.daemon_threads = True
+    server.stub = stub
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class BabelFyStub:
+    """
+    Answers BabelFy disambiguation and BabelNet synset ID requests by looking up, in
+    the text, the names of the concepts that appear in the KB entries.
+    """
+    def __init__(self, entries):
+        self.ids_by_name = dict()
+        for entry in entries:
+            for concept in (entry['c1'], entry['c2']):
+                name, _, bab_id = concept.partition('::')
+                if len(bab_id) > 0:
+                    tokens = tuple(t.lower() for t in _TOKEN.findall(name))
+                    self.ids_by_name[tokens] = bab_id[bab_id.rfind('bn:'):]
+        self.max_length = max([len(k) for k in self.ids_by_name.keys()] + [1])
+
+    def annotate(self, text):
+        """
+        returns the annotations of `text` in the BabelFy JSON format, matching the
+        longest known names first.
+        """
+        tokens = list(_TOKEN.finditer(text))
+        annotations = list()
+        i = 0
+        while i < len(tokens):
+            for n in range(min(self.max_length, len(tokens) - i), 0, -1):
+                key = tuple(t.group().lower() for t in tokens[i:i+n])
+                if key in self.ids_by_name:
+                    annotations.append({
+                        'tokenFragment' : {'start' : i, 'end' : i + n - 1},
+                        'charFragment' : {'start' : tokens[i].start(), 'end' : tokens[i+n-1].end() - 1},
+                        'babelSynsetID' : self.ids_by_name[key],
+                        'source' : 'BABELFY'
+                    })
+                    i += n
+                    break
+            else:
+                i += 1
+        return annotations
+
+    def get(self, endpoint, params):
+        if endpoint == 'disambiguate':
+            return 200, json.dumps(self.annotate(params.get('text', '')))
+        elif endpoint == 'getSynsetIds':
+            key = tuple(t.lower() for t in _TOKEN.findall(params.get('word', '')))
+            ids = [{'id' : self.ids_by_name[key]}] if key in self.ids_by_name else []
+            return 200, json.dumps(ids)
+        return 404, ""
+
+    def post(self, endpoint, body):
+        return 404, ""
+
+##################################################################################################
+#
+#                                         Load generation
+#
+##################################################################################################
+
+def generate_conversations(entries, n_conversations, length, rng):
+    """
+    Generate scripted conversations from the KB entries.
+
+    Each conversation greets the bot, chooses a domain and then, `length` times,
+    either asks a question taken from the KB or asks the bot for a question and
+    answers it (with a concept name or with "I don't know").
+
+    Returns:
+    --------
+    A list of conversations, each one a list of messages.
+    """
+    conversations = list()
+    for _ in range(n_conversations):
+        conversation = ['hi', rng.choice(predefinedDomains)]
+        for _ in range(length):
+            if rng.random() < 0.5:
+                conversation.append(rng.choice(entries)['question'])
+            else:
+                conversation.append('ask me')
+                if rng.random() < 0.5:
+                    conversation.append("I don't know")
+                else:
+                    conversation.append("It is " + rng.choice(entries)['c2'].split('::')[0])
+        conversations.append(conversation)
+    return conversations
+
+def _replay(conversation, chat_id, timings, lock):
+    """
+    Send the messages of a conversation to the bot, one after the other, measuring
+    how long each of them takes to be handled (including the work done by the pool).
+    """
+    replies = list()
+    for i, text in enumerate(conversation):
+        msg = {
+            'message_id' : i,
+            'from' : {'id' : chat_id, 'first_name' : 'bench'},
+            'chat' : {'id' : chat_id, 'type' : 'private'},
+            'date' : int(time.time()),
+            'text' : text
+        }
+        session = Chatbot.sessions.get(chat_id)
+        before = session.state
+        start = time.perf_counter()
+        Chatbot.handle_message(session, msg, replies.append)
+        while session.busy:
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        transition = STATE_NAMES[before] + " -> " + STATE_NAMES[session.state]
+        with lock:
+            try:
+                timings[transition].append(elapsed)
+            except KeyError:
+                timings[transition] = [elapsed]
+
+def run_load(conversations, n_users):
+    """
+    Replay the conversations with `n_users` concurrent virtual users.
+
+    Returns:
+    --------
+    A pair (timings, elapsed) where `timings` maps each FSA transition to the list of
+    latencies observed and `elapsed` is the total wall time.
+    """
+    timings = dict()
+    lock = Lock()
+    pending = list(enumerate(conversations))
+    pending_lock = Lock()
+
+    def user():
+        while True:
+            with pending_lock:
+                if len(pending) == 0:
+                    return
+                chat_id, conversation = pending.pop()
+            _replay(conversation, chat_id, timings, lock)
+
+    start = time.perf_counter()
+    users = [Thread(target=user) for _ in range(n_users)]
+    for u in users:
+        u.start()
+    for u in users:
+        u.join()
+    return timings, time.perf_counter() - start
+
+def percentile(values, p):
+    """
+    returns the `p`-th percentile (nearest rank) of a list of values.
+    """
+    values = sorted(values)
+    rank = max(1, ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+def summarize(timings, elapsed):
+    """
+    Compute throughput and latency percentiles from the result of run_load.
+    """
+    n_messages = sum(len(t) for t in timings.values())
+    summary = {
+        'messages' : n_messages,
+        'elapsed' : elapsed,
+        'throughput' : n_messages / elapsed if elapsed > 0 else 0,
+        'transitions' : dict()
+    }
+    for transition, values in sorted(timings.items()):
+        summary['transitions'][transition] = {
+            'count' : len(values),
+            'p50' : percentile(values, 50),
+            'p95' : percentile(values, 95),
+            'p99' : percentile(values, 99),
+            'max' : max(values)
+        }
+    return summary
+
+def print_summary(summary):
+    print("{} messages in {:.2f}s: {:.2f} messages/s".format(summary['messages'], summary['elapsed'],\
+        summary['throughput']))
+    print("{:45s} {:>7s} {:>9s} {:>9s} {:>9s} {:>9s}".format("Transition (latency in ms)", "count",\
+        "p50", "p95", "p99", "max"))
+    for transition, s in summary['transitions'].items():
+        print("{:45s} {:7d} {:9.1f} {:9.1f} {:9.1f} {:9.1f}".format(transition, s['count'],\
+            s['p50'] * 1000, s['p95'] * 1000, s['p99'] * 1000, s['max'] * 1000))
+
+def _wait_for_port(host, port, timeout=600):
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            socket.create_connection((host, port)).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10, help="number of concurrent virtual users")
+    parser.add_argument('--conversations', type=int, default=100, help="number of conversations to generate")
+    parser.add_argument('--length', type=int, default=5, help="interactions per generated conversation")
+    parser.add_argument('--corpus', help="JSON file with a list of conversations (lists of messages) to replay")
+    parser.add_argument('--kb-size', type=int, default=None, help="use only the first KB-SIZE entries of the dump")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--external-classifier', action='store_true',\
+        help="do not start the classifier process, use the one already running")
+    parser.add_argument('--output', help="write the results as JSON in this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    entries = DataAccessManager.load_knowledge_base_dump()[:args.kb_size]
+
+    # local stand-ins for the remote services
+    if os.path.isfile(BENCHMARK_KBS_STORE_PATH):
+        os.remove(BENCHMARK_KBS_STORE_PATH)
+    store = KBStore(BENCHMARK_KBS_STORE_PATH, None)
+    store.add(entries)
+    kbs = LocalKBServer(store)
+    kbs.start()
+    KBS.connect(kbs.host, kbs.port, kbs.path)
+    babelfy = serve_stub(BabelFyStub(entries))
+    babelfy_url = "http://localhost:{}/".format(babelfy.server_address[1])
+    BabelFy.set_endpoints(babelfy_url + "disambiguate", babelfy_url + "getSynsetIds")
+
+    # do not overwrite the real knowledge graph dump when the bot records answers
+    DataAccessManager.KG_DUMP_PATH = "tmp/benchmark_KG_dump.bin"
+    DataAccessManager._update_graph(DataAccessManager._clean_downloaded_data(entries), len(entries))
+
+    classifier = None
+    if not args.external_classifier:
+        classifier = Process(target=start_question_classifier_server,\
+            args=(QuestionClassifierServer_Host, QuestionClassifierServer_Port))
+        classifier.start()
+    _wait_for_port(QuestionClassifierServer_Host, QuestionClassifierServer_Port)
+
+    if args.corpus is not None:
+        conversations = json.load(open(args.corpus))
+    else:
+        conversations = generate_conversations(entries, args.conversations, args.length, rng)
+
+    try:
+        timings, elapsed = run_load(conversations, args.users)
+    finally:
+        if classifier is not None:
+            classifier.terminate()
+
+    summary = summarize(timings, elapsed)
+    print_summary(summary)
+    if args.output is not None:
+        json.dump(summary, open(args.output, 'w'), indent=2)
@@ -0,0 +1,101 @@
+"""
+Benchmark of the exported NumPy question classifier (InferenceClassifier) against
+the keras one (QuestionClassifier).
+
+It measures, for both:
+    * the import time of the modules needed for inference, in a fresh interpreter;
+    * the time needed to load the model;
+    * the latency of single-question predictions, as done by the classifier server;
+    * the throughput on batches of questions.
+It also checks that the two give the same predictions, reporting the largest
+difference between their probabilities and how often their top relation agrees.
+
+Run it from the `source` folder: ``python benchmark_classifier.py [options]``
+"""
+import argparse
+import pickle
+import os
+import tempfile
+import time
+from statistics import median
+from math import ceil
+import numpy
+from Utilities import import_time
+
+IMPORTS = [
+    ('keras', 'import keras'),
+    ('QuestionClassifier', 'import QuestionClassifier'),
+    ('InferenceClassifier', 'import InferenceClassifier')
+]
+
+def percentile(values, p):
+    """
+    returns the `p`-th percentile (nearest rank) of a list of values.
+    """
+    values = sorted(values)
+    return values[max(1, ceil(p / 100 * len(values))) - 1]
+
+def single_question_latencies(classifier, questions):
+    latencies = list()
+    for q in questions:
+        start = time.perf_counter()
+        classifier.predict(q)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-r', '--repeats', type=int, default=3, help="fresh interpreters per import measure")
+    parser.add_argument('-n', '--questions', type=int, default=500, help="questions for the latency measures")
+    parser.add_argument('--batch-size', type=int, default=256)
+    args = parser.parse_args()
+
+    print("{:40s} {:>10s}".format("Import (median seconds)", ""))
+    for name, statement in IMPORTS:
+        times = [import_time(statement) for _ in range(args.repeats)]
+        print("{:40s} {:10.3f}".format(name, median(times)))
+
+    from QuestionClassifier import QuestionClassifier, load_dataset
+    from InferenceClassifier import InferenceClassifier
+    from Settings import TMP_QC_PREFIX
+
+    start = time.perf_counter()
+    keras_classifier = QuestionClassifier(TMP_QC_PREFIX + "lstm_model")
+    keras_load = time.perf_counter() - start
+    # export to a temporary file, not to the one used by the classifier server
+    export_dir = tempfile.TemporaryDirectory()
+    export_path = os.path.join(export_dir.name, "lstm_model.npz")
+    keras_classifier.export_inference_model(export_path)
+    start = time.perf_counter()
+    numpy_classifier = InferenceClassifier(export_path)
+    numpy_load = time.perf_counter() - start
+
+    x_test = pickle.load(open(TMP_QC_PREFIX + "x_test.bin", 'rb'))
+    questions = [" ".join(x) for x in x_test[:args.questions]]
+    # the first prediction of keras builds the prediction function
+    keras_classifier.predict(questions[0])
+
+    I, _ = load_dataset('test')
+    I = numpy.asarray(I[:max(args.questions, args.batch_size * 10)])
+    lstm = keras_classifier._lstm_classifier
+
+    results = list()
+    for name, load, latency, proba in (
+        ('keras', keras_load, single_question_latencies(keras_classifier, questions),\
+            lambda B: lstm.predict_proba(lstm.indexes_to_input(B), args.batch_size)),
+        ('numpy', numpy_load, single_question_latencies(numpy_classifier, questions),\
+            numpy_classifier.predict_proba)):
+        start = time.perf_counter()
+        P = numpy.vstack([proba(I[i:i + args.batch_size]) for i in range(0, len(I), args.batch_size)])
+        elapsed = time.perf_counter() - start
+        results.append((name, load, latency, len(I) / elapsed, P))
+
+    print("\n{:10s} {:>10s} {:>12s} {:>12s} {:>16s}".format("Model", "load (s)", "p50 (ms)", "p95 (ms)",\
+        "batch (q/s)"))
+    for name, load, latency, throughput, _ in results:
+        print("{:10s} {:10.3f} {:12.3f} {:12.3f} {:16.1f}".format(name, load, percentile(latency, 50) * 1000,\
+            percentile(latency, 95) * 1000, throughput))
+
+    P_keras, P_numpy = results[0][4], results[1][4]
+    print("\nlargest probability difference: {:.2e}".format(float(numpy.abs(P_keras - P_numpy).max())))
+    print("top relation agreement: {:.3f}%".format(float(numpy.mean(P_keras.argmax(1) == P_numpy.argmax(1))) * 100))
@@ -0,0 +1,63 @@
+"""
+Benchmark of the download and synchronization paths of the Knowledge Base Server
+client, run against a `LocalKBServer` so that it needs no network.
+
+It measures:
+    * the full download of the KB (`KnowledgeBaseServer.get_all_items_from(0)`);
+    * the cleaning of the downloaded data and the construction of the knowledge graph;
+    * incremental synchronizations (`DataAccessManager.update_knowledge_graph`) after
+    new entries have been added to the server with `add_items`.
+
+Run it from the `source` folder: ``python benchmark_kbs_sync.py [options]``
+"""
+import argparse
+import os
+import time
+
+import DataAccessManager
+import KnowledgeBaseServer as KBS
+from LocalKBServer import LocalKBServer, KBStore
+
+BENCHMARK_KBS_STORE_PATH = "tmp/benchmark_sync_kbs.jsonl"
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--kb-size', type=int, default=None, help="use only the first KB-SIZE entries of the dump")
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0, help="seconds each request is delayed")
+    parser.add_argument('--error-rate', type=float, default=0, help="probability of answering with an error")
+    parser.add_argument('--syncs', type=int, default=5, help="number of incremental synchronizations")
+    parser.add_argument('--sync-size', type=int, default=100, help="entries added before each synchronization")
+    args = parser.parse_args()
+
+    entries = DataAccessManager.load_knowledge_base_dump()[:args.kb_size]
+    if os.path.isfile(BENCHMARK_KBS_STORE_PATH):
+        os.remove(BENCHMARK_KBS_STORE_PATH)
+    store = KBStore(BENCHMARK_KBS_STORE_PATH, None)
+    store.add(entries)
+    server = LocalKBServer(store, page_size=args.page_size, latency=args.latency, error_rate=args.error_rate)
+    server.start()
+    KBS.connect(server.host, server.port, server.path)
+    # do not overwrite the real knowledge graph dump
+    DataAccessManager.KG_DUMP_PATH = "tmp/benchmark_KG_dump.bin"
+
+    downloaded, t_download = _timed(KBS.get_all_items_from, 0)
+    cleaned, t_clean = _timed(DataAccessManager._clean_downloaded_data, downloaded)
+    _, t_graph = _timed(DataAccessManager._update_graph, cleaned, len(downloaded))
+    print("{:40s} {:10.3f}s ({} of {} entries)".format("download", t_download, len(downloaded), len(entries)))
+    print("{:40s} {:10.3f}s ({} valid entries)".format("clean", t_clean, len(cleaned)))
+    print("{:40s} {:10.3f}s".format("knowledge graph construction", t_graph))
+
+    for i in range(args.syncs):
+        new_entries = entries[(i * args.sync_size) % len(entries):][:args.sync_size]
+        KBS.add_items(new_entries)
+        n, t_sync = _timed(DataAccessManager.update_knowledge_graph)
+        print("{:40s} {:10.3f}s ({} new entries)".format("sync " + str(i + 1), t_sync, n))
+
+    print("injected errors:", server.injected_errors())
+    server.stop()
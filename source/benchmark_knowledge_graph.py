@@ -0,0 +1,220 @@
+"""
+Benchmark suite for the knowledge graph operations.
+
+For each KB size, a synthetic KB is generated (with configurable number of entities,
+relations and domains, and a skewed distribution of the entities' degree), then the
+following operations are timed and their peak memory is recorded:
+    * `DataAccessManager._clean_downloaded_data`
+    * `KnowledgeGraph.update`
+    * `KnowledgeGraph.query`, with one and two entities
+    * `KnowledgeGraph.pick_entity_and_relation`
+    * pickle dump and load of the knowledge graph
+
+Results are stored as JSON, together with the commit they were measured on, so that
+runs on different commits can be compared with `--compare`.
+
+Run it from the `source` folder: ``python benchmark_knowledge_graph.py [options]``
+"""
+import argparse
+import json
+import pickle
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+from itertools import accumulate
+
+from DataAccessManager import _clean_downloaded_data
+from KnowledgeGraph import KnowledgeGraph
+
+def generate_kb(n_entries, n_entities, n_relations, n_domains, skew, invalid_rate, rng):
+    """
+    Generate a synthetic KB in the KBS entry format.
+
+    Parameters:
+    -----------
+        - `n_entries`: number of entries.
+        - `n_entities`: number of distinct concepts.
+        - `n_relations`, `n_domains`: number of distinct relations and domains.
+        - `skew`: exponent of the Zipf-like distribution used to choose the concepts
+        (0 means uniform, larger values concentrate the entries on fewer concepts).
+        - `invalid_rate`: fraction of entries with malformed concepts, which the
+        cleaning step must discard.
+        - `rng`: a `random.Random` instance.
+
+    Returns:
+    --------
+    A triple (entries, domains_to_relations, domains) where `domains_to_relations`
+    maps each domain to the set of relations it admits.
+    """
+    relations = ["relation{}".format(i) for i in range(n_relations)]
+    domains = ["domain {}".format(i) for i in range(n_domains)]
+    domains_to_relations = {d : set(rng.sample(relations, max(1, n_relations // 2))) for d in domains}
+    names = ["Concept {}".format(i) for i in range(n_entities)]
+    cum_weights = list(accumulate(1 / (i + 1) ** skew for i in range(n_entities)))
+
+    def concept():
+        i = rng.choices(range(n_entities), cum_weights=cum_weights)[0]
+        return names[i] + "::bn:{:08d}n".format(i)
+
+    entries = list()
+    for h in range(n_entries):
+        c1, c2 = concept(), concept()
+        if rng.random() < invalid_rate:
+            c2 = "Concept (invalid)::" + c2.split('::')[1]
+        relation = rng.choice(relations)
+        entries.append({
+            'question' : "What is the {} of {}?".format(relation, c1.split('::')[0]),
+            'answer' : c2.split('::')[0],
+            'relation' : relation,
+            'context' : "",
+            'domains' : [rng.choice(domains)],
+            'c1' : c1,
+            'c2' : c2,
+            'HASH' : h
+        })
+    return entries, domains_to_relations, domains
+
+def _annotation(concept):
+    """
+    returns the (dep tag, BabelFy annotation) pair used by KnowledgeGraph.query.
+    """
+    return ('nsubj', {'bab_id' : concept[concept.rfind('bn:'):], 'mention' : concept.split('::')[0]})
+
+def measure(operation, repeats, memory):
+    """
+    Time an operation and, optionally, measure its peak memory.
+
+    Parameters:
+    -----------
+        - `operation`: a function with no arguments.
+        - `repeats`: the operation is timed this many times, the best time is kept.
+        - `memory`: if True, the operation is run once more under tracemalloc (which
+        slows it down, so this run is not timed).
+
+    Returns:
+    --------
+    A pair (seconds, peak memory in bytes or None).
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        operation()
+        best = min(best, time.perf_counter() - start)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        operation()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+def run_suite(size, args, rng):
+    """
+    Run all the benchmarks on a synthetic KB of `size` entries.
+
+    Returns:
+    --------
+    A list of dictionaries, one per operation.
+    """
+    n_entities = max(2, int(size * args.entities_ratio))
+    entries, domains_to_relations, domains = generate_kb(size, n_entities, args.relations, args.domains,\
+        args.skew, args.invalid_rate, rng)
+    cleaned = _clean_downloaded_data(entries)
+
+    def build():
+        kg = KnowledgeGraph(domains_to_relations)
+        kg.update(cleaned, len(entries))
+        return kg
+
+    kg = build()
+    single = [[_annotation(e['c1'])] for e in rng.sample(cleaned, min(args.queries, len(cleaned)))]
+    couples = [[_annotation(e['c1']), _annotation(e['c2'])] for e in rng.sample(cleaned, min(args.queries, len(cleaned)))]
+    relations = list(kg.relations)
+    query_relations = [rng.sample(relations, min(3, len(relations))) for _ in range(args.queries)]
+    dumped = pickle.dumps(kg)
+
+    operations = [
+        ('clean_downloaded_data', 1, lambda: _clean_downloaded_data(entries)),
+        ('update', 1, build),
+        ('query_one_entity', len(single), lambda: [kg.query(q, r) for q, r in zip(single, query_relations)]),
+        ('query_two_entities', len(couples), lambda: [kg.query(q, r) for q, r in zip(couples, query_relations)]),
+        ('pick_entity_and_relation', args.picks, lambda: [kg.pick_entity_and_relation(rng.choice(domains))\
+            for _ in range(args.picks)]),
+        ('pickle_dump', 1, lambda: pickle.dumps(kg)),
+        ('pickle_load', 1, lambda: pickle.loads(dumped))
+    ]
+
+    results = list()
+    for name, n_ops, operation in operations:
+        seconds, peak = measure(operation, args.repeats, not args.no_memory)
+        results.append({
+            'size' : size,
+            'operation' : name,
+            'calls' : n_ops,
+            'seconds' : seconds,
+            'seconds_per_call' : seconds / n_ops if n_ops > 0 else None,
+            'peak_memory_bytes' : peak
+        })
+        print("{:>9d} {:28s} {:12.4f} {:14.7f} {:>14s}".format(size, name, seconds,\
+            results[-1]['seconds_per_call'] or 0, "-" if peak is None else "{:.1f}".format(peak / 2**20)))
+    results.append({'size' : size, 'operation' : 'dump_size', 'bytes' : len(dumped)})
+    return results
+
+def _current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old, new):
+    """
+    Print the ratio between the times of two runs, for the operations they share.
+    """
+    old_times = {(r['size'], r['operation']) : r['seconds'] for r in old['results'] if 'seconds' in r}
+    print("\nComparison with commit {}".format(old.get('commit')))
+    print("{:>9s} {:28s} {:>12s} {:>12s} {:>8s}".format("size", "operation", "old (s)", "new (s)", "ratio"))
+    for r in new['results']:
+        key = (r['size'], r['operation'])
+        if 'seconds' in r and key in old_times and old_times[key] > 0:
+            print("{:>9d} {:28s} {:12.4f} {:12.4f} {:8.2f}".format(r['size'], r['operation'], old_times[key],\
+                r['seconds'], r['seconds'] / old_times[key]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default="10000,100000,1000000", help="comma separated KB sizes")
+    parser.add_argument('--entities-ratio', type=float, default=0.3, help="distinct concepts per entry")
+    parser.add_argument('--relations', type=int, default=16)
+    parser.add_argument('--domains', type=int, default=30)
+    parser.add_argument('--skew', type=float, default=1.0, help="exponent of the concepts' degree distribution")
+    parser.add_argument('--invalid-rate', type=float, default=0.02)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--picks', type=int, default=100)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help="do not measure peak memory")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="JSON file for the results (default: tmp/benchmark_kg_<commit>.json)")
+    parser.add_argument('--compare', help="JSON results of a previous run to compare with")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    commit = _current_commit()
+    print("{:>9s} {:28s} {:>12s} {:>14s} {:>14s}".format("size", "operation", "seconds", "s/call", "peak (MiB)"))
+    results = list()
+    for size in [int(s) for s in args.sizes.split(',')]:
+        results += run_suite(size, args, rng)
+
+    report = {
+        'commit' : commit,
+        'date' : time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python' : platform.python_version(),
+        'parameters' : vars(args),
+        'results' : results
+    }
+    output = args.output or "tmp/benchmark_kg_{}.json".format((commit or "unknown")[:10])
+    json.dump(report, open(output, 'w'), indent=2)
+    print("results saved in", output)
+
+    if args.compare is not None:
+        compare(json.load(open(args.compare)), report)
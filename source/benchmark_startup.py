@@ -0,0 +1,110 @@
+"""
+Startup-time benchmark for the bot and for the question classifier process.
+
+It measures, each time in a fresh interpreter:
+    * the import time of the main modules of the application;
+    * the time needed to load the spaCy parser on first use;
+    * the time `main.py` needs before printing `Listening..`;
+    * the time the classifier process needs before accepting connections, and the
+    latency of its first prediction.
+
+Run it from the `source` folder: ``python benchmark_startup.py [-r REPEATS]``
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from statistics import median
+from Utilities import import_time, run_python_script
+
+MODULES = ['SentenceAnalysis', 'Brain', 'Chatbot', 'DataAccessManager', 'QuestionClassifier', 'main']
+
+_PARSER_SCRIPT = """
+import time
+from SentenceAnalysis import get_dep_parser
+t = time.perf_counter()
+get_dep_parser()('What color is the sky?')
+print('RESULT', time.perf_counter() - t)
+"""
+
+_CLASSIFIER_SCRIPT = """
+import socket
+import time
+from multiprocessing import Process
+t = time.perf_counter()
+from main import start_question_classifier_server
+from RemoteClassifier import remote_predict
+p = Process(target=start_question_classifier_server, args=('localhost', {port}))
+p.start()
+while True:
+    try:
+        socket.create_connection(('localhost', {port})).close()
+        break
+    except OSError:
+        time.sleep(0.05)
+ready = time.perf_counter() - t
+t = time.perf_counter()
+remote_predict('What color is the sky?', 'localhost', {port})
+first = time.perf_counter() - t
+p.terminate()
+print('RESULT', ready, first)
+"""
+
+def _free_port():
+    s = socket.socket()
+    s.bind(('localhost', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def time_main_startup(timeout=300):
+    """
+    Start `main.py` and measure the time until it prints `Listening..`.
+
+    Returns:
+    --------
+    The elapsed time in seconds, or `None` if the bot did not start within `timeout`.
+    """
+    t = time.perf_counter()
+    p = subprocess.Popen([sys.executable, '-u', 'main.py'], stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL, start_new_session=True)
+    elapsed = None
+    try:
+        for line in p.stdout:
+            if b'Listening..' in line:
+                elapsed = time.perf_counter() - t
+                break
+            if time.perf_counter() - t > timeout:
+                break
+    finally:
+        # main.py forks the classifier process, stop the whole group
+        os.killpg(p.pid, signal.SIGTERM)
+        p.wait()
+    return elapsed
+
+def _report(name, values):
+    values = [v for v in values if v is not None]
+    if len(values) == 0:
+        print("{:40s} {:>10s}".format(name, "failed"))
+        return
+    print("{:40s} {:10.3f} {:10.3f} {:10.3f}".format(name, min(values), median(values), max(values)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-r', '--repeats', type=int, default=5, help="number of runs per measure")
+    args = parser.parse_args()
+
+    print("{:40s} {:>10s} {:>10s} {:>10s}".format("Measure (seconds)", "min", "median", "max"))
+    for module in MODULES:
+        _report("import " + module, [import_time("import " + module) for _ in range(args.repeats)])
+
+    _report("spaCy parser first use", [run_python_script(_PARSER_SCRIPT)[0] for _ in range(args.repeats)])
+
+    classifier = [run_python_script(_CLASSIFIER_SCRIPT.format(port=_free_port())) for _ in range(args.repeats)]
+    _report("classifier process ready", [c[0] for c in classifier])
+    _report("classifier first prediction", [c[1] for c in classifier])
+
+    _report("main.py until 'Listening..'", [time_main_startup() for _ in range(args.repeats)])
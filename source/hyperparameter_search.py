@@ -0,0 +1,182 @@
+"""
+Hyperparameter search for the LSTM question classifier.
+
+Each configuration of a grid of LSTM parameters is trained on the training split
+produced by `QuestionClassifier._build_training_validation_test_sets`, with early
+stopping on the dev split, in a pool of worker processes. The workers open the
+vectorized splits memory-mapped (see `QuestionClassifier.load_dataset`), so they
+share a single copy of the data through the page cache.
+
+For each configuration, the accuracy on the dev split, the training time and the
+latency of a single prediction are reported, and all the results are saved as JSON.
+
+Run it from the `source` folder: ``python hyperparameter_search.py [options]``
+
+The grid is a JSON object mapping LSTM parameter names (see
+`LSTMSentenceClassifier.default_lstm_params`) to lists of values; the parameters not
+in the grid keep their default value.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from statistics import median
+import numpy
+from Settings import TMP_QC_PREFIX
+from Utilities import limit_cpu_threads
+
+SEARCH_PREFIX = TMP_QC_PREFIX + "search_"
+
+DEFAULT_GRID = {
+    'lstm_units' : [50, 100, 200],
+    'dropout' : [0.1, 0.3],
+    'optimizer' : ['adagrad', 'adam'],
+    'batch_size' : [40, 128]
+}
+
+# threads each worker may use, set by _init_worker
+_worker_threads = 0
+
+def _init_worker(threads):
+    """
+    Limit the threads used by each worker, so that the workers do not compete for
+    the same cores. It runs before keras is imported in the worker.
+    """
+    global _worker_threads
+    _worker_threads = threads
+    limit_cpu_threads(threads)
+
+def run_trial(trial, params, patience, latency_samples):
+    """
+    Train and evaluate a configuration. It runs in a worker process.
+
+    Parameters:
+    -----------
+        - `trial`: number of the configuration.
+        - `params`: the LSTM parameters.
+        - `patience`: epochs without improvement on the dev split before stopping.
+        - `latency_samples`: number of single-question predictions timed.
+
+    Returns:
+    --------
+    A dictionary with the parameters and the measures.
+    """
+    from LSTMSentenceClassifier import LSTMSentenceClassifier
+    from QuestionClassifier import load_dataset
+    global _worker_threads
+    if _worker_threads > 0:
+        # now that tensorflow is imported, limit its threads as well (once per worker)
+        limit_cpu_threads(_worker_threads, 1)
+        _worker_threads = 0
+
+    I, Y = load_dataset('training')
+    I_dev, Y_dev = load_dataset('dev')
+    clf = LSTMSentenceClassifier(pickle.load(open(TMP_QC_PREFIX + "bow.bin", 'rb')))
+    clf.set_label_mapping(pickle.load(open(TMP_QC_PREFIX + "labelMapping.bin", 'rb')))
+
+    start = time.perf_counter()
+    history = clf.train_LSTM_model_on_indexes(I, Y, params, (I_dev, Y_dev), patience, verbose=0)
+    training_time = time.perf_counter() - start
+
+    known = numpy.flatnonzero(numpy.asarray(Y_dev) >= 0)
+    correct = 0
+    for i in range(0, len(known), 4096):
+        batch = known[i:i + 4096]
+        predicted = numpy.argmax(clf.predict_proba(clf.indexes_to_input(I_dev[batch])), axis=1)
+        correct += int((predicted == Y_dev[batch]).sum())
+    accuracy = correct / max(1, len(known)) * 100
+
+    latencies = list()
+    for i in known[:latency_samples]:
+        X = clf.indexes_to_input(I_dev[i:i + 1])
+        start = time.perf_counter()
+        clf.model.predict(X)
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        'trial' : trial,
+        'params' : params,
+        'epochs' : len(history.history['loss']),
+        # the epoch whose weights were kept and measured
+        'best_epoch' : int(numpy.argmin(history.history['val_loss'])) + 1,
+        'dev_accuracy' : accuracy,
+        'training_seconds' : training_time,
+        'latency_ms' : median(latencies) * 1000 if len(latencies) > 0 else None
+    }
+
+def configurations(grid, base_params):
+    """
+    returns the list of all the combinations of the values in `grid`, each one as a
+    complete dictionary of LSTM parameters.
+    """
+    names = sorted(grid.keys())
+    result = list()
+    for values in itertools.product(*[grid[n] for n in names]):
+        params = dict(base_params)
+        params.update(zip(names, values))
+        result.append(params)
+    return result
+
+def print_results(results, grid):
+    names = sorted(grid.keys())
+    print("{:>5s} {} {:>6s} {:>9s} {:>10s} {:>11s}".format("trial", " ".join("{:>14s}".format(n) for n in names),\
+        "epochs", "dev acc%", "train (s)", "latency ms"))
+    for r in sorted(results, key=lambda r: r['dev_accuracy'], reverse=True):
+        print("{:5d} {} {:6d} {:9.3f} {:10.1f} {:>11s}".format(r['trial'],\
+            " ".join("{:>14s}".format(str(r['params'][n])) for n in names), r['epochs'], r['dev_accuracy'],\
+            r['training_seconds'], "-" if r['latency_ms'] is None else "{:.2f}".format(r['latency_ms'])))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--grid', help="JSON file with the grid of parameters (default: a small built-in grid)")
+    parser.add_argument('--workers', type=int, default=max(1, os.cpu_count() // 4), help="concurrent trainings")
+    parser.add_argument('--threads-per-worker', type=int, default=4, help="0 means no limit")
+    parser.add_argument('--max-epochs', type=int, default=30)
+    parser.add_argument('--patience', type=int, default=2, help="epochs without improvement before stopping")
+    parser.add_argument('--latency-samples', type=int, default=200)
+    parser.add_argument('--output', default=SEARCH_PREFIX + "results.json")
+    args = parser.parse_args()
+
+    from LSTMSentenceClassifier import LSTMSentenceClassifier
+    from QuestionClassifier import load_dataset
+
+    grid = json.load(open(args.grid)) if args.grid is not None else DEFAULT_GRID
+    # build or refresh the vectorized splits once, before the workers open them
+    load_dataset('training')
+    load_dataset('dev')
+
+    base_params = dict(LSTMSentenceClassifier(pickle.load(open(TMP_QC_PREFIX + "bow.bin", 'rb'))).default_lstm_params)
+    base_params['epochs'] = args.max_epochs
+    trials = configurations(grid, base_params)
+    print("{} configurations, {} workers".format(len(trials), args.workers))
+
+    results = list()
+    failed = list()
+    # keras and tensorflow are not safe to use after a fork: start fresh workers
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context, initializer=_init_worker,\
+        initargs=(args.threads_per_worker,)) as executor:
+        futures = [executor.submit(run_trial, i, params, args.patience, args.latency_samples)\
+            for i, params in enumerate(trials)]
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # the other trials go on, and their results are saved anyway
+                trial = futures.index(future)
+                failed.append(trial)
+                print("trial {} failed: {!r}".format(trial, e))
+                continue
+            results.append(result)
+            print("trial {} done: {:.3f}% in {:.1f}s".format(result['trial'], result['dev_accuracy'],\
+                result['training_seconds']))
+
+    print_results(results, grid)
+    json.dump(results, open(args.output, 'w'), indent=2)
+    print("results saved in", args.output)
+    if len(failed) > 0:
+        print("failed trials:", " ".join(str(t) for t in sorted(failed)))
@@ -9,42 +9,77 @@ QuestionClassifier server (assign to each question a relation)
 and the other handles messages from users. They interact using a simple
 protocol over TCP.
 """
+import logging
+import os
 import sys
 import time
+from threading import Thread
 import telepot
 from telepot.loop import MessageLoop
 from telepot.delegate import pave_event_space, per_chat_id, create_open
 from multiprocessing.context import Process
 
 import DataAccessManager
-from Chatbot import Chatbot
-from QuestionClassifier import get_question_classifier
+import Chatbot
+import Metrics
+from QuestionClassifier import question_classifier_version, load_question_classifier
+from LinearClassifier import FALLBACK_MODEL_PATH, train_fallback_classifier
 from RemoteClassifier import RemoteClassifierServer
-from Settings import QuestionClassifierServer_Host, QuestionClassifierServer_Port, TelegramBotToken
+from SentenceAnalysis import get_dep_parser
+from Utilities import limit_cpu_threads
+from Settings import QuestionClassifierServer_Host, QuestionClassifierServer_Port, TelegramBotToken,\
+    CHATBOT_ASYNC, LOG_LEVEL, METRICS_HOST, METRICS_PORT, METRICS_SUMMARY_INTERVAL, QC_RELOAD_INTERVAL,\
+    QC_INTRA_OP_THREADS, QC_INTER_OP_THREADS
 
 
 def start_question_classifier_server(host, port):
     """
     start the process that hosts the question classifier server.
     """
-    qc = get_question_classifier()
+    limit_cpu_threads(QC_INTRA_OP_THREADS, QC_INTER_OP_THREADS)
+    qc = load_question_classifier()
+    if not os.path.isfile(FALLBACK_MODEL_PATH):
+        # the bot process uses the linear classifier as soon as it is saved
+        Thread(target=train_fallback_classifier, kwargs={'verbose' : 0}, daemon=True).start()
     rc = RemoteClassifierServer(qc, host, port)
+    if QC_RELOAD_INTERVAL > 0:
+        # a retrained model is picked up without restarting the server
+        rc.watch_classifier(question_classifier_version, load_question_classifier, QC_RELOAD_INTERVAL)
     rc.activate()
 
 if __name__ == "__main__":
 
+    logging.basicConfig(level=LOG_LEVEL, stream=sys.stdout,\
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
     # Start question classifier process
     p = Process(target=start_question_classifier_server, args=(QuestionClassifierServer_Host, QuestionClassifierServer_Port,))
     p.start()
+
+    # the spaCy model is only needed in this process: load it now that the classifier
+    # process has been forked, while the knowledge graph is being loaded.
+    Thread(target=get_dep_parser, daemon=True).start()
     
     # load database
     DataAccessManager.initialize_knowledge_graph()
-    bot = telepot.DelegatorBot(TelegramBotToken, [ pave_event_space()(per_chat_id(), create_open, Chatbot, timeout=1000), ])
-    MessageLoop(bot).run_as_thread()
+    Metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+    if METRICS_SUMMARY_INTERVAL > 0:
+        Metrics.start_summary_logger(METRICS_SUMMARY_INTERVAL)
+
+    Chatbot.sessions.load()
+    if CHATBOT_ASYNC:
+        # a single thread receives all the messages, replies are computed by the worker pool
+        bot = telepot.Bot(TelegramBotToken)
+        MessageLoop(bot, Chatbot.message_handler(bot)).run_as_thread()
+    else:
+        bot = telepot.DelegatorBot(TelegramBotToken, [ pave_event_space()(per_chat_id(), create_open, Chatbot.Chatbot, timeout=1000), ])
+        MessageLoop(bot).run_as_thread()
     print('Listening..')
 
     try:
         while 1:
             time.sleep(10)
+            Chatbot.sessions.save()
     except KeyboardInterrupt:
+        Chatbot.sessions.save()
         sys.exit()
\ No newline at end of file
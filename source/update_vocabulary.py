@@ -0,0 +1,34 @@
+"""
+Update the bag of words of the question classifier with the questions of the KBS
+entries added after the local dump (see QuestionClassifier.update_bag_of_words).
+
+The new bag of words is used from the next training of the classifier, which can be
+started right away with --train. The entries are added to the word counts each time
+the script is run, so a range of entries must not be passed twice.
+
+Run it from the `source` folder:
+``python update_vocabulary.py [--from ID] [--train]``
+"""
+import argparse
+import DataAccessManager
+import KnowledgeBaseServer as KBS
+from QuestionClassifier import QuestionClassifier, update_bag_of_words
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--from', dest='start_id', type=int, default=None,\
+        help="ID of the first new entry (default: the number of entries in the KB dump)")
+    parser.add_argument('--train', action='store_true', help="train the classifier with the new bag of words")
+    args = parser.parse_args()
+
+    start_id = args.start_id
+    if start_id is None:
+        start_id = len(DataAccessManager.load_knowledge_base_dump())
+    entries = KBS.get_all_items_from(start_id)
+    if len(entries) == 0:
+        print("no new entries from {}".format(start_id))
+    else:
+        update_bag_of_words(entries)
+        print("bag of words updated with {} entries, starting from {}".format(len(entries), start_id))
+    if args.train:
+        QuestionClassifier().train_model()